@@ -1,5 +1,12 @@
-from django.contrib import admin
+import json
 
+from django.conf import settings
+from django.contrib import admin, messages
+from django.utils import timezone
+from django.utils.html import format_html
+
+from paypal import plans as active_plans
+from paypal.entitlements import annotate_has_subscription
 from paypal.models import (
     Product,
     BillingPlan,
@@ -9,8 +16,13 @@ from paypal.models import (
     PaymentPreference,
     Amount,
     Subscription,
-    PayPalProfile
+    PayPalProfile,
+    OutboxMessage,
+    WebhookEvent,
+    Order,
+    Capture
 )
+from paypal.serializers import build_plan_data, plan_queryset
 
 
 @admin.register(Product)
@@ -80,6 +92,7 @@ class PaymentPreferenceInline(admin.StackedInline):
 class BillingPlanAdmin(admin.ModelAdmin):
     list_filter = ['status']
     list_display = ['name', 'plan_id', 'product', 'status']
+    list_select_related = ['product']
     actions = ['activate', 'deactivate']
     inlines = [BillingCycleInline, PaymentPreferenceInline]
 
@@ -87,23 +100,74 @@ class BillingPlanAdmin(admin.ModelAdmin):
         if obj:
             return [
                 'name', 'status', 'plan_id', 'product', 'quantity_supported', 'create_time', 'update_time',
-                'links'
+                'links', 'paypal_data'
             ]
         return ['plan_id', 'quantity_supported', 'create_time', 'update_time', 'links']
 
-    def activate(self, request, queryset):
+    def paypal_data(self, obj: BillingPlan):
+        # The create request body for this plan, as the outbox worker sends it
+        plan = plan_queryset().filter(pk=obj.pk).first()
+        if plan is None or not plan.product_id or not hasattr(plan, 'payment_preferences'):
+            return '-'
+        return format_html('<pre>{}</pre>', json.dumps(build_plan_data(plan), indent=2))
+
+    paypal_data.short_description = 'PayPal data'
+
+    def set_status(self, request, queryset, active: bool):
+        from paypal.outbox import enqueue_many
         from paypal.utils.billing_plan import PayPalBillingPlan
-        paypal_helper = PayPalBillingPlan()
-        for plan in queryset:
-            paypal_helper.activate_billing_plan(plan.plan_id)
-        queryset.update(status='ACTIVE')
+
+        status = BillingPlan.BillingPlanStatus.ACTIVE if active else BillingPlan.BillingPlanStatus.INACTIVE
+        # The changelist selects the product, which only() would defer
+        plans = list(queryset.select_related(None).only('id', 'name', 'plan_id'))
+        missing = [plan for plan in plans if not plan.plan_id]
+        plans = [plan for plan in plans if plan.plan_id]
+
+        if missing:
+            self.message_user(
+                request,
+                f"Skipped {len(missing)} plans not created on PayPal yet: {', '.join(p.name for p in missing[:20])}",
+                messages.WARNING
+            )
+        if not plans:
+            return
+
+        # Large selections are sent from the outbox so the request doesn't wait on hundreds of PayPal calls
+        if len(plans) > getattr(settings, 'PAYPAL_ADMIN_SYNC_LIMIT', 50):
+            action = OutboxMessage.Action.ACTIVATE_PLAN if active else OutboxMessage.Action.DEACTIVATE_PLAN
+            enqueue_many(action, plans)
+            self.message_user(
+                request,
+                f"Queued {len(plans)} plans, their status changes once PayPal confirms each one",
+                messages.INFO
+            )
+            return
+
+        results = PayPalBillingPlan().set_billing_plan_statuses(
+            [plan.plan_id for plan in plans],
+            active,
+            concurrency=getattr(settings, 'PAYPAL_ADMIN_CONCURRENCY', 8)
+        )
+        succeeded = [plan.id for plan in plans if results[plan.plan_id].ok]
+        failed = [plan for plan in plans if not results[plan.plan_id].ok]
+        BillingPlan.objects.filter(id__in=succeeded).update(status=status)
+        active_plans.invalidate()
+
+        if succeeded:
+            self.message_user(request, f"{len(succeeded)} plans set to {status.label}", messages.SUCCESS)
+        for plan in failed:
+            result = results[plan.plan_id]
+            self.message_user(
+                request,
+                f"{plan.name} ({plan.plan_id}) | {result.status_code} {result.data.get('message', '')}",
+                messages.ERROR
+            )
+
+    def activate(self, request, queryset):
+        self.set_status(request, queryset, active=True)
 
     def deactivate(self, request, queryset):
-        from paypal.utils.billing_plan import PayPalBillingPlan
-        paypal_helper = PayPalBillingPlan()
-        for plan in queryset:
-            paypal_helper.deactivate_billing_plan(plan.plan_id)
-        queryset.update(status='INACTIVE')
+        self.set_status(request, queryset, active=False)
 
     activate.short_description = 'Activate selected plans'
     deactivate.short_description = 'Deactivate selected plans'
@@ -112,10 +176,10 @@ class BillingPlanAdmin(admin.ModelAdmin):
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_filter = ['status', 'shipping_amount']
-    list_display = ['user', 'plan', 'subscription_id', 'status', 'shipping_amount']
+    list_display = ['user', 'plan', 'subscription_id', 'status', 'next_billing_time', 'synced_at']
     readonly_fields = [
         'user', 'plan', 'subscription_id', 'status', 'start_time', 'create_time', 'update_time',
-        'billing_info', 'links', 'shipping_amount'
+        'billing_info', 'next_billing_time', 'links', 'shipping_amount', 'synced_at'
     ]
 
     def has_delete_permission(self, request, obj=None):
@@ -128,8 +192,83 @@ class SubscriptionAdmin(admin.ModelAdmin):
 @admin.register(PayPalProfile)
 class PayPalProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'subscription_valid_till', 'has_subscription']
+    list_select_related = ['user']
+
+    def get_queryset(self, request):
+        return annotate_has_subscription(super().get_queryset(request))
 
     def has_subscription(self, obj: PayPalProfile):
-        return obj.has_subscription
+        return obj.has_subscription_now
 
     has_subscription.boolean = True
+    has_subscription.admin_order_field = 'subscription_valid_till'
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_filter = ['status', 'action']
+    list_display = ['action', 'object_type', 'object_id', 'status', 'attempts', 'next_attempt_at', 'modified_date']
+    readonly_fields = [
+        'action', 'object_type', 'object_id', 'payload', 'request_id', 'status', 'attempts', 'next_attempt_at',
+        'last_error'
+    ]
+    actions = ['retry']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def retry(self, request, queryset):
+        queryset.exclude(status=OutboxMessage.Status.DONE).update(
+            status=OutboxMessage.Status.PENDING,
+            attempts=0,
+            next_attempt_at=timezone.now()
+        )
+
+    retry.short_description = 'Retry selected messages'
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    search_fields = ['event_id', 'resource_id']
+    list_filter = ['status', 'event_type']
+    list_display = ['event_type', 'resource_id', 'status', 'attempts', 'event_time', 'processed_at']
+    readonly_fields = [
+        'event_id', 'event_type', 'resource_type', 'resource_id', 'payload', 'event_time', 'status', 'attempts',
+        'processed_at', 'last_error'
+    ]
+    actions = ['reprocess']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def reprocess(self, request, queryset):
+        from paypal.webhook.processor import process_in_background
+        queryset.exclude(status=WebhookEvent.Status.PROCESSING).update(status=WebhookEvent.Status.RECEIVED)
+        process_in_background()
+
+    reprocess.short_description = 'Process selected events again'
+
+
+class CaptureInline(admin.TabularInline):
+    model = Capture
+    extra = 0
+    can_delete = False
+    readonly_fields = ['capture_id', 'status', 'currency_code', 'value', 'create_time']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    search_fields = ['order_id', 'request_id']
+    list_filter = ['status', 'currency_code']
+    list_display = ['order_id', 'user', 'status', 'currency_code', 'value', 'created_date']
+    list_select_related = ['user']
+    readonly_fields = [
+        'user', 'order_id', 'request_id', 'status', 'currency_code', 'value', 'items', 'links', 'last_error'
+    ]
+    inlines = [CaptureInline]
+
+    def has_add_permission(self, request, obj=None):
+        return False
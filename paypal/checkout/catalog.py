@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Checkout items are priced here, never from the request. PAYPAL_CHECKOUT_CATALOG is the dotted path of a
+# function (skus) -> {sku: {"name", "unit_amount", "currency_code"[, "description", "category"]}} that returns
+# the items it knows, the default reads them from the PAYPAL_CHECKOUT_ITEMS setting.
+
+
+def get_settings_items(skus: list) -> dict:
+    items = getattr(settings, 'PAYPAL_CHECKOUT_ITEMS', {})
+    return {sku: items[sku] for sku in skus if sku in items}
+
+
+def get_catalog_items(skus: list) -> dict:
+    loader = import_string(getattr(settings, 'PAYPAL_CHECKOUT_CATALOG', 'paypal.checkout.catalog.get_settings_items'))
+    return loader(skus)
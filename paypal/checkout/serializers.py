@@ -0,0 +1,92 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+
+from paypal.checkout.catalog import get_catalog_items
+from paypal.models import Order
+from paypal.utils.order import format_amount, get_items_total
+from paypal.utils.response import loads
+
+MAX_ITEMS = 100
+MAX_QUANTITY = 10000
+MAX_VALUE = Decimal('9999999999.99')
+
+
+def parse_item(item, index: int) -> tuple:
+    # (sku, quantity) of a requested item, everything else the client sends is ignored
+    if not isinstance(item, dict) or not str(item.get('sku') or '').strip():
+        raise ValidationError(f"items[{index}] needs a sku")
+    try:
+        quantity = int(item.get('quantity', 1))
+    except (TypeError, ValueError):
+        raise ValidationError(f"items[{index}].quantity must be an integer")
+    if not 0 < quantity <= MAX_QUANTITY:
+        raise ValidationError(f"items[{index}].quantity must be between 1 and {MAX_QUANTITY}")
+    return str(item['sku']).strip(), quantity
+
+
+def price_item(sku: str, quantity: int, entry: dict) -> dict:
+    item = {
+        "sku": sku,
+        "name": str(entry['name'])[:127],
+        "quantity": quantity,
+        "unit_amount": format_amount(entry['unit_amount'], entry['currency_code'])
+    }
+    for key in ("description", "category"):
+        if entry.get(key):
+            item[key] = str(entry[key])[:127]
+    return item
+
+
+def parse_order_request(body: bytes, get_items=get_catalog_items) -> dict:
+    """
+    Maps a create order request {"items": [{"sku", "quantity"}]} to Order fields.
+    Names, prices and the currency come from the catalog (paypal.checkout.catalog), the client only picks skus.
+    """
+    try:
+        data = loads(body or b'{}')
+    except ValueError:
+        raise ValidationError("Body is not valid JSON")
+    if not isinstance(data, dict):
+        raise ValidationError("Body must be a JSON object")
+
+    items = data.get('items')
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_ITEMS:
+        raise ValidationError(f"items must be a list of 1 to {MAX_ITEMS} items")
+    requested = [parse_item(item, index) for index, item in enumerate(items)]
+
+    catalog = get_items(list({sku for sku, quantity in requested}))
+    unknown = [sku for sku, quantity in requested if sku not in catalog]
+    if unknown:
+        raise ValidationError(f"Unknown sku: {', '.join(unknown[:10])}")
+    currency_codes = {catalog[sku]['currency_code'] for sku, quantity in requested}
+    if len(currency_codes) > 1:
+        raise ValidationError("All items must be priced in the same currency")
+
+    currency_code = currency_codes.pop()
+    items = [price_item(sku, quantity, catalog[sku]) for sku, quantity in requested]
+    value = get_items_total(items, currency_code)
+    if not 0 < value <= MAX_VALUE:
+        raise ValidationError(f"Order total must be positive and at most {MAX_VALUE}")
+    return {"currency_code": currency_code, "value": value, "items": items}
+
+
+def build_order_response(order: Order, captures: list = None) -> dict:
+    data = {
+        "id": order.order_id,
+        "request_id": order.request_id,
+        "status": order.status,
+        "currency_code": order.currency_code,
+        "value": format_amount(order.value, order.currency_code),
+        "links": order.links,
+    }
+    if captures is not None:
+        data["captures"] = [
+            {
+                "id": capture.capture_id,
+                "status": capture.status,
+                "currency_code": capture.currency_code,
+                "value": format_amount(capture.value, capture.currency_code)
+            } for capture in captures
+        ]
+    return data
@@ -0,0 +1,159 @@
+from decimal import Decimal
+
+import requests
+from django.db import transaction, IntegrityError
+from django.utils.dateparse import parse_datetime
+
+from paypal.models import Order, Capture
+from paypal.utils.base import UpdateResult, get_base_url
+from paypal.utils.order import PayPalOrder
+from paypal.utils.response import OrderView
+from paypal.utils.throttle import RateLimited, CircuitOpen
+
+OrderStatus = Order.OrderStatus
+
+# One helper per base URL, building a PayPalHelper per request costs more than the PayPal call on a warm pool
+_helpers = {}
+
+
+class CheckoutError(Exception):
+    def __init__(self, message: str, status_code: int = 502, data: dict = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.data = data or {}
+
+
+class OrderConflict(CheckoutError):
+    # The request id belongs to a different order (other amount or user)
+    def __init__(self, message: str):
+        super().__init__(message, 409)
+
+
+def get_helper() -> PayPalOrder:
+    base_url = get_base_url()
+    helper = _helpers.get(base_url)
+    if helper is None:
+        helper = _helpers[base_url] = PayPalOrder()
+    return helper
+
+
+def get_error_message(result: UpdateResult) -> str:
+    data = result.data if isinstance(result.data, dict) else {}
+    details = data.get('details') or [{}]
+    return details[0].get('issue') or data.get('message') or f"PayPal answered {result.status_code}"
+
+
+def call_paypal(call, *args, **kwargs) -> UpdateResult:
+    try:
+        return call(*args, **kwargs)
+    except (RateLimited, CircuitOpen) as e:
+        # Not sent to PayPal, the client may retry later with the same PayPal-Request-Id
+        raise CheckoutError(f"{type(e).__name__} | {e}", 503)
+    except requests.RequestException as e:
+        raise CheckoutError(f"{type(e).__name__} | {e}")
+
+
+def get_or_create_order(request_id: str, currency_code: str, value: Decimal, items: list, user=None):
+    try:
+        with transaction.atomic():
+            return Order.objects.create(
+                request_id=request_id,
+                user=user,
+                currency_code=currency_code,
+                value=value,
+                items=items
+            ), True
+    except IntegrityError:
+        order = Order.objects.get(request_id=request_id)
+
+    if order.user_id != (user.pk if user else None) or order.currency_code != currency_code or order.value != value:
+        raise OrderConflict("PayPal-Request-Id was already used for another order")
+    return order, False
+
+
+def create_order(request_id: str, currency_code: str, value: Decimal, items: list = None, user=None):
+    """
+    Creates the order on PayPal once per request_id and returns (order, created).
+    A retried request gets the stored order back. If the first attempt never got an answer from PayPal,
+    the call is repeated with the same PayPal-Request-Id, so PayPal returns the order it may already have created.
+    """
+    order, created = get_or_create_order(request_id, currency_code, value, items or [], user)
+    if order.order_id:
+        return order, created
+    if order.status == OrderStatus.FAILED:
+        raise CheckoutError(order.last_error, 422)
+
+    result = call_paypal(
+        get_helper().create_order,
+        value,
+        currency_code,
+        items=order.items,
+        custom_id=str(user.pk) if user else None,
+        request_id=order.request_id
+    )
+    if not result.ok:
+        message = get_error_message(result)
+        if 400 <= result.status_code < 500 and result.status_code not in (401, 429):
+            # PayPal replays the same error for this request id, retrying can't succeed
+            order.status = OrderStatus.FAILED
+            order.last_error = message
+            order.save(update_fields=['status', 'last_error', 'modified_date'])
+            raise CheckoutError(message, 422, result.data)
+        raise CheckoutError(message, 502, result.data)
+
+    view = OrderView(result.data)
+    order.order_id = view.id
+    order.status = view.status or OrderStatus.CREATED
+    order.links = view.links
+    order.save(update_fields=['order_id', 'status', 'links', 'modified_date'])
+    return order, created
+
+
+def apply_order(order: Order, view: OrderView) -> list:
+    # Stores the status and captures of a PayPal order, returns the order's captures
+    captures = [
+        Capture(
+            order=order,
+            capture_id=capture.id,
+            status=capture.status,
+            currency_code=capture.currency_code or order.currency_code,
+            value=order.value if capture.value is None else capture.value,
+            create_time=parse_datetime(capture.create_time or '')
+        ) for capture in view.captures
+    ]
+
+    with transaction.atomic():
+        # Captures are unique, a capture stored by a concurrent request is kept
+        Capture.objects.bulk_create(captures, ignore_conflicts=True)
+        order.status = view.status or order.status
+        order.links = view.links or order.links
+        order.save(update_fields=['status', 'links', 'modified_date'])
+    return captures
+
+
+def capture_order(order: Order) -> list:
+    """
+    Captures the payment of an approved order and returns its captures.
+    The capture is sent with a PayPal-Request-Id derived from the order, a retried or concurrent capture of
+    the same order gets PayPal's first answer back instead of charging twice.
+    """
+    if order.status == OrderStatus.COMPLETED:
+        return list(order.captures.all())
+    if not order.order_id:
+        raise CheckoutError("Order is not created on PayPal yet", 409)
+
+    helper = get_helper()
+    result = call_paypal(helper.capture_order, order.order_id, request_id=f"{order.request_id}:capture")
+    if result.ok:
+        return apply_order(order, OrderView(result.data))
+
+    if result.status_code == 422:
+        # Typically ORDER_ALREADY_CAPTURED by an earlier attempt, take PayPal's state of the order
+        try:
+            data = helper.get_order(order.order_id)
+        except (requests.RequestException, ValueError) as e:
+            raise CheckoutError(f"{type(e).__name__} | {e}")
+        if data.get('status') == OrderStatus.COMPLETED:
+            return apply_order(order, OrderView(data))
+        raise CheckoutError(get_error_message(result), 422, result.data)
+    raise CheckoutError(get_error_message(result), 502, result.data)
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from paypal.checkout.views import OrderCreateView, OrderCaptureView
+
+app_name = 'paypal-checkout'
+
+urlpatterns = [
+    path('orders/', OrderCreateView.as_view(), name='create-order'),
+    path('orders/<str:order_id>/capture/', OrderCaptureView.as_view(), name='capture-order')
+]
@@ -0,0 +1,69 @@
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.views.generic import View
+
+from paypal.checkout.serializers import parse_order_request, build_order_response
+from paypal.checkout.service import CheckoutError, create_order, capture_order
+from paypal.models import Order
+
+
+def error_response(message: str, status: int, details: list = None) -> JsonResponse:
+    # One shape for every checkout error: {"error": message, "details": [{"issue"?, "description"}]}
+    return JsonResponse({"error": message, "details": details or []}, status=status)
+
+
+def checkout_error_response(error: CheckoutError) -> JsonResponse:
+    return error_response(str(error), error.status_code, error.data.get('details', []))
+
+
+def validation_error_response(error: ValidationError) -> JsonResponse:
+    details = [{"issue": "INVALID_REQUEST", "description": message} for message in error.messages]
+    return error_response(error.messages[0], 400, details)
+
+
+class OrderCreateView(View):
+    """
+    Creates a PayPal order for the JS SDK's createOrder callback.
+    Clients send a PayPal-Request-Id header and reuse it when they retry, the order is then only created once.
+    """
+    http_method_names = ['post']
+
+    def get_order_data(self, request) -> dict:
+        # Items are priced from the catalog, see paypal.checkout.catalog
+        return parse_order_request(request.body)
+
+    def post(self, request, *args, **kwargs):
+        request_id = request.headers.get('PayPal-Request-Id') or str(uuid.uuid4())
+        if len(request_id) > Order._meta.get_field('request_id').max_length:
+            return error_response("PayPal-Request-Id is too long", 400)
+
+        try:
+            data = self.get_order_data(request)
+        except ValidationError as e:
+            return validation_error_response(e)
+
+        user = request.user if request.user.is_authenticated else None
+        try:
+            order, created = create_order(request_id, user=user, **data)
+        except CheckoutError as e:
+            return checkout_error_response(e)
+        return JsonResponse(build_order_response(order), status=201 if created else 200)
+
+
+class OrderCaptureView(View):
+    # Captures the order once the buyer approved it (the JS SDK's onApprove callback)
+    http_method_names = ['post']
+
+    def post(self, request, order_id, *args, **kwargs):
+        order = Order.objects.filter(order_id=order_id).first()
+        user_id = request.user.pk if request.user.is_authenticated else None
+        if order is None or order.user_id != user_id:
+            return error_response("Order not found", 404)
+
+        try:
+            captures = capture_order(order)
+        except CheckoutError as e:
+            return checkout_error_response(e)
+        return JsonResponse(build_order_response(order, captures))
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import BooleanField, Case, Value, When
+from django.db.models.functions import Now
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from paypal.models import PayPalProfile
+
+# Cached per user: the POSIX timestamp of PayPalProfile.subscription_valid_till, 0 without a subscription.
+# Expiry is evaluated on read, so an entry only has to be dropped when the validity itself changes.
+
+
+def get_cache():
+    return caches[getattr(settings, 'PAYPAL_ENTITLEMENT_CACHE', 'default')]
+
+
+def get_cache_key(user_id) -> str:
+    return f"paypal:entitlement:{user_id}"
+
+
+def get_valid_till(user_id) -> float:
+    cache = get_cache()
+    key = get_cache_key(user_id)
+    valid_till = cache.get(key)
+    if valid_till is None:
+        value = PayPalProfile.objects.filter(user_id=user_id).values_list('subscription_valid_till', flat=True).first()
+        valid_till = value.timestamp() if value else 0
+        cache.set(key, valid_till, getattr(settings, 'PAYPAL_ENTITLEMENT_CACHE_TTL', 60 * 60))
+    return valid_till
+
+
+def has_subscription(user) -> bool:
+    if user is None or not user.is_authenticated:
+        return False
+    return get_valid_till(user.pk) > timezone.now().timestamp()
+
+
+def invalidate(*user_ids):
+    # Needed wherever subscription_valid_till changes without PayPalProfile.save() (bulk_update, update()).
+    # Deferred to commit, a reader could otherwise cache the old value again before the new one is visible.
+    keys = [get_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def annotate_has_subscription(queryset, valid_till_field: str = 'subscription_valid_till'):
+    """
+    Adds a `has_subscription_now` boolean computed by the database, for list views over profiles
+    (or users with valid_till_field='paypal_profile__subscription_valid_till').
+    """
+    return queryset.annotate(
+        has_subscription_now=Case(
+            When(**{f"{valid_till_field}__gt": Now()}, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        )
+    )
+
+
+class EntitlementMiddleware:
+    """
+    Sets request.has_subscription, resolved at most once per request and only if something reads it.
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.has_subscription = SimpleLazyObject(lambda: has_subscription(request.user))
+        return self.get_response(request)
@@ -0,0 +1,744 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta, timezone as dt_timezone
+from itertools import chain
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from paypal import entitlements, interning
+from paypal.models import (
+    BillingPlan,
+    BillingCycle,
+    PaymentPreference,
+    Product,
+    SyncState,
+    Subscription,
+    Subscriber,
+    PayPalProfile,
+    WebhookEvent
+)
+from paypal.signals import muted_plan_signals
+from paypal.utils.billing_plan import PayPalBillingPlan
+from paypal.utils.product import PayPalProduct
+from paypal.utils.subscription import PayPalSubscription
+from paypal.utils.throttle import Priority
+
+User = get_user_model()
+
+# Stay below SQLite's 999 bound parameters per query
+LOOKUP_CHUNK_SIZE = 900
+
+
+def chunked(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def filter_in(queryset, field: str, values: list, *fields):
+    # values_list() over `field__in=values`, split into chunks the DB accepts
+    for chunk in chunked(values, LOOKUP_CHUNK_SIZE):
+        yield from queryset.filter(**{f"{field}__in": chunk}).values_list(*fields)
+
+
+def fetch_concurrently(fetch, ids: list, concurrency: int, on_error) -> list:
+    """
+    Calls `fetch(id)` on a bounded thread pool and returns the resources that came back with an id.
+    Failures are reported through `on_error(id, error)`.
+    """
+    resources = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fetch, resource_id): resource_id for resource_id in ids}
+        for future in as_completed(futures):
+            try:
+                resource = future.result()
+            except Exception as e:
+                on_error(futures[future], e)
+                continue
+            if not resource.get('id'):
+                on_error(futures[future], resource.get('message', resource))
+                continue
+            resources.append(resource)
+    return resources
+
+
+def parse_time(value):
+    # Aware datetime of a PayPal timestamp, one without an offset is taken as UTC
+    if not value:
+        return None
+    value = parse_datetime(value) if isinstance(value, str) else value
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def build_product(product: dict) -> Product:
+    return Product(
+        product_id=product.get('id'),
+        name=product.get('name'),
+        description=product.get('description'),
+        type=product.get('type'),
+        category=product.get('category'),
+        image_url=product.get('image_url', ''),
+        home_url=product.get('home_url', ''),
+        create_time=product.get('create_time'),
+        update_time=product.get('update_time'),
+        links=product.get('links')
+    )
+
+
+def amount_key(data: dict):
+    return data["currency_code"], float(data["value"])
+
+
+def frequency_key(data: dict):
+    return data["interval_unit"], int(data["interval_count"])
+
+
+class LookupIndex:
+    """
+    Resolves the small value tables (Amount, Frequency, PricingScheme) of an import through the
+    process-wide intern caches of paypal.interning, with at most one query per table for the values
+    that aren't cached yet. Missing rows are bulk created in one go, rows a concurrent import
+    created in the meantime are skipped by the unique constraints and read back instead.
+    """
+
+    def __init__(self):
+        self.amounts = {}
+        self.frequencies = {}
+        self.pricing_schemes = {}
+
+    def ensure(self, plans: list):
+        amounts = set()
+        frequencies = set()
+        for plan in plans:
+            amounts.add(amount_key(plan["payment_preferences"]["setup_fee"]))
+            for cycle in plan.get("billing_cycles", []):
+                frequencies.add(frequency_key(cycle["frequency"]))
+                if cycle.get("pricing_scheme"):
+                    amounts.add(amount_key(cycle["pricing_scheme"]["fixed_price"]))
+
+        self.ensure_amounts(amounts)
+        self.frequencies.update(
+            interning.frequencies.resolve_many(frequencies - self.frequencies.keys(), create=True)
+        )
+
+        fixed_prices = set()
+        for plan in plans:
+            for cycle in plan.get("billing_cycles", []):
+                if cycle.get("pricing_scheme"):
+                    fixed_prices.add(self.amount(cycle["pricing_scheme"]["fixed_price"]))
+        self.pricing_schemes.update(
+            interning.pricing_schemes.resolve_many(fixed_prices - self.pricing_schemes.keys(), create=True)
+        )
+
+    def ensure_amounts(self, amounts: set):
+        self.amounts.update(interning.amounts.resolve_many(amounts - self.amounts.keys(), create=True))
+
+    def amount(self, data: dict) -> int:
+        return self.amounts[amount_key(data)]
+
+    def frequency(self, data: dict) -> int:
+        return self.frequencies[frequency_key(data)]
+
+    def pricing_scheme(self, data: dict):
+        if not data:
+            return None
+        return self.pricing_schemes[self.amount(data["fixed_price"])]
+
+
+class PlanImporter:
+    """
+    Imports PayPal billing plans that are missing locally.
+    Plan details are fetched concurrently, then every row is written with bulk_create in one transaction.
+    """
+
+    def __init__(self, paypal_helper: PayPalBillingPlan = None, concurrency: int = 8, batch_size: int = 500,
+                 on_error=None):
+        # Imports and syncs read PayPal's current state, never the resource cache, and yield to other traffic
+        self.paypal_helper = paypal_helper or PayPalBillingPlan(use_cache=False, priority=Priority.BULK)
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = max(batch_size, 1)
+        self.on_error = on_error or (lambda plan_id, error: None)
+        self.failed = 0
+        self.products = {}
+
+    def _error(self, plan_id, error):
+        self.failed += 1
+        self.on_error(plan_id, error)
+
+    def list_plan_ids(self) -> list:
+        return list(dict.fromkeys(plan.get('id') for plan in self.paypal_helper.iter_billing_plans()))
+
+    @staticmethod
+    def get_missing_plan_ids(plan_ids: list) -> list:
+        existing = {plan_id for plan_id, in filter_in(BillingPlan.objects.all(), 'plan_id', plan_ids, 'plan_id')}
+        return [plan_id for plan_id in plan_ids if plan_id not in existing]
+
+    def fetch_plans(self, plan_ids: list) -> list:
+        return fetch_concurrently(self.paypal_helper.get_billing_plan, plan_ids, self.concurrency, self._error)
+
+    def resolve_products(self, plans: list) -> list:
+        product_ids = list({plan.get('product_id') for plan in plans})
+        self.products.update(filter_in(Product.objects.all(), 'product_id', product_ids, 'product_id', 'id'))
+
+        resolved = []
+        for plan in plans:
+            if plan.get('product_id') not in self.products:
+                self._error(plan['id'], f"Product {plan.get('product_id')} does not exist locally")
+                continue
+            resolved.append(plan)
+        return resolved
+
+    def build_plan(self, plan: dict) -> BillingPlan:
+        return BillingPlan(
+            product_id=self.products[plan["product_id"]],
+            plan_id=plan.get("id"),
+            name=plan.get("name"),
+            description=plan.get("description"),
+            status=plan.get("status"),
+            create_time=plan.get("create_time"),
+            update_time=plan.get("update_time"),
+            quantity_supported=plan.get("quantity_supported", False),
+            links=plan.get("links")
+        )
+
+    def write(self, plans: list, lookups: LookupIndex):
+        for batch in chunked(plans, self.batch_size):
+            BillingPlan.objects.bulk_create([self.build_plan(plan) for plan in batch])
+            plan_ids = [plan['id'] for plan in batch]
+            plan_pks = dict(filter_in(BillingPlan.objects.all(), 'plan_id', plan_ids, 'plan_id', 'id'))
+
+            preferences = []
+            cycles = []
+            for plan in batch:
+                plan_pk = plan_pks[plan['id']]
+                data = plan["payment_preferences"]
+                preferences.append(PaymentPreference(
+                    billing_plan_id=plan_pk,
+                    auto_bill_outstanding=data.get("auto_bill_outstanding"),
+                    setup_fee_failure_action=data.get("setup_fee_failure_action"),
+                    payment_failure_threshold=data.get("payment_failure_threshold"),
+                    setup_fee_id=lookups.amount(data["setup_fee"])
+                ))
+                for cycle in plan.get("billing_cycles", []):
+                    cycles.append(BillingCycle(
+                        billing_plan_id=plan_pk,
+                        frequency_id=lookups.frequency(cycle["frequency"]),
+                        tenure_type=cycle.get('tenure_type'),
+                        sequence=cycle.get('sequence'),
+                        total_cycles=cycle.get('total_cycles'),
+                        pricing_scheme_id=lookups.pricing_scheme(cycle.get("pricing_scheme"))
+                    ))
+
+            PaymentPreference.objects.bulk_create(preferences)
+            BillingCycle.objects.bulk_create(cycles)
+
+    def run(self, dry_run: bool = False) -> dict:
+        plan_ids = self.list_plan_ids()
+        missing_ids = self.get_missing_plan_ids(plan_ids)
+        plans = self.resolve_products(self.fetch_plans(missing_ids))
+
+        if plans and not dry_run:
+            with transaction.atomic(), muted_plan_signals():
+                lookups = LookupIndex()
+                lookups.ensure(plans)
+                self.write(plans, lookups)
+
+        return {
+            "fetched": len(plan_ids),
+            "inserted": len(plans),
+            "failed": self.failed
+        }
+
+
+class DeltaSync:
+    """
+    Incremental sync of one PayPal resource type.
+    Only resources that are new, or whose PayPal update_time is newer than the stored one, are fetched and written.
+    The newest update_time seen is kept as a high-water mark in SyncState next to the time of the last run. PayPal
+    can't filter its lists by update_time, so every run still lists everything, but resources not updated since the
+    mark (less `overlap`, for PayPal's clock and list lag) skip the local comparison. full=True compares them all,
+    e.g. to restore rows deleted locally.
+    """
+    resource = None
+    overlap = timedelta(minutes=5)
+
+    def __init__(self, concurrency: int = 8, batch_size: int = 500, on_error=None):
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = max(batch_size, 1)
+        self.on_error = on_error or (lambda resource_id, error: None)
+        self.failed = 0
+
+    def _error(self, resource_id, error):
+        self.failed += 1
+        self.on_error(resource_id, error)
+
+    @staticmethod
+    def is_stale(remote_time, local_time) -> bool:
+        if local_time is None or remote_time is None:
+            # New locally, or PayPal didn't send update_time in the list and only the details can tell
+            return True
+        return remote_time > local_time
+
+    @staticmethod
+    def is_complete(summary: dict) -> bool:
+        raise NotImplementedError
+
+    def list_resources(self) -> list:
+        raise NotImplementedError
+
+    def fetch(self, resource_id: str) -> dict:
+        raise NotImplementedError
+
+    def local_update_times(self, resource_ids: list) -> dict:
+        raise NotImplementedError
+
+    def write(self, new: list, changed: list):
+        raise NotImplementedError
+
+    def is_unchanged(self, summary: dict, mark) -> bool:
+        # Written by a run that saw update_time at most `mark`, no need to look it up locally
+        update_time = parse_time(summary.get('update_time'))
+        return mark is not None and update_time is not None and update_time <= mark
+
+    def run(self, dry_run: bool = False, full: bool = False) -> dict:
+        state, _ = SyncState.objects.get_or_create(resource=self.resource)
+        summaries = list({summary['id']: summary for summary in self.list_resources()}.values())
+        mark = state.high_water_mark - self.overlap if state.high_water_mark and not full else None
+        pending = [summary for summary in summaries if not self.is_unchanged(summary, mark)]
+        local = self.local_update_times([summary['id'] for summary in pending])
+
+        complete = []
+        to_fetch = []
+        for summary in pending:
+            if not self.is_stale(parse_time(summary.get('update_time')), local.get(summary['id'])):
+                continue
+            if self.is_complete(summary):
+                complete.append(summary)
+            else:
+                to_fetch.append(summary['id'])
+        resources = complete + fetch_concurrently(self.fetch, to_fetch, self.concurrency, self._error)
+
+        new = [resource for resource in resources if resource['id'] not in local]
+        changed = [
+            resource for resource in resources
+            if resource['id'] in local and parse_time(resource.get('update_time')) != local[resource['id']]
+        ]
+
+        if not dry_run:
+            with transaction.atomic():
+                new = self.write(new, changed)
+                update_times = [parse_time(item.get('update_time')) for item in summaries + resources]
+                update_times = [t for t in update_times if t is not None]
+                # A resource that failed must stay above the mark, the next run retries it
+                if update_times and not self.failed:
+                    state.high_water_mark = max([state.high_water_mark or min(update_times), *update_times])
+                state.last_synced_at = timezone.now()
+                state.save()
+
+        return {
+            "fetched": len(summaries),
+            "inserted": len(new),
+            "updated": len(changed),
+            "unchanged": len(summaries) - len(pending),
+            "failed": self.failed
+        }
+
+
+class ProductDeltaSync(DeltaSync):
+    resource = SyncState.Resource.PRODUCTS
+    fields = ['name', 'description', 'type', 'category', 'image_url', 'home_url', 'update_time', 'links']
+
+    def __init__(self, paypal_helper: PayPalProduct = None, **kwargs):
+        super().__init__(**kwargs)
+        self.paypal_helper = paypal_helper or PayPalProduct(use_cache=False, priority=Priority.BULK)
+
+    @staticmethod
+    def is_complete(summary):
+        return 'update_time' in summary and 'type' in summary
+
+    def list_resources(self):
+        return self.paypal_helper.iter_products(full=True)
+
+    def fetch(self, resource_id):
+        return self.paypal_helper.get_product(resource_id)
+
+    def local_update_times(self, resource_ids):
+        return dict(filter_in(Product.objects.all(), 'product_id', resource_ids, 'product_id', 'update_time'))
+
+    def write(self, new, changed):
+        Product.objects.bulk_create([build_product(product) for product in new], batch_size=self.batch_size)
+
+        data = {product['id']: build_product(product) for product in changed}
+        products = []
+        for chunk in chunked(list(data), LOOKUP_CHUNK_SIZE):
+            for product in Product.objects.filter(product_id__in=chunk):
+                for field in self.fields:
+                    setattr(product, field, getattr(data[product.product_id], field))
+                products.append(product)
+        # bulk_update skips the save signals, so nothing is pushed back to PayPal
+        Product.objects.bulk_update(products, self.fields, batch_size=self.batch_size)
+        return new
+
+
+class PlanDeltaSync(DeltaSync):
+    resource = SyncState.Resource.BILLING_PLANS
+    plan_fields = ['name', 'description', 'status', 'quantity_supported', 'update_time', 'links']
+    preference_fields = ['auto_bill_outstanding', 'setup_fee', 'setup_fee_failure_action', 'payment_failure_threshold']
+    cycle_fields = ['frequency', 'tenure_type', 'total_cycles', 'pricing_scheme']
+
+    def __init__(self, paypal_helper: PayPalBillingPlan = None, **kwargs):
+        super().__init__(**kwargs)
+        self.paypal_helper = paypal_helper or PayPalBillingPlan(use_cache=False, priority=Priority.BULK)
+        self.importer = PlanImporter(
+            paypal_helper=self.paypal_helper,
+            concurrency=self.concurrency,
+            batch_size=self.batch_size,
+            on_error=self._error
+        )
+
+    @staticmethod
+    def is_complete(summary):
+        return 'update_time' in summary and 'billing_cycles' in summary and 'payment_preferences' in summary
+
+    def list_resources(self):
+        return self.paypal_helper.iter_billing_plans(full=True)
+
+    def fetch(self, resource_id):
+        return self.paypal_helper.get_billing_plan(resource_id)
+
+    def local_update_times(self, resource_ids):
+        return dict(filter_in(BillingPlan.objects.all(), 'plan_id', resource_ids, 'plan_id', 'update_time'))
+
+    def update_plans(self, plans: list, lookups: LookupIndex):
+        data = {plan['id']: plan for plan in plans}
+        billing_plans = []
+        preferences = []
+        cycles = []
+        new_cycles = []
+        removed_cycles = []
+
+        for chunk in chunked(list(data), LOOKUP_CHUNK_SIZE):
+            queryset = BillingPlan.objects.filter(plan_id__in=chunk).select_related(
+                'payment_preferences'
+            ).prefetch_related('billing_cycles')
+
+            for billing_plan in queryset:
+                plan = data[billing_plan.plan_id]
+                for field in self.plan_fields:
+                    setattr(billing_plan, field, plan.get(field, getattr(billing_plan, field)))
+                billing_plans.append(billing_plan)
+
+                preference = getattr(billing_plan, 'payment_preferences', None)
+                if preference is not None:
+                    values = plan["payment_preferences"]
+                    preference.auto_bill_outstanding = values.get("auto_bill_outstanding")
+                    preference.setup_fee_id = lookups.amount(values["setup_fee"])
+                    preference.setup_fee_failure_action = values.get("setup_fee_failure_action")
+                    preference.payment_failure_threshold = values.get("payment_failure_threshold")
+                    preferences.append(preference)
+
+                existing = {cycle.sequence: cycle for cycle in billing_plan.billing_cycles.all()}
+                for values in plan.get("billing_cycles", []):
+                    cycle = existing.get(values.get('sequence'))
+                    if cycle is None:
+                        cycle = BillingCycle(billing_plan=billing_plan, sequence=values.get('sequence'))
+                        new_cycles.append(cycle)
+                    else:
+                        cycles.append(cycle)
+                    cycle.frequency_id = lookups.frequency(values["frequency"])
+                    cycle.tenure_type = values.get('tenure_type')
+                    cycle.total_cycles = values.get('total_cycles')
+                    cycle.pricing_scheme_id = lookups.pricing_scheme(values.get("pricing_scheme"))
+                if "billing_cycles" in plan:
+                    # Removed on PayPal, kept it would still be priced locally
+                    sequences = {values.get('sequence') for values in plan["billing_cycles"]}
+                    removed_cycles += [cycle.id for sequence, cycle in existing.items() if sequence not in sequences]
+
+        # bulk_update skips the save signals, so nothing is pushed back to PayPal
+        BillingPlan.objects.bulk_update(billing_plans, self.plan_fields, batch_size=self.batch_size)
+        PaymentPreference.objects.bulk_update(preferences, self.preference_fields, batch_size=self.batch_size)
+        BillingCycle.objects.bulk_update(cycles, self.cycle_fields, batch_size=self.batch_size)
+        BillingCycle.objects.bulk_create(new_cycles, batch_size=self.batch_size)
+        for chunk in chunked(removed_cycles, LOOKUP_CHUNK_SIZE):
+            BillingCycle.objects.filter(id__in=chunk).delete()
+
+    def write(self, new, changed):
+        new = self.importer.resolve_products(new)
+        if not new and not changed:
+            return new
+
+        with muted_plan_signals():
+            lookups = LookupIndex()
+            lookups.ensure(new + changed)
+            self.importer.write(new, lookups)
+            self.update_plans(changed, lookups)
+        return new
+
+
+# PayPal subscription statuses mapped to Subscription.SubscriptionStatus, every other status is INACTIVE
+SUBSCRIPTION_STATUSES = {
+    'ACTIVE': Subscription.SubscriptionStatus.ACTIVE,
+    'SUSPENDED': Subscription.SubscriptionStatus.SUSPENDED,
+}
+
+
+def build_subscription_fields(subscription: dict) -> dict:
+    billing_info = subscription.get('billing_info', {})
+    return {
+        "status": SUBSCRIPTION_STATUSES.get(subscription.get('status'), Subscription.SubscriptionStatus.INACTIVE),
+        "billing_info": billing_info,
+        "next_billing_time": parse_time(billing_info.get('next_billing_time')),
+    }
+
+
+def update_profile_validity(subscriptions: list):
+    """
+    Extends the validity of the users of `subscriptions` to the latest next billing time of any of their
+    active subscriptions, call it once the subscriptions are written. Validity is never shortened here,
+    a cancelled subscription stays paid up to where it was.
+    """
+    user_ids = list({subscription.user_id for subscription in subscriptions if subscription.user_id})
+
+    profiles = []
+    now = timezone.now()
+    for chunk in chunked(user_ids, LOOKUP_CHUNK_SIZE):
+        # Over all of the users' active subscriptions, not only the ones in this batch
+        active = Subscription.objects.filter(
+            user_id__in=chunk,
+            status=Subscription.SubscriptionStatus.ACTIVE,
+            next_billing_time__isnull=False
+        ).order_by().values('user_id')
+        valid_till = dict(active.annotate(valid_till=Max('next_billing_time')).values_list('user_id', 'valid_till'))
+        for profile in PayPalProfile.objects.filter(user_id__in=list(valid_till)):
+            new = valid_till[profile.user_id]
+            current = profile.subscription_valid_till
+            if current is None or new > current:
+                profile.subscription_valid_till = new
+                profile.modified_date = now
+                profiles.append(profile)
+    PayPalProfile.objects.bulk_update(profiles, ['subscription_valid_till', 'modified_date'], batch_size=500)
+    entitlements.invalidate(*[profile.user_id for profile in profiles])
+
+
+class SubscriptionSync:
+    """
+    Mirrors PayPal subscriptions into Subscription and Subscriber.
+    PayPal has no endpoint listing subscriptions, so the initial load works from known ids: local rows,
+    subscription webhook events and any ids passed in. Reconciliation then only re-fetches the subscriptions
+    whose next billing time has passed or that weren't synced for `stale_after`, and those of FAILED
+    subscription webhook events. Once written, those events are marked PROCESSED.
+    """
+    fields = [
+        'plan', 'status', 'start_time', 'shipping_amount', 'billing_info', 'next_billing_time', 'create_time',
+        'update_time', 'links', 'synced_at'
+    ]
+
+    def __init__(self, paypal_helper: PayPalSubscription = None, concurrency: int = 8, batch_size: int = 500,
+                 stale_after: timedelta = timedelta(hours=24), on_error=None):
+        self.paypal_helper = paypal_helper or PayPalSubscription(use_cache=False, priority=Priority.BULK)
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = max(batch_size, 1)
+        self.stale_after = stale_after
+        self.on_error = on_error or (lambda subscription_id, error: None)
+        self.plans = {}
+        self.lookups = None
+        self.result = {"fetched": 0, "created": 0, "updated": 0, "failed": 0}
+
+    def _error(self, subscription_id, error):
+        self.result["failed"] += 1
+        self.on_error(subscription_id, error)
+
+    @staticmethod
+    def known_ids():
+        # Every subscription id we have heard of, local rows first
+        seen = set()
+        local = Subscription.objects.order_by('id').values_list('subscription_id', flat=True)
+        events = WebhookEvent.objects.filter(
+            event_type__startswith='BILLING.SUBSCRIPTION.'
+        ).order_by('id').values_list('resource_id', flat=True)
+        for subscription_id in chain(local.iterator(), events.iterator()):
+            if subscription_id and subscription_id not in seen:
+                seen.add(subscription_id)
+                yield subscription_id
+
+    @staticmethod
+    def failed_event_ids() -> list:
+        # Subscriptions of webhook events that couldn't be applied, e.g. created before their plan was imported
+        events = WebhookEvent.objects.filter(
+            event_type__startswith='BILLING.SUBSCRIPTION.',
+            status=WebhookEvent.Status.FAILED
+        ).exclude(resource_id='').order_by('id').values_list('resource_id', flat=True)
+        return list(dict.fromkeys(events))
+
+    @staticmethod
+    def resolve_failed_events(subscription_ids: list, since):
+        # What was synced after `since` is PayPal's current state, it supersedes the state the failed events carry
+        synced = [subscription_id for subscription_id, in filter_in(
+            Subscription.objects.filter(synced_at__gte=since), 'subscription_id', subscription_ids, 'subscription_id'
+        )]
+        now = timezone.now()
+        for chunk in chunked(synced, LOOKUP_CHUNK_SIZE):
+            WebhookEvent.objects.filter(
+                event_type__startswith='BILLING.SUBSCRIPTION.',
+                status=WebhookEvent.Status.FAILED,
+                resource_id__in=chunk
+            ).update(status=WebhookEvent.Status.PROCESSED, last_error='', processed_at=now, modified_date=now)
+
+    def due_ids(self):
+        now = timezone.now()
+        return Subscription.objects.filter(
+            Q(next_billing_time__lte=now) & ~Q(status=Subscription.SubscriptionStatus.INACTIVE) |
+            Q(synced_at__isnull=True) |
+            Q(synced_at__lt=now - self.stale_after)
+        ).order_by('id').values_list('subscription_id', flat=True).iterator()
+
+    def match_users(self, subscriptions: list) -> dict:
+        """
+        {subscription id: user id} from custom_id (set to the user's pk at checkout) or the subscriber's email.
+        """
+        custom_ids = {s['id']: s['custom_id'] for s in subscriptions if str(s.get('custom_id', '')).isdigit()}
+        emails = {
+            s['id']: s['subscriber']['email_address'].lower()
+            for s in subscriptions if s.get('subscriber', {}).get('email_address')
+        }
+
+        custom_pks = list({int(custom_id) for custom_id in custom_ids.values()})
+        user_ids = {pk for pk, in filter_in(User.objects.all(), 'pk', custom_pks, 'pk')}
+        users_by_email = {}
+        for chunk in chunked(list(set(emails.values())), LOOKUP_CHUNK_SIZE):
+            queryset = User.objects.annotate(lower_email=Lower('email')).filter(lower_email__in=chunk)
+            for pk, email in queryset.order_by('pk').values_list('pk', 'lower_email'):
+                users_by_email.setdefault(email, pk)
+
+        matched = {}
+        for subscription in subscriptions:
+            custom_id = custom_ids.get(subscription['id'])
+            if custom_id and int(custom_id) in user_ids:
+                matched[subscription['id']] = int(custom_id)
+            elif emails.get(subscription['id']) in users_by_email:
+                matched[subscription['id']] = users_by_email[emails[subscription['id']]]
+        return matched
+
+    def resolve_plans(self, subscriptions: list) -> list:
+        plan_ids = list({s.get('plan_id') for s in subscriptions} - self.plans.keys())
+        self.plans.update(filter_in(BillingPlan.objects.all(), 'plan_id', plan_ids, 'plan_id', 'id'))
+
+        resolved = []
+        for subscription in subscriptions:
+            if subscription.get('plan_id') not in self.plans:
+                self._error(subscription['id'], f"Plan {subscription.get('plan_id')} does not exist locally")
+                continue
+            resolved.append(subscription)
+        return resolved
+
+    def apply(self, instance: Subscription, subscription: dict, now):
+        shipping_amount = subscription.get('shipping_amount')
+        instance.plan_id = self.plans[subscription['plan_id']]
+        instance.start_time = parse_time(subscription.get('start_time')) or instance.start_time or now
+        instance.shipping_amount_id = self.lookups.amount(shipping_amount) if shipping_amount else None
+        instance.create_time = parse_time(subscription.get('create_time')) or instance.create_time or now
+        instance.update_time = parse_time(subscription.get('update_time')) or now
+        instance.links = subscription.get('links', [])
+        instance.synced_at = now
+        for field, value in build_subscription_fields(subscription).items():
+            setattr(instance, field, value)
+
+    def write(self, subscriptions: list):
+        subscriptions = self.resolve_plans(subscriptions)
+        if not subscriptions:
+            return
+
+        now = timezone.now()
+        data = {subscription['id']: subscription for subscription in subscriptions}
+        with transaction.atomic():
+            self.lookups.ensure_amounts({
+                amount_key(s['shipping_amount']) for s in subscriptions if s.get('shipping_amount')
+            })
+
+            updated = []
+            for chunk in chunked(list(data), LOOKUP_CHUNK_SIZE):
+                for instance in Subscription.objects.filter(subscription_id__in=chunk):
+                    self.apply(instance, data[instance.subscription_id], now)
+                    updated.append(instance)
+            existing = {instance.subscription_id for instance in updated}
+
+            users = self.match_users([s for s in subscriptions if s['id'] not in existing])
+            created = []
+            for subscription in subscriptions:
+                if subscription['id'] not in existing:
+                    instance = Subscription(subscription_id=subscription['id'], user_id=users.get(subscription['id']))
+                    self.apply(instance, subscription, now)
+                    created.append(instance)
+
+            Subscription.objects.bulk_update(updated, self.fields, batch_size=self.batch_size)
+            Subscription.objects.bulk_create(created, batch_size=self.batch_size)
+            self.write_subscribers(data)
+            update_profile_validity(updated + created)
+
+        self.result["created"] += len(created)
+        self.result["updated"] += len(updated)
+
+    @staticmethod
+    def write_subscribers(data: dict):
+        pks = dict(filter_in(Subscription.objects.all(), 'subscription_id', list(data), 'subscription_id', 'id'))
+        subscribers = {
+            subscriber.subscription_id: subscriber
+            for chunk in chunked(list(pks.values()), LOOKUP_CHUNK_SIZE)
+            for subscriber in Subscriber.objects.filter(subscription_id__in=chunk)
+        }
+
+        changed = []
+        new = []
+        for subscription_id, pk in pks.items():
+            values = data[subscription_id].get('subscriber')
+            if not values:
+                continue
+            subscriber = subscribers.get(pk)
+            if subscriber is None:
+                subscriber = Subscriber(subscription_id=pk)
+                new.append(subscriber)
+            else:
+                changed.append(subscriber)
+            subscriber.name = values.get('name', {})
+            subscriber.email = values.get('email_address', '')
+
+        Subscriber.objects.bulk_update(changed, ['name', 'email'], batch_size=500)
+        Subscriber.objects.bulk_create(new, batch_size=500)
+
+    def run(self, subscription_ids) -> dict:
+        # Fetches and writes the given ids batch by batch, memory stays bounded for any number of ids
+        if self.lookups is None:
+            self.lookups = LookupIndex()
+
+        batch = []
+        for subscription_id in chain(subscription_ids, [None]):
+            if subscription_id is not None:
+                batch.append(subscription_id)
+            if batch and (len(batch) >= self.batch_size or subscription_id is None):
+                subscriptions = fetch_concurrently(
+                    self.paypal_helper.get_subscription, batch, self.concurrency, self._error
+                )
+                self.result["fetched"] += len(subscriptions)
+                self.write(subscriptions)
+                batch = []
+        return self.result
+
+    def initial_load(self, extra_ids=()) -> dict:
+        started = timezone.now()
+        failed = self.failed_event_ids()
+        self.run(list(dict.fromkeys(chain(self.known_ids(), extra_ids))))
+        self.resolve_failed_events(failed, started)
+        return self.result
+
+    def reconcile(self) -> dict:
+        # Materialised first, the ids are rewritten while the batches are synced
+        started = timezone.now()
+        failed = self.failed_event_ids()
+        self.run(list(dict.fromkeys(chain(self.due_ids(), failed))))
+        self.resolve_failed_events(failed, started)
+        return self.result
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from paypal.models import Amount, Frequency, PricingScheme
+
+# Keys per query, stays below SQLite's limit of 999 parameters for two-field keys
+CHUNK_SIZE = 400
+
+
+class InternCache:
+    """
+    Process-local LRU of the rows of a small value table, resolving values to primary keys.
+    Cached instances are shared, treat them as read-only. Rows only enter the cache once the
+    transaction that read or created them has committed, so a rollback can't leave unknown pks behind.
+    Saves and deletes drop the row (paypal.signals), other processes keep theirs until evicted.
+    """
+
+    def __init__(self, model, key_fields: list, maxsize: int = None):
+        self.model = model
+        self.attnames = [model._meta.get_field(field).attname for field in key_fields]
+        self.maxsize = maxsize or getattr(settings, 'PAYPAL_INTERN_CACHE_SIZE', 1024)
+        self.lock = threading.Lock()
+        self.rows = OrderedDict()
+        self.pks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, instance):
+        values = tuple(getattr(instance, attname) for attname in self.attnames)
+        return values[0] if len(values) == 1 else values
+
+    def values(self, key) -> dict:
+        # Single field keys are plain values, the others tuples in the order of the key fields
+        return dict(zip(self.attnames, key if len(self.attnames) > 1 else (key,)))
+
+    def _put(self, instances: list):
+        with self.lock:
+            for instance in instances:
+                self.rows[instance.pk] = instance
+                self.rows.move_to_end(instance.pk)
+                self.pks[self.key(instance)] = instance.pk
+            while len(self.rows) > self.maxsize:
+                pk, instance = self.rows.popitem(last=False)
+                self.pks.pop(self.key(instance), None)
+
+    def _remember(self, instances: list):
+        if instances:
+            transaction.on_commit(lambda: self._put(instances))
+
+    def _fetch(self, keys: list, resolved: dict):
+        for start in range(0, len(keys), CHUNK_SIZE):
+            chunk = keys[start:start + CHUNK_SIZE]
+            instances = list(self.model.objects.filter(reduce(or_, [Q(**self.values(key)) for key in chunk])))
+            for instance in instances:
+                # Keep the oldest row if the table still holds duplicates
+                key = self.key(instance)
+                if key not in resolved or instance.pk < resolved[key]:
+                    resolved[key] = instance.pk
+            self._remember(instances)
+
+    def resolve_many(self, keys, create: bool = False) -> dict:
+        """
+        {key: pk} for the given value keys, read with one query for the keys that aren't cached.
+        With `create` the rows that don't exist yet are bulk created, rows a concurrent writer created are kept.
+        """
+        keys = set(keys)
+        with self.lock:
+            resolved = {key: self.pks[key] for key in keys if key in self.pks}
+            self.hits += len(resolved)
+            self.misses += len(keys) - len(resolved)
+
+        self._fetch(list(keys - resolved.keys()), resolved)
+        missing = list(keys - resolved.keys())
+        if missing and create:
+            self.model.objects.bulk_create([self.model(**self.values(key)) for key in missing], ignore_conflicts=True)
+            # bulk_create doesn't return primary keys on every backend, read them back
+            self._fetch(missing, resolved)
+        return resolved
+
+    def resolve(self, key, create: bool = False):
+        return self.resolve_many([key], create).get(key)
+
+    def _drop(self, pk):
+        with self.lock:
+            instance = self.rows.pop(pk, None)
+            if instance is not None and self.pks.get(self.key(instance)) == pk:
+                del self.pks[self.key(instance)]
+
+    def invalidate(self, pk):
+        # Dropped again on commit, another thread may have cached the old row before the change was visible
+        self._drop(pk)
+        transaction.on_commit(lambda: self._drop(pk))
+
+    def clear(self):
+        with self.lock:
+            self.rows.clear()
+            self.pks.clear()
+
+
+amounts = InternCache(Amount, ['currency_code', 'value'])
+frequencies = InternCache(Frequency, ['interval_unit', 'interval_count'])
+pricing_schemes = InternCache(PricingScheme, ['fixed_price'])
+
+CACHES = {Amount: amounts, Frequency: frequencies, PricingScheme: pricing_schemes}
@@ -0,0 +1,77 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from paypal.sandbox.benchmark import SCENARIOS, run_benchmark
+from paypal.sandbox.server import PayPalSandboxServer, SandboxState
+
+
+class Command(BaseCommand):
+    help = 'Measures throughput and p50/p99 latency of the PayPal helpers and commands against the local sandbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=list(SCENARIOS),
+            help='Scenario to run, can be repeated (default: all)'
+        )
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel requests')
+        parser.add_argument('--requests', type=int, default=200, help='Operations per request based scenario')
+        parser.add_argument('--base-url', help='Benchmark an already running server instead of starting one')
+        parser.add_argument('--latency', type=float, default=0.02, help='Sandbox latency per response in seconds')
+        parser.add_argument('--jitter', type=float, default=0.005, help='Sandbox latency standard deviation')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of sandbox responses that are 503')
+        parser.add_argument('--products', type=int, default=200, help='Products seeded in the sandbox')
+        parser.add_argument('--plans', type=int, default=400, help='Billing plans seeded in the sandbox')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be positive")
+
+        server = None
+        base_url = options['base_url']
+        if not base_url:
+            server = PayPalSandboxServer(
+                latency=options['latency'],
+                jitter=options['jitter'],
+                error_rate=options['error_rate'],
+                state=SandboxState(options['products'], options['plans'])
+            )
+            base_url = server.start()
+
+        previous_base_url = getattr(settings, 'PAYPAL_BASE_URL', '')
+        settings.PAYPAL_BASE_URL = base_url
+        try:
+            results = run_benchmark(
+                options['scenario'] or list(SCENARIOS),
+                options['concurrency'],
+                options['requests'],
+                base_url=base_url,
+                sandbox={
+                    "latency": options['latency'],
+                    "jitter": options['jitter'],
+                    "error_rate": options['error_rate'],
+                    "products": options['products'],
+                    "plans": options['plans'],
+                } if server else None
+            )
+        finally:
+            settings.PAYPAL_BASE_URL = previous_base_url
+            if server:
+                server.stop()
+
+        for name, result in results['scenarios'].items():
+            latency = result['latency_ms']
+            rate = result.get('throughput_per_s', result.get('requests_per_s'))
+            self.stdout.write(
+                f"{name:<20} {result['operations']:>6} ops  {rate:>9.1f}/s  p50 {latency['p50']:>8.2f}ms  "
+                f"p99 {latency['p99']:>8.2f}ms  errors {result['errors']}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from paypal.sandbox.benchmark import run_lookup_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measures the cost of the plan, subscription and subscriber lookups against a seeded table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=1000000, help='Subscriptions to seed')
+        parser.add_argument('--lookups', type=int, default=1000, help='Lookups per query')
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded rows instead of rolling them back")
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['subscriptions'] < 1 or options['lookups'] < 1:
+            raise CommandError("--subscriptions and --lookups must be positive")
+
+        results = run_lookup_benchmark(options['subscriptions'], options['lookups'], keep=options['keep'])
+        self.stdout.write(f"Seeded {results['subscriptions']} subscriptions in {results['seed_duration_s']}s")
+        for name, result in results['scenarios'].items():
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{name:<26} p50 {latency['p50']:>8.3f}ms  p99 {latency['p99']:>8.3f}ms  | {result['plan']}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,104 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from paypal.importers import chunked
+from paypal.models import Subscription
+from paypal.utils.bulk import Checkpoint
+from paypal.utils.subscription import PayPalSubscription
+from paypal.utils.throttle import Priority
+
+# Local status once PayPal accepted the action, the webhooks confirm it later
+LOCAL_STATUSES = {
+    "cancel": Subscription.SubscriptionStatus.INACTIVE,
+    "suspend": Subscription.SubscriptionStatus.SUSPENDED,
+    "activate": Subscription.SubscriptionStatus.ACTIVE,
+}
+
+
+class Command(BaseCommand):
+    help = 'Cancels, suspends or activates many PayPal subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=list(LOCAL_STATUSES))
+        parser.add_argument('--ids-file', help='File with one subscription id per line, - for stdin')
+        parser.add_argument('--plan-id', help='All local subscriptions of this PayPal plan id')
+        parser.add_argument('--status', help='Only local subscriptions with this status (with --plan-id)')
+        parser.add_argument('--reason', help='Reason sent to PayPal')
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel PayPal requests')
+        parser.add_argument('--max-retries', type=int, default=5, help='Retries of a rate limited request')
+        parser.add_argument('--checkpoint', help='Resume file, subscriptions recorded as done in it are skipped')
+        parser.add_argument('--progress', type=int, default=1000, help='Print progress every N subscriptions')
+
+    def iter_ids(self, options):
+        if options['ids_file']:
+            f = sys.stdin if options['ids_file'] == '-' else open(options['ids_file'])
+            try:
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        else:
+            queryset = Subscription.objects.filter(plan__plan_id=options['plan_id'])
+            if options['status']:
+                queryset = queryset.filter(status=options['status'])
+            yield from queryset.values_list('subscription_id', flat=True).order_by('id').iterator()
+
+    def update_local(self, action: str, results: list, checkpoint: Checkpoint = None):
+        subscription_ids = [result.id for result in results]
+        for chunk in chunked(subscription_ids, 500):
+            Subscription.objects.filter(subscription_id__in=chunk).update(status=LOCAL_STATUSES[action])
+        # Recorded once stored locally, a resumed run must not skip subscriptions whose local update was lost
+        if checkpoint is not None:
+            for result in results:
+                checkpoint.record(result)
+
+    def handle(self, *args, **options):
+        if not options['ids_file'] and not options['plan_id']:
+            raise CommandError("Pass --ids-file or --plan-id")
+
+        action = options['action']
+        started = time.monotonic()
+        succeeded = []
+        done = 0
+        failed = 0
+
+        checkpoint = Checkpoint(options['checkpoint']) if options['checkpoint'] else None
+        try:
+            results = PayPalSubscription(priority=Priority.BULK).bulk_update_status(
+                action,
+                self.iter_ids(options),
+                reason=options['reason'],
+                concurrency=max(options['concurrency'], 1),
+                max_retries=options['max_retries'],
+                checkpoint=checkpoint
+            )
+            for result in results:
+                done += 1
+                if result.ok:
+                    succeeded.append(result)
+                else:
+                    failed += 1
+                    if checkpoint is not None:
+                        checkpoint.record(result)
+                    self.stdout.write(self.style.ERROR(f"{result.id} | {result.status_code} {result.message}"))
+
+                if len(succeeded) >= 500:
+                    self.update_local(action, succeeded, checkpoint)
+                    succeeded = []
+                if options['progress'] and done % options['progress'] == 0:
+                    self.stdout.write(f"{done} subscriptions, {failed} failed, {time.monotonic() - started:.1f}s")
+            self.update_local(action, succeeded, checkpoint)
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action.capitalize()}: {done - failed} succeeded, {failed} failed "
+                f"in {time.monotonic() - started:.2f}s"
+            )
+        )
@@ -0,0 +1,110 @@
+import csv
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from paypal.models import Subscription
+from paypal.utils.subscription import PayPalSubscription
+from paypal.utils.throttle import Priority
+
+CSV_FIELDS = [
+    'subscription_id', 'id', 'status', 'time', 'currency_code', 'gross_amount', 'fee_amount', 'net_amount',
+    'payer_email'
+]
+
+
+def parse_time(value: str):
+    # Accepts a date (2021-01-01) or a datetime, naive values are in the current timezone
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f"Invalid date: {value}")
+        parsed = datetime.combine(date, datetime.min.time())
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def build_csv_row(subscription_id: str, transaction: dict) -> dict:
+    amounts = transaction.get('amount_with_breakdown', {})
+    return {
+        "subscription_id": subscription_id,
+        "id": transaction.get('id'),
+        "status": transaction.get('status'),
+        "time": transaction.get('time'),
+        "currency_code": amounts.get('gross_amount', {}).get('currency_code'),
+        "gross_amount": amounts.get('gross_amount', {}).get('value'),
+        "fee_amount": amounts.get('fee_amount', {}).get('value'),
+        "net_amount": amounts.get('net_amount', {}).get('value'),
+        "payer_email": transaction.get('payer_email'),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Streams PayPal subscription transactions to newline delimited JSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('subscription_ids', nargs='*', help='PayPal subscription ids')
+        parser.add_argument('--ids-file', help='File with one subscription id per line')
+        parser.add_argument('--plan-id', help='All local subscriptions of this PayPal plan id')
+        parser.add_argument('--start', required=True, help='Start date or datetime (inclusive)')
+        parser.add_argument('--end', help='End date or datetime (exclusive), defaults to now')
+        parser.add_argument('--window-days', type=int, default=30, help='Days per transactions request window')
+        parser.add_argument('--concurrency', type=int, default=4, help='Windows fetched in parallel')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--output', help='Output file, defaults to stdout')
+
+    def iter_ids(self, options):
+        yield from options['subscription_ids']
+        if options['ids_file']:
+            with open(options['ids_file']) as f:
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+        if options['plan_id']:
+            yield from Subscription.objects.filter(
+                plan__plan_id=options['plan_id']
+            ).values_list('subscription_id', flat=True).order_by('id').iterator()
+
+    def handle(self, *args, **options):
+        if not (options['subscription_ids'] or options['ids_file'] or options['plan_id']):
+            raise CommandError("Pass subscription ids, --ids-file or --plan-id")
+
+        start_time = parse_time(options['start'])
+        end_time = parse_time(options['end']) if options['end'] else timezone.now()
+        window = timedelta(days=max(options['window_days'], 1))
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        writer = None
+        if options['format'] == 'csv':
+            writer = csv.DictWriter(output, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+
+        started = time.monotonic()
+        paypal_helper = PayPalSubscription(priority=Priority.BULK)
+        subscriptions = 0
+        exported = 0
+        try:
+            for subscription_id in self.iter_ids(options):
+                subscriptions += 1
+                transactions = paypal_helper.iter_transactions(
+                    subscription_id, start_time, end_time, window=window, concurrency=options['concurrency']
+                )
+                for transaction in transactions:
+                    if writer is not None:
+                        writer.writerow(build_csv_row(subscription_id, transaction))
+                    else:
+                        output.write(json.dumps({"subscription_id": subscription_id, **transaction}) + "\n")
+                    exported += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        # Summary on stderr, stdout may be the export itself
+        self.stderr.write(
+            f"Exported {exported} transactions of {subscriptions} subscriptions in {time.monotonic() - started:.2f}s"
+        )
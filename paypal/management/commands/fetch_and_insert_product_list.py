@@ -1,45 +1,115 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from django.core.management.base import BaseCommand
 
+from paypal.importers import ProductDeltaSync, build_product, filter_in
 from paypal.models import Product
 from paypal.utils.product import PayPalProduct
+from paypal.utils.throttle import Priority
 
 
 class Command(BaseCommand):
     help = 'Fetches and Inserts PayPal product list'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel product detail requests')
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows per bulk insert')
+        parser.add_argument('--dry-run', action='store_true', help='Fetch everything but do not write to the DB')
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Also update products whose PayPal update_time is newer than the local one'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='With --incremental, compare every product, not only those updated since the last run'
+        )
+
     def _print_exception(self, e: Exception, prefix: str = None):
         prefix = f'{prefix} | ' if prefix else ''
         self.stdout.write(self.style.ERROR(f"{prefix}{type(e).__name__} | {e}"))
 
+    @staticmethod
+    def get_missing_product_ids(product_ids: list) -> list:
+        existing = {
+            product_id for product_id, in filter_in(Product.objects.all(), 'product_id', product_ids, 'product_id')
+        }
+        return [product_id for product_id in product_ids if product_id not in existing]
+
+    def insert(self, products: list, dry_run: bool):
+        if products and not dry_run:
+            Product.objects.bulk_create(products, batch_size=len(products))
+
+    def sync(self, options):
+        started = time.monotonic()
+        result = ProductDeltaSync(
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            on_error=lambda product_id, error: self.stdout.write(self.style.ERROR(f"{product_id} | {error}"))
+        ).run(dry_run=options['dry_run'], full=options['full'])
+
+        failed = f", {result['failed']} failed" if result['failed'] else ''
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Fetched {result['fetched']} products, inserted {result['inserted']} "
+                f"and updated {result['updated']} products successfully{failed}"
+            )
+        )
+        self.stdout.write(f"Total: {time.monotonic() - started:.2f}s")
+
     def handle(self, *args, **options):
-        paypal_helper = PayPalProduct()
-        paypal_products = paypal_helper.get_products()
+        if options['incremental']:
+            return self.sync(options)
+
+        concurrency = max(options['concurrency'], 1)
+        batch_size = max(options['batch_size'], 1)
+        dry_run = options['dry_run']
+
+        started = time.monotonic()
+        paypal_helper = PayPalProduct(use_cache=False, priority=Priority.BULK)
+        product_ids = list(dict.fromkeys(product.get('id') for product in paypal_helper.iter_products()))
+        missing_ids = self.get_missing_product_ids(product_ids)
+        listed = time.monotonic()
+
         products = []
-        product_ids = []
-
-        for product in paypal_products:
-            if not Product.objects.filter(product_id=product.get('id')).exists():
-                product_ids.append(product.get('id'))
-
-        for product_id in product_ids:
-            product = paypal_helper.get_product(product_id)
-            products.append(Product(
-                product_id=product.get('id'),
-                name=product.get('name'),
-                description=product.get('description'),
-                type=product.get('type'),
-                category=product.get('category'),
-                image_url=product.get('image_url', ''),
-                home_url=product.get('home_url', ''),
-                create_time=product.get('create_time'),
-                update_time=product.get('update_time'),
-                links=product.get('links')
-            ))
-
-        Product.objects.bulk_create(products, batch_size=20)
+        inserted = 0
+        failed = 0
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(paypal_helper.get_product, product_id): product_id for product_id in missing_ids}
+            for future in as_completed(futures):
+                try:
+                    product = future.result()
+                except Exception as e:
+                    failed += 1
+                    self._print_exception(e, futures[future])
+                    continue
 
+                if not product.get('id'):
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f"{futures[future]} | {product.get('message', product)}"))
+                    continue
+
+                products.append(build_product(product))
+                if len(products) >= batch_size:
+                    self.insert(products, dry_run)
+                    inserted += len(products)
+                    products = []
+
+        self.insert(products, dry_run)
+        inserted += len(products)
+        finished = time.monotonic()
+
+        action = 'would insert' if dry_run else 'inserted'
+        failed = f", {failed} failed" if failed else ''
         self.stdout.write(
             self.style.SUCCESS(
-                f"Fetched {len(paypal_products)} products and inserted {len(product_ids)} products successfully"
+                f"Fetched {len(product_ids)} products and {action} {inserted} products successfully{failed}"
             )
         )
+        self.stdout.write(
+            f"Listing: {listed - started:.2f}s | Details and insert: {finished - listed:.2f}s | "
+            f"Total: {finished - started:.2f}s"
+        )
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from paypal.outbox import OutboxProcessor
+
+
+class Command(BaseCommand):
+    help = 'Sends pending PayPal API calls recorded in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Messages claimed per batch')
+        parser.add_argument('--workers', type=int, default=4, help='Objects processed in parallel')
+        parser.add_argument('--max-attempts', type=int, default=8, help='Attempts before a message is marked failed')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new messages')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        processor = OutboxProcessor(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            max_attempts=options['max_attempts']
+        )
+
+        while True:
+            processed = processor.process_all()
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f"Processed {processed} outbox messages"))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from paypal.models import WebhookEvent
+from paypal.webhook.processor import WebhookProcessor
+
+
+class Command(BaseCommand):
+    help = 'Applies stored PayPal webhook events to products, plans, subscriptions and profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Events claimed per batch')
+        parser.add_argument('--workers', type=int, default=4, help='Resource partitions processed in parallel')
+        parser.add_argument('--retry-failed', action='store_true', help='Process failed events again')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        processor = WebhookProcessor(batch_size=options['batch_size'], workers=options['workers'])
+
+        if options['retry_failed']:
+            count = WebhookEvent.objects.filter(status=WebhookEvent.Status.FAILED).update(
+                status=WebhookEvent.Status.RECEIVED
+            )
+            self.stdout.write(f"Retrying {count} failed events")
+
+        while True:
+            start = time.monotonic()
+            processed = processor.process_all()
+            if processed:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Processed {processed} webhook events in {time.monotonic() - start:.2f}s"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from paypal.sandbox.server import PayPalSandboxServer, SandboxState
+
+
+class Command(BaseCommand):
+    help = 'Serves a local stand-in of the PayPal REST API, point PAYPAL_BASE_URL at it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Standard deviation of the latency in seconds')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503')
+        parser.add_argument('--page-size', type=int, default=20, help='Largest page the list endpoints return')
+        parser.add_argument('--products', type=int, default=100, help='Products to seed')
+        parser.add_argument('--plans', type=int, default=200, help='Billing plans to seed')
+        parser.add_argument('--subscriptions', type=int, default=500, help='Subscriptions to seed')
+
+    def handle(self, *args, **options):
+        server = PayPalSandboxServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            max_page_size=options['page_size'],
+            state=SandboxState(options['products'], options['plans'], options['subscriptions'])
+        )
+        self.stdout.write(self.style.SUCCESS(f"PayPal sandbox listening on {server.url}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
@@ -0,0 +1,66 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from paypal.importers import SubscriptionSync
+
+
+class Command(BaseCommand):
+    help = 'Mirrors PayPal subscriptions into the local Subscription and Subscriber tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--initial',
+            action='store_true',
+            help='Load every known subscription instead of only the due ones'
+        )
+        parser.add_argument('--ids-file', help='Extra subscription ids for --initial, one per line')
+        parser.add_argument('--stale-hours', type=float, default=24, help='Re-fetch subscriptions synced before this')
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel subscription requests')
+        parser.add_argument('--batch-size', type=int, default=500, help='Subscriptions per bulk write')
+        parser.add_argument('--loop', action='store_true', help='Keep reconciling')
+        parser.add_argument('--interval', type=float, default=300, help='Seconds between runs with --loop')
+
+    def _print_exception(self, e, prefix: str = None):
+        prefix = f'{prefix} | ' if prefix else ''
+        if isinstance(e, Exception):
+            self.stdout.write(self.style.ERROR(f"{prefix}{type(e).__name__} | {e}"))
+        else:
+            self.stdout.write(self.style.ERROR(f"{prefix}{e}"))
+
+    def build_sync(self, options) -> SubscriptionSync:
+        return SubscriptionSync(
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            stale_after=timedelta(hours=options['stale_hours']),
+            on_error=lambda subscription_id, error: self._print_exception(error, subscription_id)
+        )
+
+    def report(self, result: dict, started: float):
+        failed = f", {result['failed']} failed" if result['failed'] else ''
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Fetched {result['fetched']} subscriptions, created {result['created']} "
+                f"and updated {result['updated']}{failed}"
+            )
+        )
+        self.stdout.write(f"Total: {time.monotonic() - started:.2f}s")
+
+    def handle(self, *args, **options):
+        if options['initial']:
+            extra_ids = []
+            if options['ids_file']:
+                with open(options['ids_file']) as f:
+                    extra_ids = [line.strip() for line in f if line.strip()]
+            started = time.monotonic()
+            self.report(self.build_sync(options).initial_load(extra_ids), started)
+
+        while True:
+            started = time.monotonic()
+            result = self.build_sync(options).reconcile()
+            if result['fetched'] or result['failed'] or not options['loop']:
+                self.report(result, started)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
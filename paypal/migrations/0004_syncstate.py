@@ -0,0 +1,27 @@
+# Generated by Django 3.1.7 on 2026-10-17 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0003_subscriber_subscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(choices=[('PRODUCTS', 'Products'), ('BILLING_PLANS', 'Billing Plans')], max_length=40, unique=True, verbose_name='Resource')),
+                ('high_water_mark', models.DateTimeField(blank=True, null=True, verbose_name='High Water Mark')),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Synced At')),
+            ],
+            options={
+                'verbose_name': 'Sync State',
+                'verbose_name_plural': 'Sync States',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
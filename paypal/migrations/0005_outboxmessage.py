@@ -0,0 +1,60 @@
+# Generated by Django 3.1.7 on 2026-10-17 19:05
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0004_syncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+                ('action', models.CharField(choices=[('CREATE_PRODUCT', 'Create Product'), ('UPDATE_PRODUCT', 'Update Product'), ('CREATE_PLAN', 'Create Plan'), ('UPDATE_PLAN', 'Update Plan'), ('UPDATE_PLAN_PRICING', 'Update Plan Pricing')], max_length=40, verbose_name='Action')),
+                ('object_type', models.CharField(max_length=40, verbose_name='Object Type')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Object ID')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Payload')),
+                ('request_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Request ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=20, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next Attempt At')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last Error')),
+            ],
+            options={
+                'verbose_name': 'Outbox Message',
+                'verbose_name_plural': 'Outbox Messages',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='create_time',
+            field=models.DateTimeField(null=True, verbose_name='Create Time'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='product_id',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True, verbose_name='Product ID'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='update_time',
+            field=models.DateTimeField(null=True, verbose_name='Update Time'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='paypal_outb_status_1d0c22_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['object_type', 'object_id'], name='paypal_outb_object__cd1536_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.1.7 on 2026-10-17 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0005_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+                ('event_id', models.CharField(max_length=64, unique=True, verbose_name='Event ID')),
+                ('event_type', models.CharField(max_length=80, verbose_name='Event Type')),
+                ('resource_type', models.CharField(blank=True, max_length=40, verbose_name='Resource Type')),
+                ('resource_id', models.CharField(blank=True, max_length=160, verbose_name='Resource ID')),
+                ('payload', models.JSONField(default=dict, verbose_name='Payload')),
+                ('event_time', models.DateTimeField(blank=True, null=True, verbose_name='Event Time')),
+                ('status', models.CharField(choices=[('RECEIVED', 'Received'), ('PROCESSING', 'Processing'), ('PROCESSED', 'Processed'), ('IGNORED', 'Ignored'), ('FAILED', 'Failed')], default='RECEIVED', max_length=20, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Processed At')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last Error')),
+            ],
+            options={
+                'verbose_name': 'Webhook Event',
+                'verbose_name_plural': 'Webhook Events',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['status', 'id'], name='paypal_webh_status_491323_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['resource_type', 'resource_id'], name='paypal_webh_resourc_3b9b40_idx'),
+        ),
+    ]
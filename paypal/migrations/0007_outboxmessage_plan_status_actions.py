@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-17 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0006_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxmessage',
+            name='action',
+            field=models.CharField(choices=[('CREATE_PRODUCT', 'Create Product'), ('UPDATE_PRODUCT', 'Update Product'), ('CREATE_PLAN', 'Create Plan'), ('UPDATE_PLAN', 'Update Plan'), ('UPDATE_PLAN_PRICING', 'Update Plan Pricing'), ('ACTIVATE_PLAN', 'Activate Plan'), ('DEACTIVATE_PLAN', 'Deactivate Plan')], max_length=40, verbose_name='Action'),
+        ),
+    ]
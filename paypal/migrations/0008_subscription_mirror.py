@@ -0,0 +1,36 @@
+# Generated by Django 3.1.7 on 2026-10-17 19:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('paypal', '0007_outboxmessage_plan_status_actions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='next_billing_time',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Next Billing Time'),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Synced At'),
+        ),
+        migrations.AlterField(
+            model_name='subscription',
+            name='shipping_amount',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='paypal.amount', verbose_name='Shipping Amount'),
+        ),
+        migrations.AlterField(
+            model_name='subscription',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='paypal_subscriptions', to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+    ]
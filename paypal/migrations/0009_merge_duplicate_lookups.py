@@ -0,0 +1,53 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+# Rows that 0010 makes unique may already exist several times (racing get_or_create / imports).
+# The oldest row of every group is kept, references to the others are moved to it before they are deleted.
+
+# model, fields that must be unique, [(referencing model, foreign key)]
+DUPLICATES = [
+    ('Amount', ['currency_code', 'value'], [
+        ('PricingScheme', 'fixed_price'), ('PaymentPreference', 'setup_fee'), ('Subscription', 'shipping_amount')
+    ]),
+    ('PricingScheme', ['fixed_price'], [('BillingCycle', 'pricing_scheme')]),
+    ('Frequency', ['interval_unit', 'interval_count'], [('BillingCycle', 'frequency')]),
+    ('BillingPlan', ['plan_id'], [('Subscription', 'plan')]),
+    ('Subscription', ['subscription_id'], [('Subscriber', 'subscription')]),
+]
+
+
+def merge_duplicates(apps, schema_editor):
+    for model_name, fields, references in DUPLICATES:
+        model = apps.get_model('paypal', model_name)
+        queryset = model.objects.all()
+        if model_name == 'BillingPlan':
+            queryset = queryset.exclude(plan_id='')
+
+        groups = queryset.order_by().values(*fields).annotate(keep=Min('id'), rows=Count('id')).filter(rows__gt=1)
+        for group in groups:
+            duplicates = list(
+                model.objects.filter(**{field: group[field] for field in fields}).exclude(
+                    id=group['keep']
+                ).values_list('id', flat=True)
+            )
+            for related_name, field in references:
+                related = apps.get_model('paypal', related_name).objects
+                moved = related.filter(**{f"{field}_id__in": duplicates})
+                if related.model._meta.get_field(field).one_to_one:
+                    # Only one row may point at the kept row, the others go with their duplicate
+                    if related.filter(**{f"{field}_id": group['keep']}).exists():
+                        continue
+                    moved = related.filter(pk=moved.order_by('pk').values_list('pk', flat=True).first())
+                moved.update(**{f"{field}_id": group['keep']})
+            model.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0008_subscription_mirror'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
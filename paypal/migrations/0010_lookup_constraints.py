@@ -0,0 +1,52 @@
+# Generated by Django 3.1.7 on 2026-10-17 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0009_merge_duplicate_lookups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='billingplan',
+            name='plan_id',
+            field=models.CharField(blank=True, db_index=True, max_length=128, verbose_name='Billing Plan ID'),
+        ),
+        migrations.AlterField(
+            model_name='subscriber',
+            name='email',
+            field=models.EmailField(db_index=True, max_length=254, verbose_name='Email'),
+        ),
+        migrations.AlterField(
+            model_name='subscription',
+            name='subscription_id',
+            field=models.CharField(max_length=160, unique=True, verbose_name='Subscription Id'),
+        ),
+        migrations.AddIndex(
+            model_name='billingplan',
+            index=models.Index(fields=['status', 'plan_id'], name='billing_plan_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'status'], name='subscription_user_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='amount',
+            constraint=models.UniqueConstraint(fields=('currency_code', 'value'), name='unique_amount'),
+        ),
+        migrations.AddConstraint(
+            model_name='billingplan',
+            constraint=models.UniqueConstraint(condition=models.Q(_negated=True, plan_id=''), fields=('plan_id',), name='unique_plan_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='frequency',
+            constraint=models.UniqueConstraint(fields=('interval_unit', 'interval_count'), name='unique_frequency'),
+        ),
+        migrations.AddConstraint(
+            model_name='pricingscheme',
+            constraint=models.UniqueConstraint(fields=('fixed_price',), name='unique_pricing_scheme'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.1.7 on 2026-10-17 19:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('paypal', '0010_lookup_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+                ('order_id', models.CharField(blank=True, max_length=36, null=True, unique=True, verbose_name='Order ID')),
+                ('request_id', models.CharField(max_length=100, unique=True, verbose_name='Request ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('CREATED', 'Created'), ('SAVED', 'Saved'), ('APPROVED', 'Approved'), ('PAYER_ACTION_REQUIRED', 'Payer Action Required'), ('VOIDED', 'Voided'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=30, verbose_name='Status')),
+                ('currency_code', models.CharField(max_length=3, verbose_name='Currency Code')),
+                ('value', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Value')),
+                ('items', models.JSONField(blank=True, default=list, verbose_name='Items')),
+                ('links', models.JSONField(blank=True, default=list, verbose_name='Links')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last Error')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='paypal_orders', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Order',
+                'verbose_name_plural': 'Orders',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Capture',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+                ('capture_id', models.CharField(max_length=36, unique=True, verbose_name='Capture ID')),
+                ('status', models.CharField(max_length=30, verbose_name='Status')),
+                ('currency_code', models.CharField(max_length=3, verbose_name='Currency Code')),
+                ('value', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Value')),
+                ('create_time', models.DateTimeField(blank=True, null=True, verbose_name='Create Time')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='captures', to='paypal.order', verbose_name='Order')),
+            ],
+            options={
+                'verbose_name': 'Capture',
+                'verbose_name_plural': 'Captures',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='paypal_orde_user_id_c2711d_idx'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import copy
+import uuid
 from datetime import datetime
 
 from django.db import models
@@ -16,7 +18,55 @@ class AbstractTimestampModel(models.Model):
         abstract = True
 
 
-class Product(AbstractTimestampModel):
+class DirtyFieldsMixin(models.Model):
+    """
+    Keeps the field values an instance was loaded with, so changes can be detected without re-querying.
+    """
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def _copy(value):
+        # JSON fields can be changed in place, keep our own copy
+        return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: cls._copy(value) for name, value in zip(field_names, values)}
+        return instance
+
+    def get_dirty_fields(self, fields: list = None) -> dict:
+        # {field name: (loaded value, current value)} for the given fields (all loaded fields by default)
+        attnames = {field.name: field.attname for field in self._meta.concrete_fields}
+        fields = fields or list(attnames)
+
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            if self.pk is None:
+                return {}
+            # Not loaded through a queryset (e.g. built by hand with a pk), read the stored row once
+            loaded = type(self)._base_manager.filter(pk=self.pk).values(*[attnames[f] for f in fields]).first() or {}
+
+        dirty = {}
+        for field in fields:
+            attname = attnames[field]
+            if attname in loaded and loaded[attname] != getattr(self, attname):
+                dirty[field] = (loaded[attname], getattr(self, attname))
+        return dirty
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        loaded = getattr(self, '_loaded_values', {}) if update_fields else {}
+        for field in self._meta.concrete_fields:
+            if not update_fields or field.name in update_fields or field.attname in update_fields:
+                loaded[field.attname] = self._copy(getattr(self, field.attname))
+        self._loaded_values = loaded
+
+
+class Product(DirtyFieldsMixin, AbstractTimestampModel):
     # https://developer.paypal.com/docs/api/catalog-products/v1/#products_create
 
     class ProductType(models.TextChoices):
@@ -27,7 +77,8 @@ class Product(AbstractTimestampModel):
     class ProductCategory(models.TextChoices):
         SOFTWARE = 'SOFTWARE', _('Software')
 
-    product_id = models.CharField(verbose_name=_('Product ID'), max_length=50, unique=True)
+    # Filled in by the outbox worker once PayPal has created the product
+    product_id = models.CharField(verbose_name=_('Product ID'), max_length=50, unique=True, blank=True, null=True)
     name = models.CharField(verbose_name=_('Name'), max_length=127)
     description = models.CharField(verbose_name=_('Description'), max_length=256)
     type = models.CharField(verbose_name=_('Type'), max_length=24, choices=ProductType.choices)
@@ -35,8 +86,8 @@ class Product(AbstractTimestampModel):
     image_url = models.URLField(verbose_name=_('Image URL'), blank=True)
     home_url = models.URLField(verbose_name=_('Home URL'), blank=True)
 
-    create_time = models.DateTimeField(verbose_name=_('Create Time'))
-    update_time = models.DateTimeField(verbose_name=_('Update Time'))
+    create_time = models.DateTimeField(verbose_name=_('Create Time'), null=True)
+    update_time = models.DateTimeField(verbose_name=_('Update Time'), null=True)
     links = models.JSONField(verbose_name=_('Links'), default=list, blank=True)
 
     class Meta:
@@ -48,7 +99,7 @@ class Product(AbstractTimestampModel):
         return self.name
 
 
-class BillingPlan(AbstractTimestampModel):
+class BillingPlan(DirtyFieldsMixin, AbstractTimestampModel):
     # https://developer.paypal.com/docs/subscriptions/full-integration/plan-management/
 
     class BillingPlanStatus(models.TextChoices):
@@ -56,7 +107,7 @@ class BillingPlan(AbstractTimestampModel):
         ACTIVE = 'ACTIVE', _('Active')
         INACTIVE = 'INACTIVE', _('Inactive')
 
-    plan_id = models.CharField(verbose_name=_('Billing Plan ID'), max_length=128, blank=True)
+    plan_id = models.CharField(verbose_name=_('Billing Plan ID'), max_length=128, blank=True, db_index=True)
     product = models.ForeignKey(
         verbose_name=_('Product'),
         to='Product',
@@ -82,15 +133,17 @@ class BillingPlan(AbstractTimestampModel):
         ordering = ['-id']
         verbose_name = _('Billing Plan')
         verbose_name_plural = _('Billing Plans')
+        constraints = [
+            # Plans that aren't on PayPal yet have no plan_id
+            models.UniqueConstraint(fields=['plan_id'], condition=~models.Q(plan_id=''), name='unique_plan_id'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'plan_id'], name='billing_plan_status_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
-    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        if self.id:
-            self.old_instance = self.__class__.objects.get(id=self.id)
-        return super().save(force_insert, force_update, using, update_fields)
-
 
 class Amount(models.Model):
     currency_code = models.CharField(verbose_name=_('Currency Code'), max_length=40)
@@ -100,6 +153,9 @@ class Amount(models.Model):
         ordering = ['-id']
         verbose_name = _('Amount')
         verbose_name_plural = _('Amounts')
+        constraints = [
+            models.UniqueConstraint(fields=['currency_code', 'value'], name='unique_amount'),
+        ]
 
     def __str__(self):
         return f"{self.currency_code} {self.value}"
@@ -116,6 +172,9 @@ class Frequency(models.Model):
         ordering = ['-id']
         verbose_name = _('Frequency')
         verbose_name_plural = _('Frequencies')
+        constraints = [
+            models.UniqueConstraint(fields=['interval_unit', 'interval_count'], name='unique_frequency'),
+        ]
 
     def __str__(self):
         return f"{self.interval_count} ({self.interval_unit})"
@@ -133,12 +192,15 @@ class PricingScheme(models.Model):
         ordering = ['-id']
         verbose_name = _('Pricing Scheme')
         verbose_name_plural = _('Pricing Schemes')
+        constraints = [
+            models.UniqueConstraint(fields=['fixed_price'], name='unique_pricing_scheme'),
+        ]
 
     def __str__(self):
         return self.fixed_price.__str__()
 
 
-class BillingCycle(models.Model):
+class BillingCycle(DirtyFieldsMixin, models.Model):
     class TenureType(models.TextChoices):
         TRIAL = 'TRIAL', _('Trial')
         REGULAR = 'REGULAR', _('Regular')
@@ -176,7 +238,7 @@ class BillingCycle(models.Model):
         return f"{self.tenure_type} ({self.frequency})"
 
 
-class PaymentPreference(models.Model):
+class PaymentPreference(DirtyFieldsMixin, models.Model):
     class SetupFeeFailureAction(models.TextChoices):
         CONTINUE = 'CONTINUE', _('Continue')
 
@@ -214,11 +276,14 @@ class Subscription(models.Model):
         INACTIVE = 'INACTIVE', _('Inactive')
         SUSPENDED = 'SUSPENDED', _('Suspended')
 
+    # Empty for subscriptions mirrored from PayPal that couldn't be matched to a user
     user = models.ForeignKey(
         verbose_name=_('User'),
         to=User,
         related_name='paypal_subscriptions',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True
     )
     plan = models.ForeignKey(
         verbose_name=_('Plan'),
@@ -227,23 +292,33 @@ class Subscription(models.Model):
         on_delete=models.CASCADE
     )
 
-    subscription_id = models.CharField(verbose_name=_('Subscription Id'), max_length=160)
+    subscription_id = models.CharField(verbose_name=_('Subscription Id'), max_length=160, unique=True)
     status = models.CharField(verbose_name=_('Status'), max_length=40, choices=SubscriptionStatus.choices)
     start_time = models.DateTimeField(verbose_name=_('Start Time'))
     shipping_amount = models.ForeignKey(
         verbose_name=_('Shipping Amount'),
         to='Amount',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True
     )
     billing_info = models.JSONField(verbose_name=_('Billing Info'), default=dict, blank=True)
+    next_billing_time = models.DateTimeField(verbose_name=_('Next Billing Time'), blank=True, null=True, db_index=True)
     create_time = models.DateTimeField(verbose_name=_('Create Time'))
     update_time = models.DateTimeField(verbose_name=_('Update Time'))
     links = models.JSONField(verbose_name=_('Links'), default=list)
+    # Last time the row was refreshed from PayPal
+    synced_at = models.DateTimeField(verbose_name=_('Synced At'), blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'status'], name='subscription_user_status_idx'),
+        ]
 
 
 class Subscriber(models.Model):
     name = models.JSONField(verbose_name=_('Name'), default=dict)
-    email = models.EmailField(verbose_name=_('Email'))
+    email = models.EmailField(verbose_name=_('Email'), db_index=True)
     subscription = models.OneToOneField(
         verbose_name=_('Subscription'),
         to='Subscription',
@@ -280,10 +355,188 @@ class PayPalProfile(AbstractTimestampModel):
     def has_subscription(self) -> bool:
         if not self.subscription_valid_till:
             return False
-        return self.subscription_valid_till <= timezone.now()
+        return self.subscription_valid_till > timezone.now()
 
     def update_validity(self, dt: datetime):
         self.subscription_valid_till = dt
         self.save(update_fields=['subscription_valid_till', 'modified_date'])
         self.refresh_from_db()
 
+
+class SyncState(models.Model):
+    # High-water marks for incremental PayPal -> DB syncs
+
+    class Resource(models.TextChoices):
+        PRODUCTS = 'PRODUCTS', _('Products')
+        BILLING_PLANS = 'BILLING_PLANS', _('Billing Plans')
+
+    resource = models.CharField(verbose_name=_('Resource'), max_length=40, choices=Resource.choices, unique=True)
+    high_water_mark = models.DateTimeField(verbose_name=_('High Water Mark'), blank=True, null=True)
+    last_synced_at = models.DateTimeField(verbose_name=_('Last Synced At'), blank=True, null=True)
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = _('Sync State')
+        verbose_name_plural = _('Sync States')
+
+    def __str__(self):
+        return self.resource
+
+
+class OutboxMessage(AbstractTimestampModel):
+    # PayPal API calls recorded in the same transaction as the model change, sent later by paypal.outbox
+
+    class Action(models.TextChoices):
+        CREATE_PRODUCT = 'CREATE_PRODUCT', _('Create Product')
+        UPDATE_PRODUCT = 'UPDATE_PRODUCT', _('Update Product')
+        CREATE_PLAN = 'CREATE_PLAN', _('Create Plan')
+        UPDATE_PLAN = 'UPDATE_PLAN', _('Update Plan')
+        UPDATE_PLAN_PRICING = 'UPDATE_PLAN_PRICING', _('Update Plan Pricing')
+        ACTIVATE_PLAN = 'ACTIVATE_PLAN', _('Activate Plan')
+        DEACTIVATE_PLAN = 'DEACTIVATE_PLAN', _('Deactivate Plan')
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', _('Pending')
+        PROCESSING = 'PROCESSING', _('Processing')
+        DONE = 'DONE', _('Done')
+        FAILED = 'FAILED', _('Failed')
+
+    action = models.CharField(verbose_name=_('Action'), max_length=40, choices=Action.choices)
+    object_type = models.CharField(verbose_name=_('Object Type'), max_length=40)
+    object_id = models.PositiveIntegerField(verbose_name=_('Object ID'))
+    payload = models.JSONField(verbose_name=_('Payload'), default=dict, blank=True)
+    # Sent as PayPal-Request-Id so a retried call is not applied twice
+    request_id = models.UUIDField(verbose_name=_('Request ID'), default=uuid.uuid4, unique=True, editable=False)
+
+    status = models.CharField(
+        verbose_name=_('Status'),
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+    attempts = models.PositiveIntegerField(verbose_name=_('Attempts'), default=0)
+    next_attempt_at = models.DateTimeField(verbose_name=_('Next Attempt At'), default=timezone.now)
+    last_error = models.TextField(verbose_name=_('Last Error'), blank=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('Outbox Message')
+        verbose_name_plural = _('Outbox Messages')
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['object_type', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.action} ({self.object_type} {self.object_id})"
+
+
+class WebhookEvent(AbstractTimestampModel):
+    # Raw PayPal webhook events, stored before they are processed
+
+    class Status(models.TextChoices):
+        RECEIVED = 'RECEIVED', _('Received')
+        PROCESSING = 'PROCESSING', _('Processing')
+        PROCESSED = 'PROCESSED', _('Processed')
+        IGNORED = 'IGNORED', _('Ignored')
+        FAILED = 'FAILED', _('Failed')
+
+    event_id = models.CharField(verbose_name=_('Event ID'), max_length=64, unique=True)
+    event_type = models.CharField(verbose_name=_('Event Type'), max_length=80)
+    resource_type = models.CharField(verbose_name=_('Resource Type'), max_length=40, blank=True)
+    resource_id = models.CharField(verbose_name=_('Resource ID'), max_length=160, blank=True)
+    payload = models.JSONField(verbose_name=_('Payload'), default=dict)
+    event_time = models.DateTimeField(verbose_name=_('Event Time'), blank=True, null=True)
+
+    status = models.CharField(
+        verbose_name=_('Status'),
+        max_length=20,
+        choices=Status.choices,
+        default=Status.RECEIVED
+    )
+    attempts = models.PositiveIntegerField(verbose_name=_('Attempts'), default=0)
+    processed_at = models.DateTimeField(verbose_name=_('Processed At'), blank=True, null=True)
+    last_error = models.TextField(verbose_name=_('Last Error'), blank=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('Webhook Event')
+        verbose_name_plural = _('Webhook Events')
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['resource_type', 'resource_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} ({self.event_id})"
+
+
+class Order(AbstractTimestampModel):
+    # https://developer.paypal.com/docs/api/orders/v2/
+
+    class OrderStatus(models.TextChoices):
+        # Stored before PayPal answered, the request can be retried with the same request_id
+        PENDING = 'PENDING', _('Pending')
+        CREATED = 'CREATED', _('Created')
+        SAVED = 'SAVED', _('Saved')
+        APPROVED = 'APPROVED', _('Approved')
+        PAYER_ACTION_REQUIRED = 'PAYER_ACTION_REQUIRED', _('Payer Action Required')
+        VOIDED = 'VOIDED', _('Voided')
+        COMPLETED = 'COMPLETED', _('Completed')
+        FAILED = 'FAILED', _('Failed')
+
+    user = models.ForeignKey(
+        verbose_name=_('User'),
+        to=User,
+        related_name='paypal_orders',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    order_id = models.CharField(verbose_name=_('Order ID'), max_length=36, unique=True, blank=True, null=True)
+    # Client supplied idempotency key, sent to PayPal as PayPal-Request-Id (with a suffix for the capture)
+    request_id = models.CharField(verbose_name=_('Request ID'), max_length=100, unique=True)
+    status = models.CharField(
+        verbose_name=_('Status'),
+        max_length=30,
+        choices=OrderStatus.choices,
+        default=OrderStatus.PENDING
+    )
+    currency_code = models.CharField(verbose_name=_('Currency Code'), max_length=3)
+    value = models.DecimalField(verbose_name=_('Value'), max_digits=12, decimal_places=2)
+    items = models.JSONField(verbose_name=_('Items'), default=list, blank=True)
+    links = models.JSONField(verbose_name=_('Links'), default=list, blank=True)
+    last_error = models.TextField(verbose_name=_('Last Error'), blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = _('Order')
+        verbose_name_plural = _('Orders')
+        indexes = [
+            models.Index(fields=['user', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id or self.request_id} ({self.currency_code} {self.value})"
+
+
+class Capture(AbstractTimestampModel):
+    order = models.ForeignKey(
+        verbose_name=_('Order'),
+        to='Order',
+        related_name='captures',
+        on_delete=models.CASCADE
+    )
+    capture_id = models.CharField(verbose_name=_('Capture ID'), max_length=36, unique=True)
+    status = models.CharField(verbose_name=_('Status'), max_length=30)
+    currency_code = models.CharField(verbose_name=_('Currency Code'), max_length=3)
+    value = models.DecimalField(verbose_name=_('Value'), max_digits=12, decimal_places=2)
+    create_time = models.DateTimeField(verbose_name=_('Create Time'), blank=True, null=True)
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = _('Capture')
+        verbose_name_plural = _('Captures')
+
+    def __str__(self):
+        return f"{self.capture_id} ({self.currency_code} {self.value})"
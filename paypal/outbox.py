@@ -0,0 +1,308 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from paypal import plans
+from paypal.models import OutboxMessage, Product, BillingPlan
+from paypal.serializers import build_plan_data, build_pricing_data, build_product_data, plan_queryset
+from paypal.utils.base import UpdateResult
+from paypal.utils.billing_plan import PayPalBillingPlan
+from paypal.utils.product import PayPalProduct
+
+Action = OutboxMessage.Action
+Status = OutboxMessage.Status
+
+
+class OutboxError(Exception):
+    pass
+
+
+def enqueue(action: str, instance, payload: dict = None) -> OutboxMessage:
+    """
+    Records a PayPal call for `instance`. Call it inside the transaction that changes the instance,
+    the message is then only sent if that transaction commits.
+    """
+    message = OutboxMessage.objects.create(
+        action=action,
+        object_type=instance._meta.model_name,
+        object_id=instance.pk,
+        payload=payload or {}
+    )
+    if getattr(settings, 'PAYPAL_OUTBOX_AUTO_PROCESS', False):
+        transaction.on_commit(process_in_background)
+    return message
+
+
+def enqueue_many(action: str, instances: list, payload: dict = None) -> list:
+    # enqueue() for many objects with a single insert
+    messages = OutboxMessage.objects.bulk_create([
+        OutboxMessage(
+            action=action,
+            object_type=instance._meta.model_name,
+            object_id=instance.pk,
+            payload=payload or {}
+        ) for instance in instances
+    ], batch_size=500)
+    if messages and getattr(settings, 'PAYPAL_OUTBOX_AUTO_PROCESS', False):
+        transaction.on_commit(process_in_background)
+    return messages
+
+
+def enqueue_pricing(plan, schemes: dict) -> OutboxMessage:
+    """
+    Records the pricing scheme pks that billing cycles had before a change, {cycle sequence: pk}.
+    Merged into the plan's pending UPDATE_PLAN_PRICING message when there is one, so a plan whose
+    cycles are saved one by one is repriced with a single call.
+    """
+    schemes = {str(sequence): pk for sequence, pk in schemes.items()}
+    pending = OutboxMessage.objects.filter(
+        action=Action.UPDATE_PLAN_PRICING,
+        object_type=plan._meta.model_name,
+        object_id=plan.pk,
+        status=Status.PENDING
+    ).order_by('id').first()
+    if pending is not None:
+        # The earlier snapshot holds the price PayPal still has, it wins over ours
+        payload = {"schemes": {**schemes, **pending.payload.get('schemes', {})}}
+        if OutboxMessage.objects.filter(id=pending.id, status=Status.PENDING).update(payload=payload):
+            pending.payload = payload
+            return pending
+    return enqueue(Action.UPDATE_PLAN_PRICING, plan, {"schemes": schemes})
+
+
+class OutboxProcessor:
+    """
+    Drains pending OutboxMessages in batches.
+    Messages for the same object are sent in order, different objects are sent in parallel.
+    """
+
+    def __init__(self, batch_size: int = 50, workers: int = 4, max_attempts: int = 8, backoff: int = 30,
+                 stale_after: int = 600):
+        self.batch_size = max(batch_size, 1)
+        self.workers = max(workers, 1)
+        self.max_attempts = max_attempts
+        # Seconds before the first retry, doubled on every further attempt
+        self.backoff = backoff
+        # Messages left PROCESSING this long belong to a worker that died and are picked up again
+        self.stale_after = stale_after
+        self.product_helper = PayPalProduct()
+        self.plan_helper = PayPalBillingPlan()
+        self.handlers = {
+            Action.CREATE_PRODUCT: self.create_product,
+            Action.UPDATE_PRODUCT: self.update_product,
+            Action.CREATE_PLAN: self.create_plan,
+            Action.UPDATE_PLAN: self.update_plan,
+            Action.UPDATE_PLAN_PRICING: self.update_plan_pricing,
+            Action.ACTIVATE_PLAN: self.set_plan_status,
+            Action.DEACTIVATE_PLAN: self.set_plan_status,
+        }
+
+    def claim(self) -> list:
+        now = timezone.now()
+        OutboxMessage.objects.filter(
+            status=Status.PROCESSING,
+            modified_date__lt=now - timedelta(seconds=self.stale_after)
+        ).update(status=Status.PENDING)
+
+        with transaction.atomic():
+            busy = set(
+                OutboxMessage.objects.filter(status=Status.PROCESSING).values_list('object_type', 'object_id')
+            )
+            candidates = OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+                status=Status.PENDING,
+                next_attempt_at__lte=now
+            ).order_by('id').values_list('id', 'object_type', 'object_id')[:self.batch_size]
+            ids = [pk for pk, object_type, object_id in candidates if (object_type, object_id) not in busy]
+
+            OutboxMessage.objects.filter(id__in=ids, status=Status.PENDING).update(
+                status=Status.PROCESSING,
+                attempts=F('attempts') + 1,
+                modified_date=now
+            )
+        return list(OutboxMessage.objects.filter(id__in=ids, status=Status.PROCESSING).order_by('id'))
+
+    def process_batch(self) -> int:
+        messages = self.claim()
+        groups = OrderedDict()
+        for message in messages:
+            groups.setdefault((message.object_type, message.object_id), []).append(message)
+
+        # Products go first, plans created in the same batch reference them
+        for object_types in (['product'], ['billingplan']):
+            phase = [group for (object_type, _), group in groups.items() if object_type in object_types]
+            if len(phase) <= 1 or self.workers == 1:
+                for group in phase:
+                    self.process_group(group)
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(phase))) as executor:
+                    list(executor.map(self._process_group_in_thread, phase))
+        return len(messages)
+
+    def process_all(self) -> int:
+        processed = 0
+        while True:
+            count = self.process_batch()
+            processed += count
+            if count < self.batch_size:
+                return processed
+
+    def _process_group_in_thread(self, messages: list):
+        try:
+            self.process_group(messages)
+        finally:
+            close_old_connections()
+
+    def process_group(self, messages: list):
+        for index, message in enumerate(messages):
+            try:
+                self.handlers[message.action](message)
+            except Exception as e:
+                self.fail(message, e, messages[index + 1:])
+                return
+            OutboxMessage.objects.filter(id=message.id).update(
+                status=Status.DONE,
+                last_error='',
+                modified_date=timezone.now()
+            )
+
+    def fail(self, message: OutboxMessage, error: Exception, pending: list):
+        status = Status.FAILED if message.attempts >= self.max_attempts else Status.PENDING
+        next_attempt_at = timezone.now() + timedelta(seconds=self.backoff * 2 ** (message.attempts - 1))
+        OutboxMessage.objects.filter(id=message.id).update(
+            status=status,
+            next_attempt_at=next_attempt_at,
+            last_error=f"{type(error).__name__} | {error}",
+            modified_date=timezone.now()
+        )
+        # Later messages for the same object must wait for this one
+        OutboxMessage.objects.filter(id__in=[m.id for m in pending]).update(
+            status=Status.PENDING,
+            attempts=F('attempts') - 1,
+            next_attempt_at=next_attempt_at
+        )
+        OutboxMessage.objects.filter(
+            object_type=message.object_type,
+            object_id=message.object_id,
+            status=Status.PENDING,
+            id__gt=message.id,
+            next_attempt_at__lt=next_attempt_at
+        ).update(next_attempt_at=next_attempt_at)
+
+    @staticmethod
+    def _check(result: UpdateResult) -> UpdateResult:
+        if not result.ok:
+            raise OutboxError(f"{result.status_code} {result.data.get('message', result.data)}")
+        return result
+
+    def create_product(self, message: OutboxMessage):
+        product = Product.objects.filter(id=message.object_id).first()
+        if product is None or product.product_id:
+            return
+
+        data = self.product_helper.create_product(build_product_data(product), request_id=message.request_id)
+        if not data.get('id'):
+            raise OutboxError(data.get('message', data))
+        Product.objects.filter(id=product.id).update(
+            product_id=data.get('id'),
+            create_time=data.get('create_time'),
+            update_time=data.get('create_time'),
+            links=data.get('links', [])
+        )
+
+    def update_product(self, message: OutboxMessage):
+        product = Product.objects.filter(id=message.object_id).first()
+        if product is None:
+            return
+        if not product.product_id:
+            raise OutboxError("Product is not created on PayPal yet")
+
+        result = self._check(self.product_helper.update_product(product.product_id, message.payload['paths']))
+        Product.objects.filter(id=product.id).update(update_time=result.update_time)
+
+    def create_plan(self, message: OutboxMessage):
+        plan = plan_queryset().filter(id=message.object_id).first()
+        if plan is None or plan.plan_id:
+            return
+        if not plan.product.product_id:
+            raise OutboxError("Product is not created on PayPal yet")
+
+        data = self.plan_helper.create_billing_plan(build_plan_data(plan), request_id=message.request_id)
+        if not data.get('id'):
+            raise OutboxError(data.get('message', data))
+        BillingPlan.objects.filter(id=plan.id).update(
+            plan_id=data.get('id'),
+            quantity_supported=data.get('quantity_supported', False),
+            create_time=data.get('create_time'),
+            update_time=data.get('create_time'),
+            links=data.get('links', [])
+        )
+        plans.invalidate()
+
+    def update_plan(self, message: OutboxMessage):
+        plan = BillingPlan.objects.filter(id=message.object_id).first()
+        if plan is None:
+            return
+        if not plan.plan_id:
+            raise OutboxError("Plan is not created on PayPal yet")
+
+        result = self._check(self.plan_helper.update_billing_plan(plan.plan_id, message.payload['paths']))
+        BillingPlan.objects.filter(id=plan.id).update(update_time=result.update_time)
+        plans.invalidate()
+
+    def update_plan_pricing(self, message: OutboxMessage):
+        plan = plan_queryset().filter(id=message.object_id).first()
+        if plan is None:
+            return
+        if not plan.plan_id:
+            raise OutboxError("Plan is not created on PayPal yet")
+
+        # Pricing schemes per cycle sequence before the cycles were changed
+        snapshot = {int(sequence): scheme for sequence, scheme in message.payload.get('schemes', {}).items()}
+        data = build_pricing_data(plan, snapshot)
+        if data:
+            result = self._check(self.plan_helper.update_pricing(plan.plan_id, data, request_id=message.request_id))
+            BillingPlan.objects.filter(id=plan.id).update(update_time=result.update_time)
+            plans.invalidate()
+
+    def set_plan_status(self, message: OutboxMessage):
+        plan = BillingPlan.objects.filter(id=message.object_id).first()
+        if plan is None:
+            return
+        if not plan.plan_id:
+            raise OutboxError("Plan is not created on PayPal yet")
+
+        if message.action == Action.ACTIVATE_PLAN:
+            result = self._check(self.plan_helper.activate_billing_plan(plan.plan_id))
+            status = BillingPlan.BillingPlanStatus.ACTIVE
+        else:
+            result = self._check(self.plan_helper.deactivate_billing_plan(plan.plan_id))
+            status = BillingPlan.BillingPlanStatus.INACTIVE
+        BillingPlan.objects.filter(id=plan.id).update(status=status, update_time=result.update_time)
+        plans.invalidate()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def process_in_background():
+    # Drains the outbox on a single background thread of this process (PAYPAL_OUTBOX_AUTO_PROCESS)
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='paypal-outbox')
+    _executor.submit(_drain)
+
+
+def _drain():
+    try:
+        OutboxProcessor().process_all()
+    finally:
+        close_old_connections()
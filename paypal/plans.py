@@ -0,0 +1,48 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.functions import Coalesce
+
+from paypal.models import BillingPlan
+
+# Cached as one entry: [plan_id, POSIX timestamp of update_time] of every ACTIVE plan on PayPal, newest first.
+# Dropped whenever a plan is saved or its status or update_time is written in bulk.
+
+CACHE_KEY = "paypal:active-plans"
+
+
+def get_cache():
+    return caches[getattr(settings, 'PAYPAL_PLAN_CACHE', 'default')]
+
+
+def get_active_plans() -> dict:
+    cache = get_cache()
+    plans = cache.get(CACHE_KEY)
+    if plans is None:
+        queryset = BillingPlan.objects.filter(status=BillingPlan.BillingPlanStatus.ACTIVE).exclude(plan_id='')
+        plans = [
+            [plan_id, update_time.timestamp()]
+            for plan_id, update_time in queryset.values_list('plan_id', Coalesce('update_time', 'modified_date'))
+        ]
+        cache.set(CACHE_KEY, plans, getattr(settings, 'PAYPAL_PLAN_CACHE_TTL', 60 * 60))
+    return dict(plans)
+
+
+def get_active_plan(plan_id: str = None):
+    """
+    Returns (plan_id, last modified datetime) of the active plan `plan_id`, or of the newest active plan
+    without one. None when there is no such plan.
+    """
+    plans = get_active_plans()
+    if not plan_id:
+        plan_id = next(iter(plans), None)
+    if plan_id not in plans:
+        return None
+    return plan_id, datetime.fromtimestamp(plans[plan_id], dt_timezone.utc)
+
+
+def invalidate():
+    # Deferred to commit like entitlements.invalidate(), a reader could otherwise cache the old plans again
+    transaction.on_commit(lambda: get_cache().delete(CACHE_KEY))
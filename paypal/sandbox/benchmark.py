@@ -0,0 +1,354 @@
+import io
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+
+from paypal.utils.session import get_session
+
+
+def percentile(values: list, q: float) -> float:
+    # Linear interpolation between the closest ranks, like numpy's default
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(latencies: list, errors: int, duration: float, operations: int = None) -> dict:
+    operations = len(latencies) if operations is None else operations
+    return {
+        "operations": operations,
+        "errors": errors,
+        "duration_s": round(duration, 4),
+        "throughput_per_s": round(operations / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p90": round(percentile(latencies, 90) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0) * 1000, 2),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        }
+    }
+
+
+class RequestRecorder:
+    """
+    Records the latency and status of every request sent through the shared PayPal session.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, response, *args, **kwargs):
+        with self.lock:
+            self.latencies.append(response.elapsed.total_seconds())
+            if response.status_code >= 400:
+                self.errors += 1
+        return response
+
+    def __enter__(self):
+        get_session().hooks['response'].append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        get_session().hooks['response'].remove(self)
+
+
+def run_concurrently(operation, count: int, concurrency: int) -> dict:
+    # Calls operation(i) `count` times on `concurrency` threads, the latency of each call is one sample
+    latencies = []
+    errors = 0
+
+    def timed(index):
+        started = time.perf_counter()
+        operation(index)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in as_completed([executor.submit(timed, i) for i in range(count)]):
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    return summarize(latencies, errors, time.perf_counter() - started, operations=count)
+
+
+def run_command(name: str, concurrency: int) -> dict:
+    # Whole command run, the latency figures are those of the PayPal requests it sent
+    with RequestRecorder() as recorder:
+        started = time.perf_counter()
+        call_command(name, dry_run=True, concurrency=concurrency, stdout=io.StringIO())
+        duration = time.perf_counter() - started
+    result = summarize(recorder.latencies, recorder.errors, duration)
+    result["requests_per_s"] = result.pop("throughput_per_s")
+    return result
+
+
+def bench_product_sync(concurrency: int, requests: int) -> dict:
+    return run_command('fetch_and_insert_product_list', concurrency)
+
+
+def bench_plan_sync(concurrency: int, requests: int) -> dict:
+    return run_command('fetch_and_insert_plan_list', concurrency)
+
+
+@contextmanager
+def rolled_back():
+    # Nothing written inside is kept, like the lookup benchmark's seeded rows
+    from django.db import transaction
+
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def run_serially(operation, count: int) -> dict:
+    # Calls operation(i) `count` times on this thread, so on the connection of an open transaction
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for index in range(count):
+        call_started = time.perf_counter()
+        try:
+            operation(index)
+        except Exception:
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, errors, time.perf_counter() - started, operations=count)
+
+
+def run_plan_actions(concurrency: int, requests: int, selection: int) -> dict:
+    """
+    Runs the billing plan admin activate/deactivate actions (BillingPlanAdmin.set_status) on local copies of
+    `selection` sandbox plans, serially and in a transaction that is rolled back. Each action sends its PayPal
+    calls on `concurrency` threads, or only queues outbox messages above PAYPAL_ADMIN_SYNC_LIMIT plans.
+    """
+    import uuid
+    from django.contrib import admin, messages
+    from django.test import RequestFactory, override_settings
+    from paypal.admin import BillingPlanAdmin
+    from paypal.models import Product, BillingPlan
+    from paypal.utils.billing_plan import PayPalBillingPlan
+
+    class BenchmarkPlanAdmin(BillingPlanAdmin):
+        # Counts the failures the admin would show, there is no message storage without a session
+        failures = 0
+
+        def message_user(self, request, message, level=messages.INFO, *args, **kwargs):
+            if level == messages.ERROR:
+                self.failures += 1
+
+    plan_ids = [plan['id'] for plan in PayPalBillingPlan().iter_billing_plans()][:selection]
+    if len(plan_ids) < selection:
+        return summarize([], 0, 0)
+
+    model_admin = BenchmarkPlanAdmin(BillingPlan, admin.site)
+    request = RequestFactory().post('/admin/paypal/billingplan/')
+    with rolled_back(), override_settings(PAYPAL_ADMIN_CONCURRENCY=concurrency):
+        # bulk_create() sends no signals, the plans are already on PayPal
+        product_id = f"PROD-BENCH-{uuid.uuid4().hex[:8]}"
+        Product.objects.bulk_create([Product(
+            product_id=product_id, name='Benchmark', description='Benchmark', type='SERVICE', category='SOFTWARE'
+        )])
+        product = Product.objects.get(product_id=product_id)
+        BillingPlan.objects.bulk_create([
+            BillingPlan(plan_id=plan_id, product=product, name=plan_id, description='Benchmark')
+            for plan_id in plan_ids
+        ])
+        queryset = BillingPlan.objects.filter(product=product)
+
+        result = run_serially(lambda index: model_admin.set_status(request, queryset, active=bool(index % 2)), requests)
+    result["plans_per_action"] = selection
+    result["errors"] += model_admin.failures
+    return result
+
+
+def bench_plan_actions(concurrency: int, requests: int) -> dict:
+    # Selections the admin sends to PayPal right away
+    return run_plan_actions(concurrency, requests, getattr(settings, 'PAYPAL_ADMIN_SYNC_LIMIT', 50))
+
+
+def bench_queued_plan_actions(concurrency: int, requests: int) -> dict:
+    # One plan more than PAYPAL_ADMIN_SYNC_LIMIT, the admin only writes outbox messages
+    return run_plan_actions(concurrency, requests, getattr(settings, 'PAYPAL_ADMIN_SYNC_LIMIT', 50) + 1)
+
+
+def bench_orders(concurrency: int, requests: int) -> dict:
+    from paypal.utils.order import PayPalOrder
+
+    helper = PayPalOrder()
+
+    def create_and_capture(index):
+        order = helper.create_order("10.00")
+        capture = helper.capture_order(order.data['id'])
+        if capture.data.get('status') != 'COMPLETED':
+            raise ValueError(capture.data)
+
+    return run_concurrently(create_and_capture, requests, concurrency)
+
+
+def bench_checkout(concurrency: int, requests: int) -> dict:
+    # The checkout endpoints' work: an idempotent create stored in Order, then the capture stored in Capture.
+    # Serial, in a transaction that is rolled back like the lookup benchmark's, so the orders aren't kept.
+    import uuid
+    from decimal import Decimal
+    from paypal.checkout.service import create_order, capture_order
+
+    prefix = uuid.uuid4().hex[:8]
+    items = [{"name": "Ticket", "unit_amount": "12.50", "quantity": 2}]
+
+    def create_and_capture(index):
+        order, _ = create_order(f"bench-{prefix}-{index}", "EUR", Decimal("25.00"), items)
+        capture_order(order)
+
+    with rolled_back():
+        return run_serially(create_and_capture, requests)
+
+
+SCENARIOS = {
+    "product_sync": bench_product_sync,
+    "plan_sync": bench_plan_sync,
+    "plan_actions": bench_plan_actions,
+    "queued_plan_actions": bench_queued_plan_actions,
+    "orders": bench_orders,
+    "checkout": bench_checkout,
+}
+
+
+def run_benchmark(scenarios: list, concurrency: int, requests: int, **meta) -> dict:
+    started_at = timezone.now().isoformat()
+    results = {}
+    for name in scenarios:
+        results[name] = SCENARIOS[name](concurrency, requests)
+    return {
+        "started_at": started_at,
+        "python": platform.python_version(),
+        "concurrency": concurrency,
+        "requests": requests,
+        **meta,
+        "scenarios": results,
+    }
+
+
+def seed_subscriptions(count: int, plans: int = 100, users: int = 10000, batch_size: int = 10000) -> dict:
+    """
+    Rows for the lookup benchmark, returns a sample of the values the lookups are made with.
+    Every run seeds its own ids, so rows kept by an earlier run (--keep) don't collide with them.
+    Written with bulk_create(), the save signals would queue the product and plans for PayPal.
+    """
+    import uuid
+    from django.contrib.auth import get_user_model
+    from paypal.models import Product, BillingPlan, Subscription, Subscriber
+
+    User = get_user_model()
+    now = timezone.now()
+    statuses = Subscription.SubscriptionStatus.values
+    seed = uuid.uuid4().hex[:8]
+
+    Product.objects.bulk_create([Product(
+        product_id=f'PROD-BENCH-{seed}', name='Benchmark', description='Benchmark', type='SERVICE',
+        category='SOFTWARE'
+    )])
+    product = Product.objects.get(product_id=f'PROD-BENCH-{seed}')
+    BillingPlan.objects.bulk_create([
+        BillingPlan(plan_id=f'P-BENCH-{seed}-{i}', product=product, name=f'Plan {i}', description='Benchmark',
+                    status='ACTIVE' if i % 4 else 'INACTIVE')
+        for i in range(plans)
+    ])
+    plan_pks = list(BillingPlan.objects.filter(product=product).values_list('pk', flat=True))
+    User.objects.bulk_create([
+        User(username=f'bench-{seed}-{i}', email=f'bench-{seed}-{i}@example.com') for i in range(users)
+    ])
+    user_pks = list(User.objects.filter(username__startswith=f'bench-{seed}-').values_list('pk', flat=True))
+
+    for start in range(0, count, batch_size):
+        stop = min(start + batch_size, count)
+        Subscription.objects.bulk_create([
+            Subscription(
+                subscription_id=f'I-BENCH-{seed}-{i:012d}',
+                user_id=user_pks[i % len(user_pks)],
+                plan_id=plan_pks[i % len(plan_pks)],
+                status=statuses[i % len(statuses)],
+                start_time=now, create_time=now, update_time=now, links=[]
+            )
+            for i in range(start, stop)
+        ])
+        pks = Subscription.objects.filter(
+            subscription_id__gte=f'I-BENCH-{seed}-{start:012d}', subscription_id__lt=f'I-BENCH-{seed}-{stop:012d}'
+        ).values_list('pk', flat=True)
+        Subscriber.objects.bulk_create([
+            Subscriber(subscription_id=pk, email=f'subscriber-{pk}@example.com') for pk in pks
+        ])
+
+    return {
+        "subscription_ids": [f'I-BENCH-{seed}-{i:012d}' for i in range(0, count, max(count // 1000, 1))],
+        "plan_ids": [f'P-BENCH-{seed}-{i}' for i in range(plans)],
+        "user_pks": user_pks,
+    }
+
+
+def run_lookup_benchmark(subscriptions: int, lookups: int, keep: bool = False) -> dict:
+    """
+    Times the lookups the sync commands, webhooks and views make against `subscriptions` seeded rows,
+    with the query plan of each. The rows are rolled back afterwards unless `keep` is set.
+    """
+    import random
+    from django.db import connection, transaction
+    from paypal.models import BillingPlan, Subscription, Subscriber
+
+    rng = random.Random(0)
+    results = {}
+    with transaction.atomic():
+        started = time.perf_counter()
+        sample = seed_subscriptions(subscriptions)
+        seed_duration = time.perf_counter() - started
+        sample_emails = list(Subscriber.objects.filter(
+            subscription__subscription_id__in=sample['subscription_ids'][:500]
+        ).values_list('email', flat=True))
+
+        queries = {
+            "subscription_by_id": lambda: Subscription.objects.filter(
+                subscription_id=rng.choice(sample['subscription_ids'])),
+            "plan_by_id": lambda: BillingPlan.objects.filter(plan_id=rng.choice(sample['plan_ids'])),
+            "active_plans": lambda: BillingPlan.objects.filter(
+                status='ACTIVE', plan_id=rng.choice(sample['plan_ids'])),
+            "user_active_subscription": lambda: Subscription.objects.filter(
+                user_id=rng.choice(sample['user_pks']), status='ACTIVE'),
+            "subscriber_by_email": lambda: Subscriber.objects.filter(email=rng.choice(sample_emails)),
+        }
+        for name, build in queries.items():
+            latencies = []
+            for _ in range(lookups):
+                queryset = build()
+                started = time.perf_counter()
+                list(queryset[:20])
+                latencies.append(time.perf_counter() - started)
+            result = summarize(latencies, 0, sum(latencies))
+            result["plan"] = build().explain()
+            results[name] = result
+
+        if not keep:
+            transaction.set_rollback(True)
+
+    return {
+        "started_at": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "subscriptions": subscriptions,
+        "lookups": lookups,
+        "seed_duration_s": round(seed_duration, 2),
+        "scenarios": results,
+    }
@@ -0,0 +1,465 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+# Stand-in for the PayPal REST endpoints used by paypal.utils, for local load tests and benchmarks.
+# Point the helpers at it with PAYPAL_BASE_URL (see run_paypal_sandbox and benchmark_paypal).
+
+
+def now_iso(offset: int = 0) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def build_fake_product(index: int) -> dict:
+    return {
+        "id": f"PROD-{index:06d}",
+        "name": f"Product {index}",
+        "description": f"Product {index}",
+        "type": "SERVICE",
+        "category": "SOFTWARE",
+        "create_time": "2021-01-01T00:00:00Z",
+        "update_time": "2021-01-01T00:00:00Z",
+        "links": []
+    }
+
+
+def build_fake_plan(index: int, product_id: str) -> dict:
+    return {
+        "id": f"P-{index:06d}",
+        "product_id": product_id,
+        "name": f"Plan {index}",
+        "description": f"Plan {index}",
+        "status": "ACTIVE",
+        "quantity_supported": False,
+        "billing_cycles": [
+            {
+                "frequency": {"interval_unit": "MONTH", "interval_count": 1},
+                "tenure_type": "REGULAR",
+                "sequence": 1,
+                "total_cycles": 0,
+                "pricing_scheme": {"fixed_price": {"value": f"{10 + index % 5}.00", "currency_code": "USD"}}
+            }
+        ],
+        "payment_preferences": {
+            "auto_bill_outstanding": True,
+            "setup_fee": {"value": "0.00", "currency_code": "USD"},
+            "setup_fee_failure_action": "CONTINUE",
+            "payment_failure_threshold": 3
+        },
+        "create_time": "2021-01-01T00:00:00Z",
+        "update_time": "2021-01-01T00:00:00Z",
+        "links": []
+    }
+
+
+def build_fake_subscription(index: int, plan_id: str) -> dict:
+    return {
+        "id": f"I-{index:06d}",
+        "plan_id": plan_id,
+        "status": "ACTIVE",
+        "start_time": "2021-01-01T00:00:00Z",
+        "subscriber": {
+            "name": {"given_name": "Test", "surname": f"User {index}"},
+            "email_address": f"user{index}@example.com"
+        },
+        "billing_info": {"next_billing_time": now_iso(30 * 24 * 60 * 60), "failed_payments_count": 0},
+        "create_time": "2021-01-01T00:00:00Z",
+        "update_time": "2021-01-01T00:00:00Z",
+        "links": []
+    }
+
+
+# Fields of the list endpoints when the full representation is not asked for
+SUMMARY_FIELDS = {
+    'products': ['id', 'name', 'description', 'create_time', 'links'],
+    'plans': ['id', 'product_id', 'name', 'description', 'status', 'create_time', 'links'],
+}
+
+
+class SandboxState:
+    """
+    In-memory PayPal resources. Every access goes through `lock`, the server handles requests on many threads.
+    """
+
+    def __init__(self, products: int = 0, plans: int = 0, subscriptions: int = 0):
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.products = {}
+        self.plans = {}
+        self.subscriptions = {}
+        self.orders = {}
+        # PayPal-Request-Id -> (status, body) of the first response, replayed for repeated requests
+        self.replays = {}
+        self.requests = 0
+        self.seed(products, plans, subscriptions)
+
+    def seed(self, products: int, plans: int, subscriptions: int):
+        for i in range(products):
+            product = build_fake_product(i)
+            self.products[product['id']] = product
+        product_ids = list(self.products) or [build_fake_product(0)['id']]
+        for i in range(plans):
+            plan = build_fake_plan(i, product_ids[i % len(product_ids)])
+            self.plans[plan['id']] = plan
+        plan_ids = list(self.plans) or [build_fake_plan(0, product_ids[0])['id']]
+        for i in range(subscriptions):
+            subscription = build_fake_subscription(i, plan_ids[i % len(plan_ids)])
+            self.subscriptions[subscription['id']] = subscription
+
+
+class SandboxRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body leave in one write (flushed after every request), separate small writes on a
+    # keep-alive connection stall on Nagle's algorithm and delayed ACKs for ~40ms
+    wbufsize = -1
+    routes = [
+        ('POST', r'/v1/oauth2/token', 'create_token'),
+        ('GET', r'/v1/catalogs/products', 'list_products'),
+        ('POST', r'/v1/catalogs/products', 'create_product'),
+        ('GET', r'/v1/catalogs/products/(?P<id>[^/]+)', 'get_product'),
+        ('PATCH', r'/v1/catalogs/products/(?P<id>[^/]+)', 'update_product'),
+        ('GET', r'/v1/billing/plans', 'list_plans'),
+        ('POST', r'/v1/billing/plans', 'create_plan'),
+        ('GET', r'/v1/billing/plans/(?P<id>[^/]+)', 'get_plan'),
+        ('PATCH', r'/v1/billing/plans/(?P<id>[^/]+)', 'update_plan'),
+        ('POST', r'/v1/billing/plans/(?P<id>[^/]+)/(?P<action>activate|deactivate)', 'set_plan_status'),
+        ('POST', r'/v1/billing/plans/(?P<id>[^/]+)/update-pricing-schemes', 'update_pricing'),
+        ('POST', r'/v1/billing/subscriptions', 'create_subscription'),
+        ('GET', r'/v1/billing/subscriptions/(?P<id>[^/]+)', 'get_subscription'),
+        ('POST', r'/v1/billing/subscriptions/(?P<id>[^/]+)/(?P<action>activate|suspend|cancel)',
+         'set_subscription_status'),
+        ('GET', r'/v1/billing/subscriptions/(?P<id>[^/]+)/transactions', 'list_transactions'),
+        ('POST', r'/v2/checkout/orders', 'create_order'),
+        ('GET', r'/v2/checkout/orders/(?P<id>[^/]+)', 'get_order'),
+        ('POST', r'/v2/checkout/orders/(?P<id>[^/]+)/capture', 'capture_order'),
+    ]
+    compiled_routes = [(method, re.compile(f"^{pattern}$"), name) for method, pattern, name in routes]
+
+    # Set by PayPalSandboxServer
+    state: SandboxState = None
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    max_page_size = 20
+    token_ttl = 32400
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if raw and self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(raw)
+        return dict(parse_qsl(raw.decode())) if raw else {}
+
+    def send(self, status: int, data=None, headers: dict = None):
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status: int, name: str, message: str):
+        return status, {"name": name, "message": message, "debug_id": uuid.uuid4().hex[:12]}
+
+    def dispatch(self, method: str):
+        url = urlparse(self.path)
+        self.query = dict(parse_qsl(url.query))
+        body = self.read_body()
+
+        with self.state.lock:
+            self.state.requests += 1
+
+        if self.latency or self.jitter:
+            time.sleep(max(random.gauss(self.latency, self.jitter), 0))
+
+        for route_method, pattern, name in self.compiled_routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            return self.send(*self.error(404, 'NOT_FOUND', f"{method} {url.path}"))
+
+        if name != 'create_token':
+            if not self.is_authorized():
+                return self.send(*self.error(401, 'AUTHENTICATION_FAILURE', 'Invalid or expired token'))
+            if self.error_rate and random.random() < self.error_rate:
+                return self.send(
+                    *self.error(503, 'SERVICE_UNAVAILABLE', 'Injected error'), headers={'Retry-After': '0'}
+                )
+
+        request_id = self.headers.get('PayPal-Request-Id') if method == 'POST' else None
+        if request_id:
+            with self.state.lock:
+                replay = self.state.replays.get(request_id)
+            if replay is not None:
+                return self.send(*replay)
+
+        with self.state.lock:
+            status, data = getattr(self, name)(body, **match.groupdict())
+            if request_id and status < 500:
+                self.state.replays[request_id] = (status, data)
+        self.send(status, data)
+
+    def is_authorized(self) -> bool:
+        authorization = self.headers.get('Authorization', '')
+        token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else None
+        with self.state.lock:
+            expires_at = self.state.tokens.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+    @property
+    def representation(self) -> bool:
+        return self.headers.get('Prefer') == 'return=representation'
+
+    def paginate(self, items: list, key: str):
+        page_size = min(max(int(self.query.get('page_size', 10)), 1), self.max_page_size)
+        page = max(int(self.query.get('page', 1)), 1)
+        if not self.representation and key in SUMMARY_FIELDS:
+            items = [{field: item[field] for field in SUMMARY_FIELDS[key] if field in item} for item in items]
+        data = {key: items[(page - 1) * page_size:page * page_size], "links": []}
+        if self.query.get('total_required') == 'true':
+            data.update({"total_items": len(items), "total_pages": -(-len(items) // page_size)})
+        return 200, data
+
+    def patch(self, resource: dict, operations: list):
+        for operation in operations:
+            target = resource
+            *parents, field = operation['path'].strip('/').split('/')
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[field] = operation.get('value')
+        resource['update_time'] = now_iso()
+        return (200, resource) if self.representation else (204, None)
+
+    # oauth2
+
+    def create_token(self, body):
+        token = uuid.uuid4().hex
+        self.state.tokens[token] = time.time() + self.token_ttl
+        return 200, {"access_token": token, "token_type": "Bearer", "expires_in": self.token_ttl}
+
+    # catalogs/products
+
+    def list_products(self, body):
+        return self.paginate(list(self.state.products.values()), 'products')
+
+    def create_product(self, body):
+        product = {**body, "id": f"PROD-{uuid.uuid4().hex[:12].upper()}", "create_time": now_iso(),
+                   "update_time": now_iso(), "links": []}
+        self.state.products[product['id']] = product
+        return 201, product
+
+    def get_product(self, body, id):
+        product = self.state.products.get(id)
+        return (200, product) if product else self.error(404, 'RESOURCE_NOT_FOUND', f"Product {id} not found")
+
+    def update_product(self, body, id):
+        product = self.state.products.get(id)
+        if product is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Product {id} not found")
+        return self.patch(product, body)
+
+    # billing/plans
+
+    def list_plans(self, body):
+        plans = list(self.state.plans.values())
+        if self.query.get('product_id'):
+            plans = [plan for plan in plans if plan['product_id'] == self.query['product_id']]
+        return self.paginate(plans, 'plans')
+
+    def create_plan(self, body):
+        if body.get('product_id') not in self.state.products:
+            return self.error(422, 'UNPROCESSABLE_ENTITY', 'Product does not exist')
+        plan = {**body, "id": f"P-{uuid.uuid4().hex[:12].upper()}", "status": "ACTIVE", "create_time": now_iso(),
+                "update_time": now_iso(), "links": []}
+        self.state.plans[plan['id']] = plan
+        return 201, plan
+
+    def get_plan(self, body, id):
+        plan = self.state.plans.get(id)
+        return (200, plan) if plan else self.error(404, 'RESOURCE_NOT_FOUND', f"Plan {id} not found")
+
+    def update_plan(self, body, id):
+        plan = self.state.plans.get(id)
+        if plan is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Plan {id} not found")
+        return self.patch(plan, body)
+
+    def set_plan_status(self, body, id, action):
+        plan = self.state.plans.get(id)
+        if plan is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Plan {id} not found")
+        plan.update({"status": "ACTIVE" if action == 'activate' else "INACTIVE", "update_time": now_iso()})
+        return 204, None
+
+    def update_pricing(self, body, id):
+        plan = self.state.plans.get(id)
+        if plan is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Plan {id} not found")
+        cycles = {cycle['sequence']: cycle for cycle in plan.get('billing_cycles', [])}
+        for scheme in body.get('pricing_schemes', []):
+            if scheme['billing_cycle_sequence'] in cycles:
+                cycles[scheme['billing_cycle_sequence']]['pricing_scheme'] = scheme['pricing_scheme']
+        plan['update_time'] = now_iso()
+        return 204, None
+
+    # billing/subscriptions
+
+    def create_subscription(self, body):
+        if body.get('plan_id') not in self.state.plans:
+            return self.error(422, 'UNPROCESSABLE_ENTITY', 'Plan does not exist')
+        subscription = {
+            **build_fake_subscription(len(self.state.subscriptions), body['plan_id']),
+            "id": f"I-{uuid.uuid4().hex[:12].upper()}",
+            "status": "APPROVAL_PENDING",
+            "create_time": now_iso(),
+            "update_time": now_iso()
+        }
+        self.state.subscriptions[subscription['id']] = subscription
+        return 201, subscription
+
+    def get_subscription(self, body, id):
+        subscription = self.state.subscriptions.get(id)
+        if subscription is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Subscription {id} not found")
+        return 200, subscription
+
+    def set_subscription_status(self, body, id, action):
+        subscription = self.state.subscriptions.get(id)
+        if subscription is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Subscription {id} not found")
+        status = {"activate": "ACTIVE", "suspend": "SUSPENDED", "cancel": "CANCELLED"}[action]
+        subscription.update({"status": status, "update_time": now_iso()})
+        return 204, None
+
+    def list_transactions(self, body, id):
+        subscription = self.state.subscriptions.get(id)
+        if subscription is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Subscription {id} not found")
+        # One payment a week during 2021
+        first = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        transactions = [
+            {
+                "id": f"TX-{id}-{week:02d}",
+                "status": "COMPLETED",
+                "amount_with_breakdown": {
+                    "gross_amount": {"currency_code": "USD", "value": "10.00"},
+                    "fee_amount": {"currency_code": "USD", "value": "0.59"},
+                    "net_amount": {"currency_code": "USD", "value": "9.41"}
+                },
+                "payer_name": subscription['subscriber']['name'],
+                "payer_email": subscription['subscriber']['email_address'],
+                "time": (first + timedelta(weeks=week)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            } for week in range(52)
+        ]
+        start_time = self.query.get('start_time', '')[:19]
+        end_time = self.query.get('end_time', '')[:19]
+        transactions = [
+            transaction for transaction in transactions
+            if (not start_time or transaction['time'][:19] >= start_time)
+            and (not end_time or transaction['time'][:19] < end_time)
+        ]
+        return self.paginate(transactions, 'transactions')
+
+    # checkout/orders
+
+    def create_order(self, body):
+        order = {
+            "id": uuid.uuid4().hex[:17].upper(),
+            "intent": body.get('intent', 'CAPTURE'),
+            "status": "CREATED",
+            "purchase_units": body.get('purchase_units', []),
+            "create_time": now_iso(),
+            "links": []
+        }
+        self.state.orders[order['id']] = order
+        return 201, order
+
+    def get_order(self, body, id):
+        order = self.state.orders.get(id)
+        return (200, order) if order else self.error(404, 'RESOURCE_NOT_FOUND', f"Order {id} not found")
+
+    def capture_order(self, body, id):
+        order = self.state.orders.get(id)
+        if order is None:
+            return self.error(404, 'RESOURCE_NOT_FOUND', f"Order {id} not found")
+        if order['status'] == 'COMPLETED':
+            return self.error(422, 'UNPROCESSABLE_ENTITY', 'ORDER_ALREADY_CAPTURED')
+
+        for unit in order['purchase_units']:
+            unit['payments'] = {
+                "captures": [{
+                    "id": uuid.uuid4().hex[:17].upper(),
+                    "status": "COMPLETED",
+                    "amount": unit.get('amount', {}),
+                    "create_time": now_iso()
+                }]
+            }
+        order.update({"status": "COMPLETED", "update_time": now_iso()})
+        return 201, order
+
+
+class PayPalSandboxServer:
+    """
+    Threaded HTTP server answering like the PayPal REST API.
+    `latency` and `jitter` are seconds added to every response, `error_rate` is the share of authenticated
+    requests answered with a 503.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, max_page_size: int = 20, state: SandboxState = None):
+        self.state = state or SandboxState()
+        handler = type('Handler', (SandboxRequestHandler,), {
+            "state": self.state,
+            "latency": latency,
+            "jitter": jitter,
+            "error_rate": error_rate,
+            "max_page_size": max_page_size,
+        })
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='paypal-sandbox', daemon=True)
+        self.thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
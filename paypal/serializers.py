@@ -0,0 +1,84 @@
+from django.db.models import Prefetch
+
+from paypal.models import Product, BillingPlan, BillingCycle
+
+# PayPal request bodies built from our models. The plan builders read the relations loaded by
+# plan_queryset(), a plan and everything its JSON needs comes from two queries.
+
+
+def plan_queryset(queryset=None):
+    queryset = BillingPlan.objects.all() if queryset is None else queryset
+    return queryset.select_related('product', 'payment_preferences__setup_fee').prefetch_related(
+        Prefetch(
+            'billing_cycles',
+            queryset=BillingCycle.objects.select_related('frequency', 'pricing_scheme__fixed_price').order_by(
+                'sequence'
+            )
+        )
+    )
+
+
+def build_amount_data(amount) -> dict:
+    return {"value": amount.value, "currency_code": amount.currency_code}
+
+
+def build_product_data(product: Product) -> dict:
+    data = {
+        "name": product.name,
+        "description": product.description,
+        "type": product.type,
+        "category": product.category
+    }
+    if product.image_url:
+        data.update({"image_url": product.image_url})
+    if product.home_url:
+        data.update({"home_url": product.home_url})
+    return data
+
+
+def build_cycle_data(cycle: BillingCycle) -> dict:
+    data = {
+        "frequency": {
+            "interval_unit": cycle.frequency.interval_unit,
+            "interval_count": cycle.frequency.interval_count
+        },
+        "tenure_type": cycle.tenure_type,
+        "sequence": cycle.sequence,
+        "total_cycles": cycle.total_cycles
+    }
+    # Free trial cycles have no pricing scheme
+    if cycle.pricing_scheme_id:
+        data["pricing_scheme"] = {"fixed_price": build_amount_data(cycle.pricing_scheme.fixed_price)}
+    return data
+
+
+def build_plan_data(plan: BillingPlan) -> dict:
+    preferences = plan.payment_preferences
+    return {
+        "product_id": plan.product.product_id,
+        "name": plan.name,
+        "description": plan.description,
+        "billing_cycles": [build_cycle_data(cycle) for cycle in plan.billing_cycles.all()],
+        "payment_preferences": {
+            "auto_bill_outstanding": preferences.auto_bill_outstanding,
+            "setup_fee": build_amount_data(preferences.setup_fee),
+            "setup_fee_failure_action": preferences.setup_fee_failure_action,
+            "payment_failure_threshold": preferences.payment_failure_threshold
+        }
+    }
+
+
+def build_pricing_data(plan: BillingPlan, snapshot: dict) -> dict:
+    """
+    Body of the update-pricing-schemes call for the cycles whose pricing scheme changed since `snapshot`,
+    None when nothing changed.
+    """
+    pricing_schemes = [
+        {
+            "billing_cycle_sequence": cycle.sequence,
+            "pricing_scheme": {"fixed_price": build_amount_data(cycle.pricing_scheme.fixed_price)}
+        }
+        for cycle in plan.billing_cycles.all()
+        if cycle.pricing_scheme_id and cycle.pricing_scheme_id != snapshot.get(cycle.sequence)
+    ]
+    return {"pricing_schemes": pricing_schemes} if pricing_schemes else None
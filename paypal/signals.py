@@ -1,166 +1,159 @@
-from django.db.models.signals import pre_save, post_save
-from django.db import transaction
+from contextlib import contextmanager
+from functools import partial
+
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 
-from paypal.models import Product, BillingPlan, PaymentPreference
-from paypal.utils.product import PayPalProduct
-from paypal.utils.billing_plan import PayPalBillingPlan
+from paypal import entitlements, interning, plans
+from paypal.models import (
+    Product, BillingPlan, BillingCycle, PaymentPreference, OutboxMessage, PayPalProfile, Amount, Frequency,
+    PricingScheme
+)
+from paypal.outbox import enqueue, enqueue_pricing
+
+# PayPal calls are not made here, they are recorded as OutboxMessages in the saving transaction
+# and sent by paypal.outbox.OutboxProcessor (process_paypal_outbox command or background thread).
+
+
+def defer(instance, call=None):
+    # The diff is taken in pre_save, against the loaded values, and enqueued by send_deferred() in post_save
+    # so a save that fails records nothing
+    instance._outbox_deferred = call
+
+
+def send_deferred(instance):
+    call = instance.__dict__.pop('_outbox_deferred', None)
+    if call is not None:
+        call()
 
 
 @receiver(pre_save, sender=Product)
-def update_product(sender, instance: Product, **kwargs):
+def diff_product(sender, instance: Product, **kwargs):
+    defer(instance)
     created = instance.id is None
     if not created:
-        old_instance = Product.objects.get(id=instance.id)
-        has_changed = False
-        paths = {}
+        changes = instance.get_dirty_fields(['name', 'description', 'category', 'image_url', 'home_url'])
+        paths = {f"/{field}": new for field, (old, new) in changes.items()}
 
-        for field in ['name', 'description', 'category', 'image_url', 'home_url']:
-            if getattr(instance, field) != getattr(old_instance, field):
-                has_changed = True
-                paths.update({
-                    f"/{field}": getattr(instance, field)
-                })
+        # A product that isn't on PayPal yet is created from its latest state, nothing to patch
+        if paths and instance.product_id:
+            defer(instance, partial(enqueue, OutboxMessage.Action.UPDATE_PRODUCT, instance, {"paths": paths}))
 
-        if has_changed:
-            PayPalProduct().update_product(instance.product_id, paths)
-            product = PayPalProduct().get_product(instance.product_id)
-            instance.update_time = product.get('update_time')
 
+@receiver(post_save, sender=Product)
+def update_product(sender, instance: Product, **kwargs):
+    send_deferred(instance)
 
-@receiver(pre_save, sender=Product)
-def create_product(sender, instance: Product, **kwargs):
-    created = instance.id is None
-    if created:
-        data = {
-            "name": instance.name,
-            "description": instance.description,
-            "type": instance.type,
-            "category": instance.category
-        }
-        if instance.image_url:
-            data.update({"image_url": instance.image_url})
-        if instance.home_url:
-            data.update({"home_url": instance.home_url})
-
-        product = PayPalProduct().create_product(data)
-        instance.product_id = product.get("id")
-        instance.create_time = product.get('create_time')
-        instance.update_time = product.get('create_time')
-        instance.links = product.get('links')
+
+@receiver(post_save, sender=Product)
+def create_product(sender, instance: Product, created, **kwargs):
+    if created and not instance.product_id:
+        enqueue(OutboxMessage.Action.CREATE_PRODUCT, instance)
 
 
 @receiver(pre_save, sender=BillingPlan)
+def diff_plan(sender, instance: BillingPlan, **kwargs):
+    defer(instance)
+    created = instance.id is None
+    if not created:
+        changes = instance.get_dirty_fields(['description'])
+        paths = {f"/{field}": new for field, (old, new) in changes.items()}
+
+        if paths and instance.plan_id:
+            defer(instance, partial(enqueue, OutboxMessage.Action.UPDATE_PLAN, instance, {"paths": paths}))
+
+
+@receiver(post_save, sender=BillingPlan)
 def update_plan(sender, instance: BillingPlan, **kwargs):
+    send_deferred(instance)
+
+
+@receiver(pre_save, sender=PaymentPreference)
+def diff_payment_preferences(sender, instance: PaymentPreference, **kwargs):
+    # Saved on its own (admin inline), after the plan's signals have already run
+    defer(instance)
     created = instance.id is None
     if not created:
-        old_instance = BillingPlan.objects.get(id=instance.id)
-        paypal_helper = PayPalBillingPlan()
-        has_changed = False
-        paths = dict()
-
-        fields = [
-            'description',
-            'auto_bill_outstanding',
-            'payment_failure_threshold'
-        ]
-        for field in fields[:1]:
-            if getattr(old_instance, field) != getattr(instance, field):
-                paths[f"/{field}"] = getattr(instance, field)
-                has_changed = True
-        for field in fields[1:3]:
-            if getattr(old_instance.payment_preferences, field) != getattr(instance.payment_preferences, field):
-                paths[f"/payment_preferences/{field}"] = getattr(instance.payment_preferences, field)
-                has_changed = True
-
-        if has_changed:
-            paypal_helper.update_billing_plan(instance.plan_id, paths)
-            plan = paypal_helper.get_billing_plan(instance.plan_id)
-            instance.update_time = plan.get('update_time')
-
-
-def create_billing_plan(instance):
-    billing_cycles = []
-
-    for cycle in instance.billing_cycles.all():
-        billing_cycles.append({
-            "frequency": {
-                "interval_unit": cycle.frequency.interval_unit,
-                "interval_count": cycle.frequency.interval_count
-            },
-            "tenure_type": cycle.tenure_type,
-            "sequence": cycle.sequence,
-            "total_cycles": cycle.total_cycles,
-            "pricing_scheme": {
-                "fixed_price": {
-                    "value": cycle.pricing_scheme.fixed_price.value,
-                    "currency_code": cycle.pricing_scheme.fixed_price.currency_code
-                }
-            }
-        })
-    data = {
-        "product_id": instance.product.product_id,
-        "name": instance.name,
-        "description": instance.description,
-        "billing_cycles": billing_cycles,
-        "payment_preferences": {
-            "auto_bill_outstanding": instance.payment_preferences.auto_bill_outstanding,
-            "setup_fee": {
-                "value": instance.payment_preferences.setup_fee.value,
-                "currency_code": instance.payment_preferences.setup_fee.currency_code
-            },
-            "setup_fee_failure_action": instance.payment_preferences.setup_fee_failure_action,
-            "payment_failure_threshold": instance.payment_preferences.payment_failure_threshold
-        }
-    }
-    plan = PayPalBillingPlan().create_billing_plan(data)
-    BillingPlan.objects.filter(id=instance.id).update(
-        plan_id=plan.get('id'),
-        quantity_supported=plan.get('quantity_supported', False),
-        create_time=plan.get('create_time'),
-        update_time=plan.get('create_time'),
-        links=plan.get('links')
-    )
+        changes = instance.get_dirty_fields(['auto_bill_outstanding', 'payment_failure_threshold'])
+        paths = {f"/payment_preferences/{field}": new for field, (old, new) in changes.items()}
+
+        # An unchanged save doesn't load the plan
+        if paths and instance.billing_plan.plan_id:
+            defer(
+                instance, partial(enqueue, OutboxMessage.Action.UPDATE_PLAN, instance.billing_plan, {"paths": paths})
+            )
+
+
+@receiver(post_save, sender=PaymentPreference)
+def update_payment_preferences(sender, instance: PaymentPreference, **kwargs):
+    send_deferred(instance)
 
 
 @receiver(post_save, sender=BillingPlan)
 def create_plan(sender, instance: BillingPlan, created, **kwargs):
-    if created:
-        transaction.on_commit(lambda: create_billing_plan(instance))
-
-
-def update_billing_plan_pricing(instance, old_schemes, cycles):
-    pricing_schemes = []
-
-    for cycle in cycles:
-        if cycle.pricing_scheme not in old_schemes:
-            pricing_schemes.append({
-                "billing_cycle_sequence": cycle.sequence,
-                "pricing_scheme": {
-                    "fixed_price": {
-                        "value": cycle.pricing_scheme.fixed_price.value,
-                        "currency_code": cycle.pricing_scheme.fixed_price.currency_code
-                    }
-                }
-            })
-
-    if pricing_schemes:
-        paypal_helper = PayPalBillingPlan()
-        paypal_helper.update_pricing(
-            instance.plan_id, {
-                "pricing_schemes": pricing_schemes
-            }
-        )
-        plan = paypal_helper.get_billing_plan(instance.plan_id)
-        BillingPlan.objects.filter(id=instance.id).update(
-            update_time=plan.get('update_time')
-        )
+    # Billing cycles and payment preferences are saved after the plan (admin inlines),
+    # the worker only reads them once this transaction has committed
+    if created and not instance.plan_id:
+        enqueue(OutboxMessage.Action.CREATE_PLAN, instance)
 
 
-@receiver(post_save, sender=BillingPlan)
-def update_pricing(sender, instance: BillingPlan, created, **kwargs):
+@receiver(pre_save, sender=BillingCycle)
+def diff_pricing(sender, instance: BillingCycle, **kwargs):
+    # Only a changed pricing scheme reprices the plan, the worker diffs the old schemes after commit
+    defer(instance)
+    created = instance.id is None
     if not created:
-        old_instance = getattr(instance, 'old_instance')
-        old_schemes = [cycle.pricing_scheme for cycle in old_instance.billing_cycles.all()]
-        cycles = instance.billing_cycles.all()
-        transaction.on_commit(lambda: update_billing_plan_pricing(instance, old_schemes, cycles))
+        changes = instance.get_dirty_fields(['pricing_scheme'])
+        if changes and instance.billing_plan.plan_id:
+            defer(
+                instance,
+                partial(enqueue_pricing, instance.billing_plan, {instance.sequence: changes['pricing_scheme'][0]})
+            )
+
+
+@receiver(post_save, sender=BillingCycle)
+def update_pricing(sender, instance: BillingCycle, **kwargs):
+    send_deferred(instance)
+
+
+@receiver(post_save, sender=BillingPlan)
+@receiver(post_delete, sender=BillingPlan)
+def invalidate_active_plans(sender, instance: BillingPlan, **kwargs):
+    plans.invalidate()
+
+
+@receiver(post_save, sender=PayPalProfile)
+@receiver(post_delete, sender=PayPalProfile)
+def invalidate_entitlement(sender, instance: PayPalProfile, **kwargs):
+    entitlements.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Amount)
+@receiver(post_save, sender=Frequency)
+@receiver(post_save, sender=PricingScheme)
+@receiver(post_delete, sender=Amount)
+@receiver(post_delete, sender=Frequency)
+@receiver(post_delete, sender=PricingScheme)
+def invalidate_interned(sender, instance, **kwargs):
+    interning.CACHES[sender].invalidate(instance.pk)
+
+
+@contextmanager
+def muted_plan_signals():
+    # Bulk imports write plans that already exist on PayPal, they must not be pushed back
+    receivers = [
+        (pre_save, diff_plan, BillingPlan),
+        (post_save, update_plan, BillingPlan),
+        (post_save, create_plan, BillingPlan),
+        (pre_save, diff_pricing, BillingCycle),
+        (post_save, update_pricing, BillingCycle),
+    ]
+    for signal, handler, sender in receivers:
+        signal.disconnect(handler, sender)
+    try:
+        yield
+    finally:
+        for signal, handler, sender in receivers:
+            signal.connect(handler, sender)
+        # Imported plans are written in bulk, without the save signals
+        plans.invalidate()
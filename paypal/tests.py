@@ -1,3 +1,1657 @@
-from django.test import TestCase
+import asyncio
+import base64
+import copy
+import json
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from paypal import entitlements, interning, plans
+from paypal.importers import (
+    PlanDeltaSync, PlanImporter, ProductDeltaSync, SubscriptionSync, build_product, update_profile_validity
+)
+from paypal.models import (
+    Product, BillingPlan, BillingCycle, PaymentPreference, Amount, Frequency, PricingScheme, OutboxMessage,
+    WebhookEvent, PayPalProfile, Subscription, Order, Capture, SyncState
+)
+from paypal.outbox import OutboxError, OutboxProcessor
+from paypal.sandbox import benchmark
+from paypal.sandbox.server import PayPalSandboxServer, SandboxState, build_fake_subscription, now_iso
+from paypal.serializers import build_plan_data, build_pricing_data, plan_queryset
+from paypal.signals import muted_plan_signals
+from paypal.utils import resource_cache, session, throttle
+from paypal.utils.aio.base import close_client
+from paypal.utils.aio.product import AsyncPayPalProduct
+from paypal.utils.aio.subscription import AsyncPayPalSubscription
+from paypal.utils.base import UpdateResult, build_update_result
+from paypal.utils.bulk import Checkpoint
+from paypal.utils.order import format_amount
+from paypal.utils.product import PayPalProduct
+from paypal.utils.response import OrderView, decode, loads
+from paypal.utils.subscription import PayPalSubscription
+from paypal.utils.throttle import CircuitBreaker, CircuitOpen, Priority, RateLimited, TokenBucket
+from paypal.utils.token import AccessToken, LocalTokenStore
+from paypal.webhook import handlers, verification
+from paypal.webhook.processor import WebhookProcessor
+from paypal.webhook.serializers import parse_event
+
+
+def create_plan(plan_id: str = 'P-1', prices: tuple = (10,), product_id: str = 'PROD-1') -> BillingPlan:
+    # A plan that is already on PayPal, with one monthly cycle per price
+    product = Product.objects.create(
+        product_id=product_id, name='Product', description='Product', type='SERVICE', category='SOFTWARE'
+    )
+    frequency, _ = Frequency.objects.get_or_create(interval_unit='MONTH', interval_count=1)
+    with muted_plan_signals():
+        plan = BillingPlan.objects.create(
+            plan_id=plan_id, product=product, name='Plan', description='Plan', update_time=timezone.now()
+        )
+        PaymentPreference.objects.create(
+            billing_plan=plan,
+            setup_fee=Amount.objects.get_or_create(currency_code='USD', value=0)[0],
+            setup_fee_failure_action='CONTINUE'
+        )
+        for sequence, price in enumerate(prices, 1):
+            BillingCycle.objects.create(
+                billing_plan=plan,
+                frequency=frequency,
+                tenure_type='REGULAR',
+                sequence=sequence,
+                pricing_scheme=get_pricing_scheme(price)
+            )
+    return plan
+
+
+def get_pricing_scheme(price: float) -> PricingScheme:
+    amount, _ = Amount.objects.get_or_create(currency_code='USD', value=price)
+    return PricingScheme.objects.get_or_create(fixed_price=amount)[0]
+
+
+class SandboxMixin:
+    # Runs a PayPalSandboxServer for the test class and points every helper at it
+    products = 0
+    plans = 0
+    subscriptions = 0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.sandbox = PayPalSandboxServer(state=SandboxState(cls.products, cls.plans, cls.subscriptions))
+        cls.sandbox_settings = override_settings(PAYPAL_BASE_URL=cls.sandbox.start())
+        cls.sandbox_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sandbox_settings.disable()
+        cls.sandbox.stop()
+        super().tearDownClass()
+
+
+class TokenStoreTests(TestCase):
+    def test_concurrent_callers_fetch_one_token(self):
+        store = LocalTokenStore()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return f"token-{len(calls)}", 3600
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(store.get_token('key', fetch))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['token-1'] * 10)
+
+    def test_token_close_to_expiry_is_used_while_another_caller_refreshes(self):
+        store = LocalTokenStore(refresh_margin=300)
+        store.set('key', AccessToken('old', time.time() + 60))
+
+        store.acquire('key')
+        try:
+            self.assertEqual(store.get_token('key', lambda: self.fail("refreshed twice")), 'old')
+        finally:
+            store.release('key')
+        self.assertEqual(store.get_token('key', lambda: ('new', 3600)), 'new')
+
+    def test_rejected_token_is_replaced(self):
+        store = LocalTokenStore()
+        store.set('key', AccessToken('revoked', time.time() + 3600))
+
+        self.assertEqual(store.get_token('key', lambda: ('other', 3600)), 'revoked')
+        self.assertEqual(store.get_token('key', lambda: ('new', 3600), rejected='revoked'), 'new')
+
+
+class AsyncTokenTests(TestCase):
+    def setUp(self):
+        self.store = LocalTokenStore()
+        patcher = mock.patch('paypal.utils.aio.base.get_token_store', return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_tokens(self, tasks: int, fetch) -> list:
+        async def get_tokens():
+            helper = AsyncPayPalProduct()
+            with mock.patch.object(helper, 'fetch_access_token', fetch):
+                return await asyncio.gather(*(helper.get_access_token() for _ in range(tasks)))
+        return asyncio.run(get_tokens())
+
+    def test_concurrent_tasks_fetch_one_token(self):
+        fetch = mock.AsyncMock(return_value=('token-1', 3600))
+        self.assertEqual(self.get_tokens(10, fetch), ['token-1'] * 10)
+        self.assertEqual(fetch.await_count, 1)
+
+    def test_token_refreshed_by_another_thread_is_reused(self):
+        key = AsyncPayPalProduct().token_key
+        self.store.acquire(key)
+
+        def refresh():
+            self.store.set(key, AccessToken('shared', time.time() + 3600))
+            self.store.release(key)
+
+        # The store's lock is held by a synchronous caller, the tasks wait for it instead of fetching their own
+        timer = threading.Timer(0.1, refresh)
+        timer.start()
+        self.addCleanup(timer.join)
+        fetch = mock.AsyncMock(return_value=('token-1', 3600))
+        self.assertEqual(self.get_tokens(3, fetch), ['shared'] * 3)
+        fetch.assert_not_awaited()
+
+
+class PayPalHelperAuthTests(SandboxMixin, TestCase):
+    products = 1
+
+    def test_revoked_token_is_refreshed_and_the_call_retried(self):
+        helper = PayPalProduct()
+        product_id = next(iter(self.sandbox.state.products))
+        self.assertEqual(helper.get_product(product_id)['id'], product_id)
+
+        self.sandbox.state.tokens.clear()
+        requests = self.sandbox.state.requests
+        self.assertEqual(helper.get_product(product_id)['id'], product_id)
+
+        # 401, new token, retry
+        self.assertEqual(self.sandbox.state.requests - requests, 3)
+        self.assertEqual(len(self.sandbox.state.tokens), 1)
+
+    def test_helpers_share_the_token(self):
+        product_id = next(iter(self.sandbox.state.products))
+        PayPalProduct().get_product(product_id)
+        tokens = dict(self.sandbox.state.tokens)
+
+        PayPalProduct().get_product(product_id)
+        self.assertEqual(self.sandbox.state.tokens, tokens)
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    # Answers with the queued statuses first, then 200
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+    calls = 0
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond()
+
+    def respond(self):
+        type(self).calls += 1
+        self.send_response(self.statuses.pop(0) if self.statuses else 200)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(PAYPAL_RETRY_BACKOFF=0)
+class SessionTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.httpd = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.httpd.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FlakyHandler.statuses = []
+        FlakyHandler.calls = 0
+        patcher = mock.patch.object(session, '_session', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(session.close_session)
+
+    def test_idempotent_calls_are_retried_on_server_errors(self):
+        FlakyHandler.statuses = [503, 429]
+
+        self.assertEqual(session.get_session().get(self.url).status_code, 200)
+        self.assertEqual(FlakyHandler.calls, 3)
+
+    def test_posts_are_not_retried(self):
+        FlakyHandler.statuses = [503]
+
+        self.assertEqual(session.get_session().post(self.url, json={}).status_code, 503)
+        self.assertEqual(FlakyHandler.calls, 1)
+
+    def test_calls_share_one_keep_alive_connection(self):
+        for _ in range(3):
+            session.get_session().get(self.url)
+
+        stats = session.get_pool_stats()[f"http://127.0.0.1:{self.httpd.server_port}"]
+        self.assertEqual((stats['connections_opened'], stats['requests'], stats['idle']), (1, 3, 1))
+
+
+def build_response(status_code: int, body: bytes = b'') -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    return response
+
+
+class ProductListImportTests(TestCase):
+    def setUp(self):
+        self.catalog = {
+            f"PROD-{i}": {
+                "id": f"PROD-{i}", "name": f"Product {i}", "description": 'Product', "type": 'SERVICE',
+                "category": 'SOFTWARE', "links": [], "create_time": '2021-01-01T00:00:00Z',
+                "update_time": '2021-01-01T00:00:00Z'
+            } for i in range(45)
+        }
+        self.calls = []
+        patcher = mock.patch.object(PayPalProduct, 'request', side_effect=self.respond)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def respond(self, method: str, url: str, params: dict = None, **kwargs):
+        self.calls.append((url.rsplit('/', 1)[-1], params and params['page']))
+        if params is None:
+            return build_response(200, json.dumps(self.catalog[url.rsplit('/', 1)[-1]]).encode())
+        page, page_size = params['page'], params['page_size']
+        products = list(self.catalog.values())[(page - 1) * page_size:page * page_size]
+        return build_response(200, json.dumps({"products": products, "total_pages": 3}).encode())
+
+    def test_every_page_is_listed_and_only_missing_products_are_fetched(self):
+        # bulk_create, a save would create the product on PayPal
+        Product.objects.bulk_create([build_product(self.catalog['PROD-0'])])
+
+        call_command('fetch_and_insert_product_list', stdout=StringIO())
+        self.assertEqual([page for _, page in self.calls if page], [1, 2, 3])
+        self.assertEqual(sorted(product_id for product_id, page in self.calls if not page), sorted(self.catalog)[1:])
+        self.assertEqual(Product.objects.count(), 45)
+
+    def test_dry_run_writes_nothing(self):
+        out = StringIO()
+        call_command('fetch_and_insert_product_list', '--dry-run', stdout=out)
+
+        self.assertIn('would insert 45 products', out.getvalue())
+        self.assertFalse(Product.objects.exists())
+
+
+def build_paypal_plan(plan_id: str, product_id: str = 'PROD-0', price: str = '10') -> dict:
+    # A billing plan as PayPal returns it
+    return {
+        "id": plan_id,
+        "product_id": product_id,
+        "name": 'Plan',
+        "description": 'Plan',
+        "status": 'ACTIVE',
+        "create_time": '2021-01-01T00:00:00Z',
+        "update_time": '2021-01-01T00:00:00Z',
+        "links": [],
+        "payment_preferences": {
+            "auto_bill_outstanding": True,
+            "setup_fee": {"currency_code": 'USD', "value": '0'},
+            "setup_fee_failure_action": 'CONTINUE',
+            "payment_failure_threshold": 3
+        },
+        "billing_cycles": [{
+            "frequency": {"interval_unit": 'MONTH', "interval_count": 1},
+            "tenure_type": 'REGULAR',
+            "sequence": 1,
+            "total_cycles": 0,
+            "pricing_scheme": {"fixed_price": {"currency_code": 'USD', "value": price}}
+        }]
+    }
+
+
+class FakePlanHelper:
+    def __init__(self, plans: list):
+        self.plans = {plan['id']: plan for plan in plans}
+
+    def iter_billing_plans(self):
+        return iter(self.plans.values())
+
+    def get_billing_plan(self, plan_id: str) -> dict:
+        return self.plans[plan_id]
+
+
+class PlanImporterTests(TestCase):
+    def setUp(self):
+        Product.objects.bulk_create([build_product({
+            "id": 'PROD-0', "name": 'Product', "description": 'Product', "type": 'SERVICE', "category": 'SOFTWARE',
+            "links": [], "create_time": '2021-01-01T00:00:00Z', "update_time": '2021-01-01T00:00:00Z'
+        })])
+
+    @staticmethod
+    def count_queries(plans: list) -> int:
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                PlanImporter(FakePlanHelper(plans)).run()
+            transaction.set_rollback(True)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_the_plans(self):
+        self.assertEqual(
+            self.count_queries([build_paypal_plan(f"P-{i}", price=str(10 + i % 2)) for i in range(3)]),
+            self.count_queries([build_paypal_plan(f"P-{i}", price=str(10 + i % 2)) for i in range(30)])
+        )
+
+    def test_plans_share_the_value_rows(self):
+        plans = [build_paypal_plan(f"P-{i}", price=str(10 + i % 2)) for i in range(4)]
+
+        self.assertEqual(PlanImporter(FakePlanHelper(plans)).run(), {"fetched": 4, "inserted": 4, "failed": 0})
+        cycle = BillingCycle.objects.select_related('pricing_scheme__fixed_price').get(billing_plan__plan_id='P-3')
+        self.assertEqual(cycle.pricing_scheme.fixed_price.value, 11)
+        # One row per distinct setup fee and price
+        self.assertEqual(Amount.objects.count(), 3)
+
+    def test_existing_plans_and_unknown_products_are_skipped(self):
+        plans = [build_paypal_plan('P-1'), build_paypal_plan('P-2'), build_paypal_plan('P-3', product_id='PROD-X')]
+        PlanImporter(FakePlanHelper(plans[:1])).run()
+        errors = []
+
+        result = PlanImporter(FakePlanHelper(plans), on_error=lambda plan_id, error: errors.append(plan_id)).run()
+        self.assertEqual(result, {"fetched": 3, "inserted": 1, "failed": 1})
+        self.assertEqual(errors, ['P-3'])
+        self.assertEqual(sorted(BillingPlan.objects.values_list('plan_id', flat=True)), ['P-1', 'P-2'])
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class DeltaSyncTests(SandboxMixin, TestCase):
+    products = 1
+    plans = 2
+
+    def setUp(self):
+        plans = copy.deepcopy(self.sandbox.state.plans)
+        self.addCleanup(setattr, self.sandbox.state, 'plans', plans)
+        ProductDeltaSync().run()
+
+    def test_plans_not_updated_since_the_last_run_are_skipped(self):
+        self.sandbox.state.plans['P-000000']['update_time'] = '2020-06-01T00:00:00Z'
+        self.assertEqual(PlanDeltaSync().run()['inserted'], 2)
+        self.assertEqual(
+            SyncState.objects.get(resource=SyncState.Resource.BILLING_PLANS).high_water_mark.isoformat(),
+            '2021-01-01T00:00:00+00:00'
+        )
+
+        result = PlanDeltaSync().run()
+        self.assertEqual((result['unchanged'], result['updated']), (1, 0))
+        self.assertEqual(PlanDeltaSync().run(full=True)['unchanged'], 0)
+
+    def test_billing_cycles_removed_on_paypal_are_deleted(self):
+        PlanDeltaSync().run()
+        plan = self.sandbox.state.plans['P-000000']
+        plan['billing_cycles'].append(dict(plan['billing_cycles'][0], sequence=2))
+        plan['update_time'] = now_iso()
+
+        self.assertEqual(PlanDeltaSync().run()['updated'], 1)
+        cycles = BillingCycle.objects.filter(billing_plan__plan_id='P-000000')
+        self.assertEqual(sorted(cycles.values_list('sequence', flat=True)), [1, 2])
+
+        plan['billing_cycles'].pop(0)
+        plan['update_time'] = now_iso(1)
+        self.assertEqual(PlanDeltaSync().run()['updated'], 1)
+        self.assertEqual(list(cycles.values_list('sequence', flat=True)), [2])
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.processor = OutboxProcessor(workers=1, backoff=30, max_attempts=2)
+        self.sent = []
+        self.failing = set()
+        self.processor.handlers = {action: self.send for action in OutboxMessage.Action.values}
+
+    def send(self, message):
+        if message.id in self.failing:
+            raise OutboxError("PayPal is down")
+        self.sent.append(message.id)
+
+    @staticmethod
+    def add(object_id: int, action: str = OutboxMessage.Action.UPDATE_PRODUCT, **kwargs) -> OutboxMessage:
+        return OutboxMessage.objects.create(action=action, object_type='product', object_id=object_id, **kwargs)
+
+    def test_messages_are_sent_in_order(self):
+        messages = [self.add(1, OutboxMessage.Action.CREATE_PRODUCT), self.add(2), self.add(1), self.add(2)]
+
+        self.assertEqual(self.processor.process_all(), 4)
+        self.assertEqual(self.sent, [messages[0].id, messages[2].id, messages[1].id, messages[3].id])
+        self.assertFalse(OutboxMessage.objects.exclude(status=OutboxMessage.Status.DONE).exists())
+
+    def test_object_with_a_message_in_flight_is_not_claimed(self):
+        self.add(1, status=OutboxMessage.Status.PROCESSING)
+        self.add(1)
+        other = self.add(2)
+
+        self.assertEqual([message.id for message in self.processor.claim()], [other.id])
+
+    def test_message_of_a_dead_worker_is_claimed_again(self):
+        message = self.add(1, status=OutboxMessage.Status.PROCESSING)
+        OutboxMessage.objects.filter(id=message.id).update(modified_date=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual([claimed.id for claimed in self.processor.claim()], [message.id])
+
+    def test_failure_backs_off_and_holds_later_messages(self):
+        first, second = self.add(1), self.add(1)
+        self.failing.add(first.id)
+
+        self.processor.process_batch()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, OutboxMessage.Status.PENDING)
+        self.assertEqual(first.attempts, 1)
+        self.assertIn("PayPal is down", first.last_error)
+        self.assertGreater(first.next_attempt_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual((second.status, second.attempts), (OutboxMessage.Status.PENDING, 0))
+        self.assertEqual(second.next_attempt_at, first.next_attempt_at)
+        self.assertEqual(self.processor.claim(), [])
+        self.assertEqual(self.sent, [])
+
+    def test_message_fails_after_max_attempts(self):
+        message = self.add(1)
+        self.failing.add(message.id)
+
+        for _ in range(2):
+            OutboxMessage.objects.filter(id=message.id).update(next_attempt_at=timezone.now())
+            self.processor.process_batch()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.Status.FAILED, 2))
+        self.assertEqual(self.processor.claim(), [])
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class PricingOutboxTests(TestCase):
+    def setUp(self):
+        self.plan = create_plan(prices=(10, 20))
+
+    def get_messages(self):
+        return OutboxMessage.objects.filter(action=OutboxMessage.Action.UPDATE_PLAN_PRICING)
+
+    def test_unchanged_pricing_is_not_sent(self):
+        self.plan.name = 'Renamed'
+        self.plan.save()
+        for cycle in self.plan.billing_cycles.all():
+            cycle.total_cycles = 12
+            cycle.save()
+
+        self.assertFalse(self.get_messages().exists())
+
+    def test_changed_cycles_are_sent_in_one_message(self):
+        cycles = {cycle.sequence: cycle for cycle in self.plan.billing_cycles.all()}
+        old = {sequence: cycle.pricing_scheme_id for sequence, cycle in cycles.items()}
+        for price in (15, 17):
+            cycles[1].pricing_scheme = get_pricing_scheme(price)
+            cycles[1].save()
+        cycles[2].pricing_scheme = get_pricing_scheme(25)
+        cycles[2].save()
+
+        message = self.get_messages().get()
+        # The first snapshot is what PayPal still has
+        self.assertEqual(message.payload, {"schemes": {"1": old[1], "2": old[2]}})
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class OutboxSignalTests(TransactionTestCase):
+    def setUp(self):
+        self.plan = create_plan()
+
+    def get_messages(self):
+        return OutboxMessage.objects.filter(action=OutboxMessage.Action.UPDATE_PLAN)
+
+    def test_changes_are_enqueued_once_saved(self):
+        self.plan.description = 'Changed'
+        self.plan.save()
+
+        self.assertEqual(self.get_messages().get().payload, {"paths": {"/description": 'Changed'}})
+
+    def test_failed_save_enqueues_nothing(self):
+        # Autocommit, a message written before the row would outlive the failed save
+        self.plan.description = 'Changed'
+        self.plan.name = None
+        with self.assertRaises(IntegrityError):
+            self.plan.save()
+        self.assertFalse(self.get_messages().exists())
+
+        self.plan.name = 'Plan'
+        self.plan.description = 'Plan'
+        self.plan.save()
+        self.assertFalse(self.get_messages().exists())
+
+    def test_muted_saves_enqueue_nothing(self):
+        with muted_plan_signals():
+            self.plan.description = 'Changed'
+            self.plan.save()
+        self.plan.save()
+
+        self.assertFalse(self.get_messages().exists())
+
+
+class UpdateResultTests(TestCase):
+    def test_no_content_falls_back_to_the_local_time(self):
+        before = timezone.now()
+        result = build_update_result(build_response(204))
+
+        self.assertEqual((result.ok, result.status_code, result.data), (True, 204, {}))
+        self.assertGreaterEqual(datetime.fromisoformat(result.update_time), before)
+
+    def test_representation_carries_the_paypal_update_time(self):
+        result = build_update_result(build_response(200, b'{"id": "PROD-1", "update_time": "2021-06-01T00:00:00Z"}'))
+        self.assertEqual((result.ok, result.update_time), (True, '2021-06-01T00:00:00Z'))
+
+    def test_failed_update_has_no_update_time(self):
+        result = build_update_result(build_response(422, b'{"name": "UNPROCESSABLE_ENTITY", "message": "Invalid"}'))
+        self.assertEqual((result.ok, result.update_time, result.data['message']), (False, None, 'Invalid'))
+
+    @override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+    def test_outbox_stores_the_update_time_without_fetching_the_product(self):
+        product = Product.objects.create(
+            product_id='PROD-1', name='Product', description='Product', type='SERVICE', category='SOFTWARE'
+        )
+        message = OutboxMessage.objects.create(
+            action=OutboxMessage.Action.UPDATE_PRODUCT, object_type='product', object_id=product.id,
+            payload={"paths": {"/name": 'Renamed'}}
+        )
+        processor = OutboxProcessor()
+        processor.product_helper = mock.Mock()
+        processor.product_helper.update_product.return_value = UpdateResult(True, 204, '2021-06-01T00:00:00Z', {})
+
+        processor.update_product(message)
+        processor.product_helper.get_product.assert_not_called()
+        product.refresh_from_db()
+        self.assertEqual(product.update_time, datetime(2021, 6, 1, tzinfo=dt_timezone.utc))
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class DirtyFieldsTests(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id='PROD-1', name='Product', description='Product', type='SERVICE', category='SOFTWARE'
+        )
+        self.product = Product.objects.get(product_id='PROD-1')
+
+    def test_changed_fields_are_reported_with_their_loaded_value(self):
+        self.assertEqual(self.product.get_dirty_fields(), {})
+        self.product.name = 'Renamed'
+        self.product.links.append({"rel": "self"})
+
+        self.assertEqual(
+            self.product.get_dirty_fields(),
+            {"name": ('Product', 'Renamed'), "links": ([], [{"rel": "self"}])}
+        )
+        self.assertEqual(self.product.get_dirty_fields(['description']), {})
+
+    def test_save_diffs_without_reading_the_row(self):
+        self.product.name = 'Renamed'
+        # The UPDATE and the outbox message, no SELECT of the old row
+        with self.assertNumQueries(2):
+            self.product.save()
+        self.assertEqual(self.product.get_dirty_fields(), {})
+        self.assertEqual(OutboxMessage.objects.get().payload, {"paths": {"/name": 'Renamed'}})
+
+    def test_save_with_update_fields_keeps_other_changes(self):
+        self.product.name = 'Renamed'
+        self.product.description = 'Changed'
+        self.product.save(update_fields=['name'])
+
+        self.assertEqual(self.product.get_dirty_fields(), {"description": ('Product', 'Changed')})
+
+    def test_instance_built_by_hand_reads_the_stored_row(self):
+        product = Product(id=self.product.id, product_id='PROD-1', name='Renamed')
+
+        self.assertEqual(
+            product.get_dirty_fields(['name', 'type']),
+            {"name": ('Product', 'Renamed'), "type": ('SERVICE', '')}
+        )
+        self.assertEqual(Product(name='New').get_dirty_fields(), {})
+
+    def test_unchanged_plan_children_are_saved_without_loading_the_plan(self):
+        plan = create_plan(product_id='PROD-2')
+        preference = PaymentPreference.objects.get(billing_plan=plan)
+        cycle = BillingCycle.objects.get(billing_plan=plan)
+
+        # Only the UPDATEs
+        with self.assertNumQueries(2):
+            preference.save()
+            cycle.save()
+        self.assertFalse(OutboxMessage.objects.filter(object_id=plan.pk).exists())
+
+
+def build_certificate(common_name: str, key, issuer: x509.Certificate = None, issuer_key=None) -> x509.Certificate:
+    name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, common_name)])
+    now = datetime.utcnow()
+    return x509.CertificateBuilder().subject_name(name).issuer_name(
+        issuer.subject if issuer else name
+    ).public_key(key.public_key()).serial_number(x509.random_serial_number()).not_valid_before(
+        now - timedelta(days=1)
+    ).not_valid_after(now + timedelta(days=10)).sign(issuer_key or key, hashes.SHA256())
+
+
+@override_settings(PAYPAL_WEBHOOK_VERIFY=True, PAYPAL_WEBHOOK_ID='WH-1', PAYPAL_WEBHOOK_TOLERANCE=300)
+class WebhookVerificationTests(TestCase):
+    cert_url = 'https://api.sandbox.paypal.com/v1/notifications/certs/CERT-1'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A test root stands in for the certifi bundle, PayPal's leaf is issued by it
+        root_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.root = build_certificate('Test Root', root_key)
+        cls.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        leaf = build_certificate('messageverificationcerts.sandbox.paypal.com', cls.key, cls.root, root_key)
+        cls.pem = b''.join(cert.public_bytes(serialization.Encoding.PEM) for cert in (leaf, cls.root))
+
+    def setUp(self):
+        cache.clear()
+        self.fetched = []
+        self.fetch_error = None
+        for patcher in (
+            mock.patch.object(verification, '_trusted_roots', {self.root.subject: self.root}),
+            mock.patch.dict(verification._certificates, clear=True),
+            mock.patch.object(verification, 'get_session', lambda: mock.Mock(get=self.fetch_certificate)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fetch_certificate(self, url, timeout):
+        self.fetched.append(url)
+        if self.fetch_error is not None:
+            raise self.fetch_error
+        return mock.Mock(content=self.pem, raise_for_status=lambda: None)
+
+    def post(self, event: dict, transmission_time: datetime = None, tamper: bool = False, **headers):
+        body = json.dumps(event).encode()
+        transmission_time = (transmission_time or timezone.now()).strftime('%Y-%m-%dT%H:%M:%SZ')
+        message = f"T-1|{transmission_time}|WH-1|{zlib.crc32(body)}".encode()
+        signature = base64.b64encode(self.key.sign(message, padding.PKCS1v15(), hashes.SHA256())).decode()
+        headers = {
+            "HTTP_PAYPAL_TRANSMISSION_ID": 'T-1',
+            "HTTP_PAYPAL_TRANSMISSION_TIME": transmission_time,
+            "HTTP_PAYPAL_TRANSMISSION_SIG": signature,
+            "HTTP_PAYPAL_CERT_URL": self.cert_url,
+            "HTTP_PAYPAL_AUTH_ALGO": 'SHA256withRSA',
+            **headers
+        }
+        if tamper:
+            body = body.replace(b'ACTIVE', b'CANCELLED')
+        return self.client.post(
+            reverse('paypal:paypal-webhook:webhook'), body, content_type='application/json', **headers
+        )
+
+    @staticmethod
+    def build_event(event_id: str = 'WH-EV-1') -> dict:
+        return {
+            "id": event_id,
+            "event_type": 'BILLING.SUBSCRIPTION.ACTIVATED',
+            "resource_type": 'subscription',
+            "create_time": timezone.now().isoformat(),
+            "resource": {"id": 'I-1', "status": 'ACTIVE'}
+        }
+
+    def test_signed_event_is_stored_once(self):
+        response = self.post(self.build_event())
+        self.assertEqual((response.status_code, response.json()), (200, {"status": 'received'}))
+
+        response = self.post(self.build_event())
+        self.assertEqual((response.status_code, response.json()), (200, {"status": 'duplicate'}))
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.event_id, event.resource_id), ('WH-EV-1', 'I-1'))
+
+    def test_certificate_is_fetched_once(self):
+        for event_id in ('WH-EV-1', 'WH-EV-2', 'WH-EV-3'):
+            self.assertEqual(self.post(self.build_event(event_id)).status_code, 200)
+        self.assertEqual(self.fetched, [self.cert_url])
+
+    def test_tampered_body_is_rejected(self):
+        self.assertEqual(self.post(self.build_event(), tamper=True).status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_stale_transmission_is_rejected(self):
+        response = self.post(self.build_event(), transmission_time=timezone.now() - timedelta(hours=1))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_malformed_transmission_time_is_rejected(self):
+        response = self.post(self.build_event(), HTTP_PAYPAL_TRANSMISSION_TIME='2024-13-45T00:00:00Z')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.fetched, [])
+
+    def test_malformed_certificate_is_rejected(self):
+        self.pem = b'-----BEGIN CERTIFICATE-----\nbm90IGEgY2VydGlmaWNhdGU=\n-----END CERTIFICATE-----\n'
+        self.assertEqual(self.post(self.build_event()).status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        # The junk wasn't cached, a fixed certificate is picked up right away
+        del self.pem
+        self.assertEqual(self.post(self.build_event()).status_code, 200)
+        self.assertEqual(self.fetched, [self.cert_url] * 2)
+
+    def test_certificate_outside_paypal_is_refused(self):
+        response = self.post(self.build_event(), HTTP_PAYPAL_CERT_URL='https://example.com/cert.pem')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.fetched, [])
+
+    def test_untrusted_root_is_rejected(self):
+        with mock.patch.object(verification, '_trusted_roots', {}):
+            self.assertEqual(self.post(self.build_event()).status_code, 400)
+
+    def test_unavailable_certificate_is_retried_by_paypal(self):
+        self.fetch_error = requests.Timeout("timed out")
+        self.assertEqual(self.post(self.build_event()).status_code, 503)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        self.fetch_error = None
+        self.assertEqual(self.post(self.build_event()).status_code, 200)
+
+
+def add_event(event_type: str, resource: dict, event_id: str = None) -> WebhookEvent:
+    event_id = event_id or f"WH-EV-{WebhookEvent.objects.count() + 1}"
+    body = {"id": event_id, "event_type": event_type, "create_time": timezone.now().isoformat(), "resource": resource}
+    return WebhookEvent.objects.create(**parse_event(json.dumps(body).encode()))
+
+
+def format_time(value: datetime) -> str:
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class WebhookProcessorTests(TestCase):
+    def setUp(self):
+        self.processor = WebhookProcessor(workers=2)
+        self.plan = create_plan()
+        self.product = self.plan.product
+        self.now = timezone.now().replace(microsecond=0)
+
+    def update_product(self, name: str, seconds: int) -> WebhookEvent:
+        resource = {"id": 'PROD-1', "name": name, "update_time": format_time(self.now + timedelta(seconds=seconds))}
+        return add_event('CATALOG.PRODUCT.UPDATED', resource)
+
+    def test_latest_event_of_a_resource_wins(self):
+        events = [self.update_product('First', 1), self.update_product('Latest', 3), self.update_product('Late', 2)]
+
+        self.assertEqual(self.processor.process_all(), 3)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.update_time), ('Latest', self.now + timedelta(seconds=3)))
+        self.assertEqual(
+            set(WebhookEvent.objects.filter(id__in=[event.id for event in events]).values_list('status', flat=True)),
+            {WebhookEvent.Status.PROCESSED}
+        )
+
+    def test_event_older_than_the_row_is_not_applied(self):
+        Product.objects.filter(id=self.product.id).update(name='Current', update_time=self.now + timedelta(hours=1))
+        self.update_product('Replayed', 1)
+
+        self.processor.process_all()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Current')
+
+    def test_unknown_event_type_is_ignored(self):
+        event = add_event('PAYMENT.SALE.COMPLETED', {"id": 'SALE-1'})
+
+        self.processor.process_all()
+        event.refresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.Status.IGNORED)
+
+    def test_event_of_an_unknown_subscription_creates_it(self):
+        resource = build_fake_subscription(1, 'P-1')
+        # Naive times are read as UTC
+        resource['update_time'] = self.now.replace(tzinfo=None).isoformat()
+        event = add_event('BILLING.SUBSCRIPTION.ACTIVATED', resource)
+
+        self.processor.process_all()
+        event.refresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.Status.PROCESSED)
+        subscription = Subscription.objects.get(subscription_id=resource['id'])
+        self.assertEqual(subscription.plan_id, self.plan.id)
+        self.assertEqual(subscription.status, Subscription.SubscriptionStatus.ACTIVE)
+        self.assertEqual(subscription.update_time, self.now)
+
+    def test_event_of_a_subscription_to_an_unknown_plan_fails(self):
+        event = add_event('BILLING.SUBSCRIPTION.ACTIVATED', build_fake_subscription(1, 'P-MISSING'))
+
+        self.processor.process_all()
+        event.refresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.Status.FAILED)
+        self.assertIn('P-MISSING', event.last_error)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_failed_subscription_events_are_reconciled(self):
+        resource = build_fake_subscription(1, 'P-2')
+        event = add_event('BILLING.SUBSCRIPTION.ACTIVATED', resource)
+        self.processor.process_all()
+        helper = mock.Mock(get_subscription=mock.Mock(return_value=resource))
+
+        # Still unknown, the event stays FAILED and is tried again by the next run
+        SubscriptionSync(paypal_helper=helper).reconcile()
+        event.refresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.Status.FAILED)
+
+        create_plan('P-2', product_id='PROD-2')
+        result = SubscriptionSync(paypal_helper=helper).reconcile()
+        self.assertEqual((result['fetched'], result['created']), (1, 1))
+        self.assertEqual(Subscription.objects.get().subscription_id, resource['id'])
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.last_error), (WebhookEvent.Status.PROCESSED, ''))
+        helper.get_subscription.assert_called_with(resource['id'])
+
+
+class AsyncTransactionsTests(SandboxMixin, TestCase):
+    subscriptions = 1
+    start_time = datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+    end_time = datetime(2022, 1, 1, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        self.subscription_id = next(iter(self.sandbox.state.subscriptions))
+
+    def run_async(self, call):
+        async def run():
+            try:
+                return await call(AsyncPayPalSubscription())
+            finally:
+                await close_client()
+        return asyncio.run(run())
+
+    def test_transactions_of_a_time_range_are_decoded(self):
+        end_time = self.start_time + timedelta(days=7)
+        data = self.run_async(lambda helper: helper.get_transactions(self.subscription_id, self.start_time, end_time))
+        self.assertEqual([transaction['time'] for transaction in data['transactions']], ['2021-01-01T00:00:00Z'])
+
+    def test_iter_transactions_matches_the_sync_helper(self):
+        async def collect(helper):
+            return [
+                transaction['id'] async for transaction in helper.iter_transactions(
+                    self.subscription_id, self.start_time, self.end_time, concurrency=4
+                )
+            ]
+
+        expected = [
+            transaction['id'] for transaction in
+            PayPalSubscription().iter_transactions(self.subscription_id, self.start_time, self.end_time)
+        ]
+        self.assertEqual(len(expected), 52)
+        self.assertEqual(self.run_async(collect), expected)
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class ProfileValidityTests(TestCase):
+    def setUp(self):
+        self.plan = create_plan()
+        self.user = get_user_model().objects.create(username='subscriber')
+        self.profile = PayPalProfile.objects.create(user=self.user)
+        self.now = timezone.now()
+
+    def add_subscription(self, subscription_id: str, days: int) -> Subscription:
+        return Subscription.objects.create(
+            user=self.user, plan=self.plan, subscription_id=subscription_id,
+            status=Subscription.SubscriptionStatus.ACTIVE, start_time=self.now, create_time=self.now,
+            update_time=self.now, next_billing_time=self.now + timedelta(days=days)
+        )
+
+    def get_valid_till(self):
+        self.profile.refresh_from_db()
+        return self.profile.subscription_valid_till
+
+    def test_validity_is_the_latest_of_all_active_subscriptions(self):
+        self.add_subscription('I-LONG', 30)
+        short = self.add_subscription('I-SHORT', 10)
+
+        update_profile_validity([short])
+        self.assertEqual(self.get_valid_till(), self.now + timedelta(days=30))
+
+    def test_validity_is_never_shortened(self):
+        long = self.add_subscription('I-LONG', 30)
+        update_profile_validity([long])
+        long.status = Subscription.SubscriptionStatus.INACTIVE
+        long.save()
+        short = self.add_subscription('I-SHORT', 10)
+
+        update_profile_validity([long, short])
+        self.assertEqual(self.get_valid_till(), self.now + timedelta(days=30))
+
+        update_profile_validity([self.add_subscription('I-LONGER', 40)])
+        self.assertEqual(self.get_valid_till(), self.now + timedelta(days=40))
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class PlanStatusActionTests(SandboxMixin, TestCase):
+    products = 1
+    plans = 2
+
+    def setUp(self):
+        self.addCleanup(setattr, self.sandbox.state, 'plans', copy.deepcopy(self.sandbox.state.plans))
+        # The last plan is unknown to PayPal
+        self.billing_plans = [
+            create_plan(plan_id, product_id=f"PROD-{plan_id}") for plan_id in ('P-000000', 'P-000001', 'P-MISSING')
+        ]
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def deactivate(self):
+        return self.client.post(
+            reverse('admin:paypal_billingplan_changelist'),
+            {"action": 'deactivate', "_selected_action": [plan.id for plan in self.billing_plans]},
+            follow=True
+        )
+
+    @staticmethod
+    def get_statuses() -> dict:
+        return dict(BillingPlan.objects.values_list('plan_id', 'status'))
+
+    def test_only_plans_paypal_confirmed_are_updated(self):
+        response = self.deactivate()
+
+        inactive, active = BillingPlan.BillingPlanStatus.INACTIVE, BillingPlan.BillingPlanStatus.ACTIVE
+        self.assertEqual(self.get_statuses(), {'P-000000': inactive, 'P-000001': inactive, 'P-MISSING': active})
+        self.assertEqual(self.sandbox.state.plans['P-000000']['status'], 'INACTIVE')
+        messages = [str(message) for message in response.context['messages']]
+        self.assertIn(f"2 plans set to {inactive.label}", messages)
+        self.assertTrue(any('P-MISSING' in message and '404' in message for message in messages))
+
+    @override_settings(PAYPAL_ADMIN_SYNC_LIMIT=2)
+    def test_large_selection_is_queued(self):
+        requests = self.sandbox.state.requests
+        self.deactivate()
+
+        self.assertEqual(OutboxMessage.objects.filter(action=OutboxMessage.Action.DEACTIVATE_PLAN).count(), 3)
+        self.assertEqual(set(self.get_statuses().values()), {BillingPlan.BillingPlanStatus.ACTIVE})
+        self.assertEqual(self.sandbox.state.requests, requests)
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False, PAYPAL_ADMIN_SYNC_LIMIT=2)
+class BenchmarkTests(SandboxMixin, TestCase):
+    products = 1
+    plans = 3
+
+    def setUp(self):
+        self.addCleanup(setattr, self.sandbox.state, 'plans', copy.deepcopy(self.sandbox.state.plans))
+
+    def get_statuses(self) -> list:
+        return sorted(plan['status'] for plan in self.sandbox.state.plans.values())
+
+    def test_plan_actions_go_through_the_admin(self):
+        result = benchmark.bench_plan_actions(2, 3)
+
+        self.assertEqual((result['operations'], result['errors'], result['plans_per_action']), (3, 0, 2))
+        # Deactivated, activated and deactivated again
+        self.assertEqual(self.get_statuses(), ['ACTIVE', 'INACTIVE', 'INACTIVE'])
+        self.assertFalse(BillingPlan.objects.exists())
+
+    def test_selections_above_the_sync_limit_are_queued(self):
+        result = benchmark.bench_queued_plan_actions(2, 2)
+
+        self.assertEqual((result['operations'], result['errors'], result['plans_per_action']), (2, 0, 3))
+        self.assertEqual(self.get_statuses(), ['ACTIVE'] * 3)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_checkout_orders_are_rolled_back(self):
+        orders = len(self.sandbox.state.orders)
+        result = benchmark.bench_checkout(2, 2)
+
+        self.assertEqual((result['operations'], result['errors']), (2, 0))
+        self.assertEqual(len(self.sandbox.state.orders) - orders, 2)
+        self.assertFalse(Order.objects.exists())
+
+
+class BulkSubscriptionActionTests(SandboxMixin, TestCase):
+    subscriptions = 3
+
+    def setUp(self):
+        self.addCleanup(setattr, self.sandbox.state, 'subscriptions', copy.deepcopy(self.sandbox.state.subscriptions))
+        plan = create_plan()
+        now = timezone.now()
+        Subscription.objects.bulk_create([
+            Subscription(
+                subscription_id=subscription_id, plan=plan, status=Subscription.SubscriptionStatus.ACTIVE,
+                start_time=now, create_time=now, update_time=now
+            ) for subscription_id in self.sandbox.state.subscriptions
+        ])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.ids_file = f"{directory.name}/ids.txt"
+        self.checkpoint = f"{directory.name}/checkpoint.jsonl"
+        with open(self.ids_file, 'w') as f:
+            f.write("\n".join(self.sandbox.state.subscriptions))
+
+    def cancel(self):
+        call_command(
+            'bulk_subscription_action', 'cancel', ids_file=self.ids_file, checkpoint=self.checkpoint, stdout=StringIO()
+        )
+
+    def get_done(self) -> set:
+        checkpoint = Checkpoint(self.checkpoint)
+        checkpoint.close()
+        return checkpoint.done
+
+    def test_run_resumes_after_a_lost_local_update(self):
+        with mock.patch(
+            'paypal.management.commands.bulk_subscription_action.Command.update_local', side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                self.cancel()
+        # Cancelled on PayPal, but not recorded as done as the local update never happened
+        self.assertEqual(self.get_done(), set())
+
+        self.cancel()
+        self.assertEqual(
+            set(Subscription.objects.values_list('status', flat=True)), {Subscription.SubscriptionStatus.INACTIVE}
+        )
+        self.assertEqual(self.get_done(), set(self.sandbox.state.subscriptions))
+
+        requests = self.sandbox.state.requests
+        self.cancel()
+        self.assertEqual(self.sandbox.state.requests, requests)
+
+
+class EntitlementTests(TransactionTestCase):
+    # Commits for real, cache entries are dropped on commit
+
+    def setUp(self):
+        entitlements.get_cache().clear()
+        self.user = get_user_model().objects.create(username='subscriber')
+        self.profile = PayPalProfile.objects.create(user=self.user)
+        self.profile.update_validity(timezone.now() + timedelta(days=1))
+
+    def test_validity_is_read_from_the_cache(self):
+        self.assertTrue(entitlements.has_subscription(self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(entitlements.has_subscription(self.user))
+        self.assertTrue(self.profile.has_subscription)
+
+    def test_changed_validity_drops_the_cached_entry(self):
+        self.assertTrue(entitlements.has_subscription(self.user))
+        self.profile.update_validity(timezone.now() - timedelta(minutes=1))
+
+        self.assertFalse(entitlements.has_subscription(self.user))
+        self.assertFalse(self.profile.has_subscription)
+
+    def test_middleware_resolves_the_flag_only_when_read(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            request = entitlements.EntitlementMiddleware(lambda request: request)(request)
+
+        self.assertTrue(request.has_subscription)
+        # Resolved once per request
+        request.user = AnonymousUser()
+        self.assertTrue(request.has_subscription)
+        self.assertFalse(entitlements.has_subscription(AnonymousUser()))
+
+
+class MergeDuplicateLookupsMigrationTests(TransactionTestCase):
+    migrate_from = [('paypal', '0008_subscription_mirror')]
+    migrate_to = [('paypal', '0010_lookup_constraints')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        return executor.loader.project_state(self.migrate_to).apps
+
+    def test_duplicates_are_merged_into_the_oldest_row(self):
+        get_model = self.apps.get_model
+        amounts = [get_model('paypal', 'Amount').objects.create(currency_code='USD', value=10) for _ in range(2)]
+        schemes = [get_model('paypal', 'PricingScheme').objects.create(fixed_price=amount) for amount in amounts]
+        frequency = get_model('paypal', 'Frequency').objects.create(interval_unit='MONTH', interval_count=1)
+        plans = [
+            get_model('paypal', 'BillingPlan').objects.create(plan_id=plan_id, name='Plan', description='Plan')
+            for plan_id in ('P-1', 'P-1', '', '')
+        ]
+        for index, plan in enumerate(plans):
+            get_model('paypal', 'BillingCycle').objects.create(
+                billing_plan=plan, frequency=frequency, tenure_type='REGULAR', pricing_scheme=schemes[index % 2]
+            )
+        now = timezone.now()
+        subscriptions = [
+            get_model('paypal', 'Subscription').objects.create(
+                plan=plan, subscription_id='I-1', status='ACTIVE', start_time=now, shipping_amount=amount,
+                create_time=now, update_time=now
+            ) for plan, amount in zip(plans, amounts)
+        ]
+        for subscription in subscriptions:
+            get_model('paypal', 'Subscriber').objects.create(email='user@example.com', subscription=subscription)
+
+        get_model = self.migrate().get_model
+        self.assertEqual(list(get_model('paypal', 'Amount').objects.values_list('id', flat=True)), [amounts[0].id])
+        self.assertEqual(
+            list(get_model('paypal', 'PricingScheme').objects.values_list('id', flat=True)), [schemes[0].id]
+        )
+        self.assertEqual(
+            list(get_model('paypal', 'BillingCycle').objects.values_list('pricing_scheme_id', flat=True)),
+            [schemes[0].id] * 3
+        )
+        # Plans that aren't on PayPal yet all have an empty plan_id, they are not duplicates
+        self.assertEqual(
+            sorted(get_model('paypal', 'BillingPlan').objects.values_list('id', flat=True)),
+            sorted(plan.id for plan in plans if plan.id != plans[1].id)
+        )
+        subscription = get_model('paypal', 'Subscription').objects.get()
+        self.assertEqual(
+            (subscription.id, subscription.plan_id, subscription.shipping_amount_id),
+            (subscriptions[0].id, plans[0].id, amounts[0].id)
+        )
+        self.assertEqual(
+            list(get_model('paypal', 'Subscriber').objects.values_list('subscription_id', flat=True)),
+            [subscription.id]
+        )
+
+
+CHECKOUT_ITEMS = {
+    "book": {"name": 'Book', "unit_amount": '12.50', "currency_code": 'USD'},
+    "album": {"name": 'Album', "unit_amount": '9.00', "currency_code": 'EUR'},
+}
+
+
+class LookupBenchmarkTests(TestCase):
+    def test_kept_runs_seed_their_own_rows(self):
+        for _ in range(2):
+            result = benchmark.run_lookup_benchmark(20, 2, keep=True)
+            self.assertEqual(set(result['scenarios']), {
+                'subscription_by_id', 'plan_by_id', 'active_plans', 'user_active_subscription', 'subscriber_by_email'
+            })
+
+        self.assertEqual(Subscription.objects.count(), 40)
+        self.assertEqual(get_user_model().objects.filter(username__startswith='bench-').count(), 20000)
+        # Written without the save signals, nothing is sent to PayPal
+        self.assertFalse(OutboxMessage.objects.exists())
+
+
+class InternCacheTests(TransactionTestCase):
+    # Commits for real, rows only enter the cache on commit
+
+    def setUp(self):
+        for intern_cache in interning.CACHES.values():
+            intern_cache.clear()
+            self.addCleanup(intern_cache.clear)
+
+    def test_resolved_values_are_served_from_the_cache(self):
+        pk = interning.amounts.resolve(('USD', 10.0), create=True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(interning.amounts.resolve(('USD', 10.0)), pk)
+        self.assertEqual(Amount.objects.get(pk=pk).value, 10)
+
+    def test_rows_of_a_rolled_back_transaction_are_not_cached(self):
+        with transaction.atomic():
+            interning.amounts.resolve(('USD', 10.0), create=True)
+            transaction.set_rollback(True)
+
+        self.assertEqual(interning.amounts.pks, {})
+        self.assertIsNone(interning.amounts.resolve(('USD', 10.0)))
+
+    def test_saved_row_is_dropped(self):
+        pk = interning.amounts.resolve(('USD', 10.0), create=True)
+        amount = Amount.objects.get(pk=pk)
+        amount.value = 12
+        amount.save()
+
+        self.assertIsNone(interning.amounts.resolve(('USD', 10.0)))
+        self.assertEqual(interning.amounts.resolve(('USD', 12.0)), pk)
+
+
+class PlanPayloadTests(TestCase):
+    def setUp(self):
+        self.plan = create_plan(prices=(10, 20, 30))
+
+    def test_plan_payload_is_built_from_two_queries(self):
+        with self.assertNumQueries(2):
+            data = build_plan_data(plan_queryset().get(pk=self.plan.pk))
+
+        self.assertEqual(data['product_id'], 'PROD-1')
+        self.assertEqual(
+            [(cycle['sequence'], cycle['pricing_scheme']['fixed_price']['value']) for cycle in data['billing_cycles']],
+            [(1, 10), (2, 20), (3, 30)]
+        )
+        self.assertEqual(data['payment_preferences']['setup_fee'], {"value": 0, "currency_code": 'USD'})
+
+    def test_pricing_payload_has_only_the_changed_cycles(self):
+        snapshot = dict(self.plan.billing_cycles.values_list('sequence', 'pricing_scheme_id'))
+        self.assertIsNone(build_pricing_data(plan_queryset().get(pk=self.plan.pk), snapshot))
+        BillingCycle.objects.filter(billing_plan=self.plan, sequence=2).update(pricing_scheme=get_pricing_scheme(25))
+
+        with self.assertNumQueries(2):
+            data = build_pricing_data(plan_queryset().get(pk=self.plan.pk), snapshot)
+        self.assertEqual(data, {
+            "pricing_schemes": [{
+                "billing_cycle_sequence": 2,
+                "pricing_scheme": {"fixed_price": {"value": 25, "currency_code": 'USD'}}
+            }]
+        })
+
+
+CHECKOUT_ITEMS = {
+    "book": {"name": 'Book', "unit_amount": '12.50', "currency_code": 'USD'},
+    "album": {"name": 'Album', "unit_amount": '9.00', "currency_code": 'EUR'},
+    "figure": {"name": 'Figure', "unit_amount": '1500', "currency_code": 'JPY'},
+}
+
+
+@override_settings(PAYPAL_CHECKOUT_ITEMS=CHECKOUT_ITEMS)
+class CheckoutTests(SandboxMixin, TestCase):
+    def create_order(self, items: list, request_id: str = 'checkout-1'):
+        return self.client.post(
+            reverse('paypal:paypal-checkout:create-order'),
+            json.dumps({"items": items}),
+            content_type='application/json',
+            HTTP_PAYPAL_REQUEST_ID=request_id
+        )
+
+    def capture_order(self, order_id: str):
+        return self.client.post(reverse('paypal:paypal-checkout:capture-order', args=[order_id]))
+
+    def test_items_are_priced_from_the_catalog(self):
+        response = self.create_order([{"sku": 'book', "quantity": 2, "unit_amount": '0.01'}])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['currency_code'], response.json()['value']), ('USD', '25.00'))
+
+    def test_retried_request_gets_the_same_order(self):
+        first = self.create_order([{"sku": 'book', "quantity": 1}])
+        orders = len(self.sandbox.state.orders)
+        retry = self.create_order([{"sku": 'book', "quantity": 1}])
+
+        self.assertEqual((first.status_code, retry.status_code), (201, 200))
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(len(self.sandbox.state.orders), orders)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_reused_request_id_with_another_body_conflicts(self):
+        self.create_order([{"sku": 'book', "quantity": 1}])
+        response = self.create_order([{"sku": 'book', "quantity": 3}])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(set(response.json()), {'error', 'details'})
+        self.assertEqual(Order.objects.get().value, 12.5)
+
+    def test_invalid_items_are_rejected(self):
+        unknown = [{"sku": 'unknown', "quantity": 1}]
+        mixed_currencies = [{"sku": 'book', "quantity": 1}, {"sku": 'album', "quantity": 1}]
+        for items in (unknown, mixed_currencies):
+            response = self.create_order(items)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['details'][0]['issue'], 'INVALID_REQUEST')
+        self.assertFalse(Order.objects.exists())
+
+    def test_zero_decimal_currencies_are_sent_whole(self):
+        self.assertEqual((format_amount('12.5'), format_amount(1500.5, 'JPY')), ('12.50', '1501'))
+
+        response = self.create_order([{"sku": 'figure', "quantity": 1}], request_id='checkout-jpy')
+        self.assertEqual((response.status_code, response.json()['value']), (201, '1500'))
+        purchase_unit = self.sandbox.state.orders[response.json()['id']]['purchase_units'][0]
+        self.assertEqual((purchase_unit['amount']['currency_code'], purchase_unit['amount']['value']), ('JPY', '1500'))
+
+    def test_capture_is_idempotent(self):
+        order_id = self.create_order([{"sku": 'book', "quantity": 1}]).json()['id']
+
+        first = self.capture_order(order_id)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['status'], 'COMPLETED')
+        self.assertEqual(len(first.json()['captures']), 1)
+
+        # The first answer was lost, PayPal replays its capture for the same PayPal-Request-Id
+        Order.objects.filter(order_id=order_id).update(status=Order.OrderStatus.CREATED)
+        Capture.objects.all().delete()
+        for _ in range(2):
+            retry = self.capture_order(order_id)
+            self.assertEqual(retry.status_code, 200)
+            self.assertEqual(retry.json()['captures'], first.json()['captures'])
+        self.assertEqual(Capture.objects.count(), 1)
+
+    def test_unknown_order_is_not_found(self):
+        response = self.capture_order('UNKNOWN')
+        self.assertEqual((response.status_code, response.json()['error']), (404, 'Order not found'))
+
+
+class DecodeTests(TestCase):
+    def test_body_is_decoded_from_the_bytes(self):
+        self.assertEqual(decode(build_response(200, '{"name": "Café"}'.encode())), {"name": 'Café'})
+        self.assertEqual(decode(build_response(204)), {})
+        with self.assertRaises(ValueError):
+            decode(build_response(502, b'<html>Bad Gateway</html>'))
+
+    def test_json_is_used_without_orjson(self):
+        with mock.patch('paypal.utils.response.orjson', None):
+            self.assertEqual(loads(b'{"value": "1.50"}'), {"value": '1.50'})
+            with self.assertRaises(ValueError):
+                loads(b'{')
+
+    def test_order_view_keeps_the_captures_only(self):
+        order = OrderView({
+            "id": 'ORDER-1',
+            "status": 'COMPLETED',
+            "purchase_units": [{
+                "reference_id": 'default',
+                "payments": {"captures": [
+                    {"id": 'CAPTURE-1', "status": 'COMPLETED', "amount": {"currency_code": 'USD', "value": '12.50'}}
+                ]}
+            }]
+        })
+
+        capture, = order.captures
+        self.assertEqual((capture.id, capture.currency_code, capture.value), ('CAPTURE-1', 'USD', Decimal('12.50')))
+        self.assertIsNone(order._purchase_units)
+
+
+@override_settings(PAYPAL_OUTBOX_AUTO_PROCESS=False)
+class SubscribeViewTests(TransactionTestCase):
+    # Commits for real, the active-plan cache is dropped on commit
+
+    def setUp(self):
+        plans.get_cache().delete(plans.CACHE_KEY)
+        self.plan = create_plan()
+        self.url = reverse('paypal:subscribe_plan', args=['P-1'])
+
+    def test_unchanged_plan_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertContains(response, 'P-1')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_plan_is_rendered_again(self):
+        etag = self.client.get(self.url)['ETag']
+        self.plan.update_time += timedelta(minutes=1)
+        self.plan.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_inactive_plan_is_not_found(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.plan.status = BillingPlan.BillingPlanStatus.INACTIVE
+        self.plan.save()
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_newest_active_plan_is_the_default(self):
+        create_plan('P-2', product_id='PROD-2')
+
+        self.assertContains(self.client.get(reverse('paypal:subscribe')), 'P-2')
+
+
+@override_settings(PAYPAL_RESOURCE_CACHE='default')
+class ResourceCacheTests(SandboxMixin, TestCase):
+    products = 1
+
+    def setUp(self):
+        resource_cache._caches.clear()
+        cache.clear()
+        self.addCleanup(resource_cache._caches.clear)
+        products = copy.deepcopy(self.sandbox.state.products)
+        self.addCleanup(setattr, self.sandbox.state, 'products', products)
+        self.product_id = next(iter(self.sandbox.state.products))
+
+    def test_repeated_gets_are_answered_from_the_cache(self):
+        helper = PayPalProduct()
+        product = helper.get_product(self.product_id)
+        requests = self.sandbox.state.requests
+
+        self.assertEqual(helper.get_product(self.product_id), product)
+        self.assertEqual(PayPalProduct().get_product(self.product_id), product)
+        self.assertEqual(self.sandbox.state.requests, requests)
+        self.assertEqual(helper.get_cache_stats()['product'], {
+            "hits": 2, "shared_hits": 0, "misses": 1, "size": 1, "maxsize": 1024
+        })
+
+    def test_update_drops_the_cached_product(self):
+        helper = PayPalProduct()
+        helper.get_product(self.product_id)
+
+        helper.update_product(self.product_id, {'description': 'Changed'})
+        self.assertEqual(helper.get_product(self.product_id)['description'], 'Changed')
+
+    def test_webhook_event_drops_the_cached_product(self):
+        helper = PayPalProduct()
+        helper.get_product(self.product_id)
+        self.sandbox.state.products[self.product_id]['description'] = 'Changed'
+        self.assertNotEqual(helper.get_product(self.product_id)['description'], 'Changed')
+
+        handlers.apply_products([add_event('CATALOG.PRODUCT.UPDATED', {"id": self.product_id})])
+        self.assertEqual(helper.get_product(self.product_id)['description'], 'Changed')
+
+    @override_settings(PAYPAL_RESOURCE_CACHE='')
+    def test_cache_is_opt_in(self):
+        helper = PayPalProduct()
+        helper.get_product(self.product_id)
+        requests = self.sandbox.state.requests
+
+        helper.get_product(self.product_id)
+        self.assertEqual(self.sandbox.state.requests - requests, 1)
+        self.assertEqual(helper.get_cache_stats(), {})
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_priorities_take_up_to_their_share(self):
+        bucket = TokenBucket(10)
+        window = int(time.time()) + 60
+        bulk = sum(bucket.take(window, 10 * bucket.shares[Priority.BULK]) for _ in range(10))
+        checkout = sum(bucket.take(window, 10 * bucket.shares[Priority.CHECKOUT]) for _ in range(10))
+
+        # Bulk leaves half of the rate to the higher priorities
+        self.assertEqual((bulk, checkout), (5, 5))
+
+    def test_retry_after_pauses_every_priority(self):
+        bucket = TokenBucket(10, max_wait=0)
+        bucket.pause(2)
+
+        with self.assertRaises(RateLimited):
+            bucket.acquire(Priority.CHECKOUT)
+        self.assertEqual(bucket.rejections, 1)
+
+    def test_async_acquire_waits_for_the_next_second(self):
+        bucket = TokenBucket(2, max_wait=5)
+
+        async def acquire():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            for _ in range(2):
+                await bucket.acquire_async(Priority.BULK)
+            ticker.cancel()
+            return ticks
+
+        # One bulk token per second, the second call waits without blocking the loop
+        self.assertGreater(asyncio.run(acquire()), 0)
+        self.assertGreaterEqual(bucket.waits, 1)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('v1/test', window=4, min_calls=4, failure_ratio=0.5, open_seconds=0.05)
+
+    def open(self):
+        for failed in (False, True, False, True):
+            self.breaker.before_call()
+            self.breaker.record(failed)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_failures_open_the_circuit(self):
+        for failed in (False, True, False):
+            self.breaker.record(failed)
+        # Too few calls to judge
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+        self.assertEqual(self.breaker.rejections, 1)
+
+    def test_one_probe_closes_the_circuit(self):
+        self.open()
+        time.sleep(0.06)
+
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open()
+        time.sleep(0.06)
+
+        self.breaker.before_call()
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+    def test_probe_that_was_not_sent_lets_another_one_through(self):
+        self.open()
+        time.sleep(0.06)
+
+        self.breaker.before_call()
+        self.breaker.release()
+        self.breaker.before_call()
+
+    def test_cancelled_probe_lets_another_one_through(self):
+        self.open()
+        time.sleep(0.06)
+
+        async def cancel_probe():
+            started = asyncio.Event()
+
+            async def call():
+                started.set()
+                await asyncio.sleep(60)
+
+            probe = asyncio.ensure_future(throttle.send_async('https://api-m.paypal.com/v1/test', call))
+            await started.wait()
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+
+        for patcher in (
+            mock.patch.object(throttle, 'get_breaker', return_value=self.breaker),
+            mock.patch.object(throttle, 'get_token_bucket', return_value=None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        asyncio.run(cancel_probe())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.before_call()
+
+    def test_server_errors_and_slow_calls_are_failures(self):
+        self.assertTrue(self.breaker.is_failure(mock.Mock(status_code=503), 0.1))
+        self.assertTrue(self.breaker.is_failure(mock.Mock(status_code=200), 11))
+        self.assertFalse(self.breaker.is_failure(mock.Mock(status_code=404), 0.1))
+
+
+@override_settings(
+    PAYPAL_RATE_LIMIT=0,
+    PAYPAL_CIRCUIT_BREAKER=True,
+    PAYPAL_CIRCUIT_BREAKER_OPTIONS={"window": 4, "min_calls": 4, "open_seconds": 60},
+    PAYPAL_MAX_RETRIES=0
+)
+class ThrottledHelperTests(SandboxMixin, TestCase):
+    products = 1
+
+    def setUp(self):
+        # Own breakers, and a session built without retries so every call is one outcome
+        for patcher in (mock.patch.dict(throttle._breakers, clear=True), mock.patch.object(session, '_session', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(session.close_session)
+        self.product_id = next(iter(self.sandbox.state.products))
+
+    def fail_requests(self):
+        self.sandbox.httpd.RequestHandlerClass.error_rate = 1.0
+        self.addCleanup(setattr, self.sandbox.httpd.RequestHandlerClass, 'error_rate', 0.0)
+
+    def test_open_circuit_fails_fast(self):
+        helper = PayPalProduct(use_cache=False)
+        helper.get_product(self.product_id)
+        self.fail_requests()
+
+        with self.assertRaises(CircuitOpen):
+            for _ in range(10):
+                helper.get_product(self.product_id)
+        requests = self.sandbox.state.requests
+        with self.assertRaises(CircuitOpen):
+            helper.get_product(self.product_id)
+        self.assertEqual(self.sandbox.state.requests, requests)
+
+    def test_async_helpers_share_the_breakers(self):
+        PayPalProduct(use_cache=False).get_product(self.product_id)
+        self.fail_requests()
+
+        async def get_products():
+            helper = AsyncPayPalProduct(priority=Priority.BULK)
+            try:
+                for _ in range(10):
+                    await helper.get_product(self.product_id)
+            finally:
+                await close_client()
+
+        with self.assertRaises(CircuitOpen):
+            asyncio.run(get_products())
+        # Opened by the async calls, the sync helpers fail fast too
+        with self.assertRaises(CircuitOpen):
+            PayPalProduct(use_cache=False).get_product(self.product_id)
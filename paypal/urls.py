@@ -6,5 +6,7 @@ app_name = 'paypal'
 
 urlpatterns = [
     path('webhook/', include('paypal.webhook.urls')),
-    path('subscribe/', SubscribeTemplateView.as_view(), name='subscribe')
+    path('checkout/', include('paypal.checkout.urls')),
+    path('subscribe/', SubscribeTemplateView.as_view(), name='subscribe'),
+    path('subscribe/<str:plan_id>/', SubscribeTemplateView.as_view(), name='subscribe_plan')
 ]
@@ -0,0 +1,221 @@
+import asyncio
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+
+from paypal.utils import resource_cache, throttle
+from paypal.utils.base import PayPalHelper, get_base_url, get_resource_path
+from paypal.utils.response import decode
+from paypal.utils.token import AccessToken, get_token_store, get_token_key
+
+# One connection pool and one token refresh lock per event loop, httpx clients can't be shared across loops
+_clients = weakref.WeakKeyDictionary()
+_token_locks = weakref.WeakKeyDictionary()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+def build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=getattr(settings, 'PAYPAL_ASYNC_MAX_CONNECTIONS', 100),
+            max_keepalive_connections=getattr(settings, 'PAYPAL_ASYNC_MAX_KEEPALIVE', 20)
+        ),
+        timeout=httpx.Timeout(
+            getattr(settings, 'PAYPAL_READ_TIMEOUT', 30),
+            connect=getattr(settings, 'PAYPAL_CONNECT_TIMEOUT', 5)
+        ),
+        transport=httpx.AsyncHTTPTransport(retries=getattr(settings, 'PAYPAL_MAX_RETRIES', 3))
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = build_client()
+    return client
+
+
+async def close_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _get_token_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _token_locks.get(loop)
+    if lock is None:
+        lock = _token_locks[loop] = asyncio.Lock()
+    return lock
+
+
+class AsyncPayPalHelper:
+    """
+    asyncio counterpart of PayPalHelper.
+    Shares the token store with the synchronous helpers, so a token fetched by either is reused by both, and so
+    are the rate limit and circuit breakers of paypal.utils.throttle.
+    """
+    # Rate limit priority of the calls, see paypal.utils.throttle
+    priority = throttle.Priority.NORMAL
+
+    def __init__(self, priority: int = None):
+        self.client_id = settings.PAYPAL_CLIENT_ID
+        self.secret_key = settings.PAYPAL_SECRET_KEY
+        self.base_url = get_base_url()
+
+        self.access_token = None
+        self.token_store = get_token_store()
+        self.token_key = get_token_key(self.base_url, self.client_id)
+        self.max_retries = getattr(settings, 'PAYPAL_MAX_RETRIES', 3)
+        self.retry_backoff = getattr(settings, 'PAYPAL_RETRY_BACKOFF', 0.5)
+        if priority is not None:
+            self.priority = priority
+
+        self.access_token_url = f"{self.base_url}/v1/oauth2/token"
+        self.products_url = f"{self.base_url}/v1/catalogs/products"
+        self.plan_url = f"{self.base_url}/v1/billing/plans"
+        self.subscription_url = f"{self.base_url}/v1/billing/subscriptions"
+        self.orders_url = f"{self.base_url}/v2/checkout/orders"
+        self.resource_urls = {
+            "product": self.products_url,
+            "plan": self.plan_url,
+            "subscription": self.subscription_url
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return get_client()
+
+    async def send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        # Waits for a rate limit token without blocking the loop, and fails fast while the endpoint's circuit is open
+        return await throttle.send_async(url, lambda: self.client.request(method, url, **kwargs), self.priority)
+
+    async def fetch_access_token(self):
+        response = await self.send(
+            "POST",
+            self.access_token_url,
+            auth=(self.client_id, self.secret_key),
+            data={
+                "grant_type": "client_credentials"
+            },
+            headers={
+                "Accept": "application/json",
+                "Accept-Language": "en_US"
+            }
+        )
+        response.raise_for_status()
+        data = decode(response)
+        return data.get('access_token'), data.get('expires_in', 0)
+
+    def _is_usable(self, token, rejected):
+        return token is not None and token.value != rejected and not token.is_expired()
+
+    async def get_access_token(self, rejected: str = None):
+        store = self.token_store
+        lock = _get_token_lock()
+
+        token = store.get(self.token_key)
+        if self._is_usable(token, rejected) and (not token.is_expired(store.refresh_margin) or lock.locked()):
+            # Fresh, or close to expiry while another task is already refreshing it
+            self.access_token = token.value
+            return self.access_token
+
+        async with lock:
+            token = store.get(self.token_key)
+            if not self._is_usable(token, rejected) or token.is_expired(store.refresh_margin):
+                # Other threads and processes refresh through the store's lock too, it may have a new token after it
+                await self._acquire_store_lock()
+                try:
+                    token = store.get(self.token_key)
+                    if not self._is_usable(token, rejected) or token.is_expired(store.refresh_margin):
+                        value, expires_in = await self.fetch_access_token()
+                        token = AccessToken(value, time.time() + expires_in)
+                        store.set(self.token_key, token)
+                finally:
+                    store.release(self.token_key)
+
+        self.access_token = token.value
+        return self.access_token
+
+    async def _acquire_store_lock(self):
+        # The store's acquire() blocks, so it waits in a thread. A task cancelled meanwhile releases it once taken.
+        acquired = asyncio.ensure_future(asyncio.to_thread(self.token_store.acquire, self.token_key))
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            acquired.add_done_callback(
+                lambda future: future.cancelled() or future.exception() or self.token_store.release(self.token_key)
+            )
+            raise
+
+    async def get_request_headers(self, access_token: str = None):
+        return {
+            "Accept": "application/json",
+            "Accept-Language": "en_US",
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {access_token or await self.get_access_token()}"
+        }
+
+    get_idempotency_headers = staticmethod(PayPalHelper.get_idempotency_headers)
+
+    async def request(self, method: str, url: str, headers: dict = None, **kwargs) -> httpx.Response:
+        try:
+            return await self._request(method, url, headers, **kwargs)
+        finally:
+            if method != "GET":
+                # Writes drop what the synchronous helpers cached of the resource
+                self.invalidate_cache(url)
+
+    def invalidate_cache(self, url: str):
+        path = get_resource_path(self.resource_urls, url)
+        if path is not None:
+            resource_cache.invalidate(self.base_url, *path)
+
+    async def _request(self, method: str, url: str, headers: dict = None, **kwargs) -> httpx.Response:
+        access_token = await self.get_access_token()
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+
+        for attempt in range(retries + 1):
+            response = await self.send(
+                method, url, headers={**await self.get_request_headers(access_token), **(headers or {})}, **kwargs
+            )
+
+            if response.status_code == 401 and attempt == 0:
+                # Token was revoked or expired early, refresh it once and retry
+                access_token = await self.get_access_token(rejected=access_token)
+                response = await self.send(
+                    method, url, headers={**await self.get_request_headers(access_token), **(headers or {})}, **kwargs
+                )
+
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+
+            retry_after = response.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else self.retry_backoff * (2 ** attempt)
+            await asyncio.sleep(delay)
+        return response
+
+    async def paginate(self, url: str, key: str, page_size: int = 20, params: dict = None, headers: dict = None):
+        # Async generator walking every page of a PayPal list endpoint, like PayPalHelper.paginate
+        page = 1
+        while True:
+            data = decode(await self.request(
+                "GET",
+                url,
+                params={**(params or {}), "page": page, "page_size": page_size, "total_required": "true"},
+                headers=headers
+            ))
+            items = data.get(key, [])
+            for item in items:
+                yield item
+
+            total_pages = data.get('total_pages')
+            if not items or (total_pages is not None and page >= total_pages) or (
+                    total_pages is None and len(items) < page_size):
+                break
+            page += 1
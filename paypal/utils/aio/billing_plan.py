@@ -0,0 +1,71 @@
+from paypal.utils.aio.base import AsyncPayPalHelper
+from paypal.utils.base import UpdateResult, RETURN_REPRESENTATION, build_patch_data, build_update_result
+from paypal.utils.response import decode
+
+
+class AsyncPayPalBillingPlan(AsyncPayPalHelper):
+    async def get_billing_plans(self):
+        res = await self.request(
+            "GET",
+            self.plan_url
+        )
+        return decode(res).get('plans', [])
+
+    async def get_billing_plan(self, plan_id):
+        res = await self.request(
+            "GET",
+            f"{self.plan_url}/{plan_id}"
+        )
+        return decode(res)
+
+    async def create_billing_plan(self, data, request_id: str = None):
+        # If creating a plan succeeds, it triggers the BILLING.PLAN.CREATED webhook
+        res = await self.request(
+            "POST",
+            self.plan_url,
+            headers=self.get_idempotency_headers(request_id),
+            json=data
+        )
+        return decode(res)
+
+    async def update_billing_plan(self, plan_id, paths: dict) -> UpdateResult:
+        # If the update succeeds, it triggers the BILLING.PLAN.UPDATED webhook.
+        """
+        Can update these fields [description, auto_bill_outstanding, payment_failure_threshold]
+        Example: update_billing_plan.json file
+        """
+        data = build_patch_data(paths)
+        res = await self.request(
+            "PATCH",
+            f"{self.plan_url}/{plan_id}",
+            headers=RETURN_REPRESENTATION,
+            json=data
+        )
+        return build_update_result(res)
+
+    async def update_pricing(self, plan_id, data, request_id: str = None) -> UpdateResult:
+        # BILLING.PLAN.PRICING.CHANGE.ACTIVATED
+        """
+        Example: update_plan_pricing.json
+        """
+        res = await self.request(
+            "POST",
+            f"{self.plan_url}/{plan_id}/update-pricing-schemes",
+            headers={**RETURN_REPRESENTATION, **(self.get_idempotency_headers(request_id) or {})},
+            json=data
+        )
+        return build_update_result(res)
+
+    async def activate_billing_plan(self, plan_id):
+        # If the plan activation succeeds, it triggers the BILLING.PLAN.ACTIVATED webhook.
+        await self.request(
+            "POST",
+            f"{self.plan_url}/{plan_id}/activate"
+        )
+
+    async def deactivate_billing_plan(self, plan_id):
+        # If deactivation succeeds, it triggers the BILLING.PLAN.DEACTIVATED webhook.
+        await self.request(
+            "POST",
+            f"{self.plan_url}/{plan_id}/deactivate"
+        )
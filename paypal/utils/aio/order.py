@@ -0,0 +1,35 @@
+from paypal.utils.aio.base import AsyncPayPalHelper
+from paypal.utils.base import UpdateResult, RETURN_REPRESENTATION, build_update_result
+from paypal.utils.order import build_order_data
+from paypal.utils.response import decode
+from paypal.utils.throttle import Priority
+
+
+class AsyncPayPalOrder(AsyncPayPalHelper):
+    # Talks to the Orders v2 REST API directly, the checkout SDK client is blocking
+    priority = Priority.CHECKOUT
+
+    async def create_order(self, price=None, currency_code: str = "USD", items: list = None, custom_id: str = None,
+                           request_id: str = None) -> UpdateResult:
+        res = await self.request(
+            "POST",
+            self.orders_url,
+            headers={**RETURN_REPRESENTATION, **(self.get_idempotency_headers(request_id) or {})},
+            json=build_order_data(price, currency_code, items, custom_id)
+        )
+        return build_update_result(res)
+
+    async def get_order(self, order_id):
+        res = await self.request(
+            "GET",
+            f"{self.orders_url}/{order_id}"
+        )
+        return decode(res)
+
+    async def capture_order(self, order_id, request_id: str = None) -> UpdateResult:
+        res = await self.request(
+            "POST",
+            f"{self.orders_url}/{order_id}/capture",
+            headers={**RETURN_REPRESENTATION, **(self.get_idempotency_headers(request_id) or {})}
+        )
+        return build_update_result(res)
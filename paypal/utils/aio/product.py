@@ -0,0 +1,42 @@
+from paypal.utils.aio.base import AsyncPayPalHelper
+from paypal.utils.base import UpdateResult, RETURN_REPRESENTATION, build_patch_data, build_update_result
+from paypal.utils.response import decode
+
+
+class AsyncPayPalProduct(AsyncPayPalHelper):
+    async def get_products(self):
+        res = await self.request(
+            "GET",
+            self.products_url
+        )
+        return decode(res).get('products', [])
+
+    async def get_product(self, product_id):
+        res = await self.request(
+            "GET",
+            f"{self.products_url}/{product_id}"
+        )
+        return decode(res)
+
+    async def create_product(self, data, request_id: str = None):
+        # If creating a product succeeds, it triggers the CATALOG.PRODUCT.CREATED webhook
+        res = await self.request(
+            "POST",
+            self.products_url,
+            headers=self.get_idempotency_headers(request_id),
+            json=data
+        )
+        return decode(res)
+
+    async def update_product(self, prod_id, paths: dict) -> UpdateResult:
+        """
+        Can update these fields [description, category, image_url, home_url]
+        """
+        data = build_patch_data(paths)
+        res = await self.request(
+            "PATCH",
+            f"{self.products_url}/{prod_id}",
+            headers=RETURN_REPRESENTATION,
+            json=data
+        )
+        return build_update_result(res)
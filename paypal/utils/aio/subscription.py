@@ -0,0 +1,118 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from paypal.utils.aio.base import AsyncPayPalHelper
+from paypal.utils.base import UpdateResult, build_update_result
+from paypal.utils.response import decode
+from paypal.utils.subscription import PayPalSubscription, format_time, split_windows
+
+
+class AsyncPayPalSubscription(AsyncPayPalHelper):
+    max_page_size = PayPalSubscription.max_page_size
+    default_reasons = PayPalSubscription.default_reasons
+
+    async def get_subscription(self, subscription_id):
+        res = await self.request(
+            "GET",
+            f"{self.subscription_url}/{subscription_id}"
+        )
+        return decode(res)
+
+    async def update_subscription(self):
+        # If subscription update succeeds, it triggers the BILLING.SUBSCRIPTION.UPDATED webhook.
+        """
+        Can Update: subscriber.shipping_address, shipping_amount,
+        billing_info.outstanding_balance, subscriber.payment_source
+        """
+        pass
+
+    async def cancel_subscription(self, subscription_id, reason: str = None) -> UpdateResult:
+        # If subscription cancellation succeeds, it triggers the BILLING.SUBSCRIPTION.CANCELLED webhook.
+        res = await self.request(
+            "POST",
+            f"{self.subscription_url}/{subscription_id}/cancel",
+            json={
+                "reason": reason or self.default_reasons["cancel"]
+            }
+        )
+        return build_update_result(res)
+
+    async def activate_subscription(self, subscription_id, reason: str = None) -> UpdateResult:
+        # If activate subscription succeeds, it triggers the BILLING.SUBSCRIPTION.ACTIVATED webhook.
+        res = await self.request(
+            "POST",
+            f"{self.subscription_url}/{subscription_id}/activate",
+            json={
+                "reason": reason or self.default_reasons["activate"]
+            }
+        )
+        return build_update_result(res)
+
+    async def suspend_subscription(self, subscription_id, reason: str = None) -> UpdateResult:
+        # If subscription suspension succeeds, it triggers the BILLING.SUBSCRIPTION.SUSPENDED webhook.
+        res = await self.request(
+            "POST",
+            f"{self.subscription_url}/{subscription_id}/suspend",
+            json={
+                "reason": reason or self.default_reasons["suspend"]
+            }
+        )
+        return build_update_result(res)
+
+    async def get_transactions(self, subscription_id, start_time: datetime, end_time: datetime = None):
+        res = await self.request(
+            "GET",
+            f"{self.subscription_url}/{subscription_id}/transactions",
+            params={
+                "start_time": format_time(start_time),
+                "end_time": format_time(end_time or timezone.now())
+            }
+        )
+        return decode(res)
+
+    def iter_window_transactions(self, subscription_id, start_time: datetime, end_time: datetime,
+                                 page_size: int = max_page_size):
+        # Async generator paging through the transactions of one time window
+        return self.paginate(
+            f"{self.subscription_url}/{subscription_id}/transactions",
+            'transactions',
+            page_size=page_size,
+            params={
+                "start_time": format_time(start_time),
+                "end_time": format_time(end_time)
+            }
+        )
+
+    async def iter_transactions(self, subscription_id, start_time: datetime, end_time: datetime = None,
+                                window: timedelta = timedelta(days=30), concurrency: int = 1):
+        """
+        Async generator of PayPalSubscription.iter_transactions: the transactions between start_time and end_time,
+        oldest window first. With concurrency > 1 that many windows are fetched at once as tasks.
+        """
+        windows = split_windows(start_time, end_time or timezone.now(), window)
+        if concurrency <= 1:
+            for window_start, window_end in windows:
+                async for transaction in self.iter_window_transactions(subscription_id, window_start, window_end):
+                    yield transaction
+            return
+
+        async def fetch(bounds):
+            return [transaction async for transaction in self.iter_window_transactions(subscription_id, *bounds)]
+
+        pending = deque()
+        try:
+            for bounds in windows:
+                pending.append(asyncio.ensure_future(fetch(bounds)))
+                if len(pending) >= concurrency:
+                    for transaction in await pending.popleft():
+                        yield transaction
+            while pending:
+                for transaction in await pending.popleft():
+                    yield transaction
+        finally:
+            # The caller stopped early, windows still in flight are not needed
+            for task in pending:
+                task.cancel()
@@ -1,33 +1,130 @@
-import requests
+from functools import cached_property
+from typing import NamedTuple
+
 from django.conf import settings
-from paypalcheckoutsdk.core import SandboxEnvironment, LiveEnvironment, PayPalHttpClient
+from django.utils import timezone
+from paypalcheckoutsdk.core import SandboxEnvironment, LiveEnvironment, PayPalEnvironment, PayPalHttpClient
+
+from paypal.utils import resource_cache, throttle
+from paypal.utils.session import get_session, get_timeout, get_pool_stats
+from paypal.utils.response import decode, loads
+from paypal.utils.token import get_token_store, get_token_key
+
+LIVE_BASE_URL = "https://api-m.paypal.com"
+SANDBOX_BASE_URL = "https://api-m.sandbox.paypal.com"
+
+
+def get_base_url():
+    # PAYPAL_BASE_URL points every helper at another host, e.g. the local sandbox server (run_paypal_sandbox)
+    base_url = getattr(settings, 'PAYPAL_BASE_URL', '')
+    if base_url:
+        return base_url.rstrip('/')
+    if settings.PAYPAL_ENVIRONMENT == "PRODUCTION":
+        return LIVE_BASE_URL
+    return SANDBOX_BASE_URL
+
+
+class UpdateResult(NamedTuple):
+    ok: bool
+    status_code: int
+    # PayPal's update_time when it sent the resource back, otherwise the local time of the update
+    update_time: str
+    data: dict
+    # Seconds PayPal asked us to wait before the next call (Retry-After on 429/503)
+    retry_after: float = None
+
+
+def build_update_result(response) -> UpdateResult:
+    ok = 200 <= response.status_code < 300
+    try:
+        data = decode(response)
+    except ValueError:
+        data = {}
+
+    update_time = data.get('update_time') if isinstance(data, dict) else None
+    if ok and not update_time:
+        update_time = timezone.now().isoformat()
+
+    retry_after = response.headers.get('Retry-After')
+    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+    return UpdateResult(ok, response.status_code, update_time, data, retry_after)
+
+
+# Asks PayPal to answer writes with the full resource where the endpoint supports it
+RETURN_REPRESENTATION = {"Prefer": "return=representation"}
+
+
+def build_patch_data(paths: dict) -> list:
+    # {"/description": "..."} -> JSON Patch replace operations
+    return [
+        {
+            "op": "replace",
+            "path": path,
+            "value": value
+        } for path, value in paths.items()
+    ]
+
+
+def get_resource_path(resource_urls: dict, url: str):
+    # (resource, resource id or None) of a URL below one of resource_urls, None for any other URL
+    for resource, resource_url in resource_urls.items():
+        if url == resource_url:
+            return resource, None
+        if url.startswith(f"{resource_url}/"):
+            return resource, url[len(resource_url) + 1:].split('/', 1)[0].split('?', 1)[0]
+    return None
 
 
 class PayPalHelper:
-    def __init__(self):
+    # Rate limit priority of the calls, see paypal.utils.throttle
+    priority = throttle.Priority.NORMAL
+
+    def __init__(self, use_cache: bool = None, priority: int = None):
         self.client_id = settings.PAYPAL_CLIENT_ID
         self.secret_key = settings.PAYPAL_SECRET_KEY
 
-        if settings.PAYPAL_ENVIRONMENT == "PRODUCTION":
-            self.base_url = "https://api-m.paypal.com"
+        self.base_url = get_base_url()
+        if getattr(settings, 'PAYPAL_BASE_URL', ''):
+            self.environment = PayPalEnvironment(self.client_id, self.secret_key, self.base_url, self.base_url)
+        elif settings.PAYPAL_ENVIRONMENT == "PRODUCTION":
             self.environment = LiveEnvironment(client_id=self.client_id, client_secret=self.secret_key)
         else:
-            self.base_url = "https://api-m.sandbox.paypal.com"
             self.environment = SandboxEnvironment(client_id=self.client_id, client_secret=self.secret_key)
 
-        self.client = PayPalHttpClient(environment=self.environment)
         self.access_token = None
+        self.session = get_session()
+        self.timeout = get_timeout()
+        self.token_store = get_token_store()
+        self.token_key = get_token_key(self.base_url, self.client_id)
 
         self.access_token_url = f"{self.base_url}/v1/oauth2/token"
         self.products_url = f"{self.base_url}/v1/catalogs/products"
         self.plan_url = f"{self.base_url}/v1/billing/plans"
         self.subscription_url = f"{self.base_url}/v1/billing/subscriptions"
+        self.orders_url = f"{self.base_url}/v2/checkout/orders"
+
+        if priority is not None:
+            self.priority = priority
+        # GETs of these resources go through paypal.utils.resource_cache when it is enabled (PAYPAL_RESOURCE_CACHE)
+        self.use_cache = resource_cache.is_enabled() if use_cache is None else use_cache
+        self.resource_urls = {
+            "product": self.products_url,
+            "plan": self.plan_url,
+            "subscription": self.subscription_url
+        }
 
-    def get_access_token(self):
-        if self.access_token:
-            return self.access_token
+    @cached_property
+    def client(self) -> PayPalHttpClient:
+        # Checkout SDK client, built on first use as the helpers call the REST API on the pooled session
+        return PayPalHttpClient(environment=self.environment)
 
-        self.access_token = requests.post(
+    def send(self, method: str, url: str, **kwargs):
+        # Every outbound call waits for the shared rate limit and fails fast while its endpoint's circuit is open
+        return throttle.send(url, lambda: self.session.request(method, url, **kwargs), self.priority)
+
+    def fetch_access_token(self):
+        response = self.send(
+            "POST",
             self.access_token_url,
             auth=(self.client_id, self.secret_key),
             data={
@@ -37,14 +134,105 @@ class PayPalHelper:
                 "Accept": "application/json",
                 "Accept-Language": "en_US"
             },
-        ).json().get('access_token')
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = decode(response)
+        return data.get('access_token'), data.get('expires_in', 0)
 
+    def get_access_token(self, rejected: str = None):
+        # Tokens are shared by every helper in the process (or across processes, see PAYPAL_TOKEN_STORE)
+        self.access_token = self.token_store.get_token(self.token_key, self.fetch_access_token, rejected)
         return self.access_token
 
-    def get_request_headers(self):
+    def get_request_headers(self, access_token: str = None):
         return {
             "Accept": "application/json",
             "Accept-Language": "en_US",
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.get_access_token()}"
+            "Authorization": f"Bearer {access_token or self.get_access_token()}"
         }
+
+    @staticmethod
+    def get_idempotency_headers(request_id: str = None):
+        # PayPal replays the original response for a repeated PayPal-Request-Id instead of acting twice
+        return {"PayPal-Request-Id": str(request_id)} if request_id else None
+
+    def request(self, method: str, url: str, headers: dict = None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            access_token = self.get_access_token()
+            response = self.send(
+                method, url, headers={**self.get_request_headers(access_token), **(headers or {})}, **kwargs
+            )
+
+            if response.status_code == 401:
+                # Token was revoked or expired early, refresh it once and retry
+                access_token = self.get_access_token(rejected=access_token)
+                response = self.send(
+                    method, url, headers={**self.get_request_headers(access_token), **(headers or {})}, **kwargs
+                )
+            return response
+        finally:
+            if method != "GET":
+                # Also after an error, the write may have reached PayPal
+                self.invalidate_cache(url)
+
+    def invalidate_cache(self, url: str):
+        path = get_resource_path(self.resource_urls, url)
+        if path is not None:
+            resource_cache.invalidate(self.base_url, *path)
+
+    def get_resource(self, resource: str, resource_id: str = None):
+        """
+        GET of one resource, or of the first page of its list without resource_id, decoded.
+        Read through the resource cache when use_cache is set, only 200 responses are cached.
+        """
+        url = self.resource_urls[resource]
+        if resource_id:
+            url = f"{url}/{resource_id}"
+        if not self.use_cache:
+            return decode(self.request("GET", url))
+
+        cache = resource_cache.get_resource_cache(resource)
+        key = cache.key(self.base_url, resource_id)
+        content = cache.get(key)
+        if content is None:
+            generation = cache.generation
+            response = self.request("GET", url)
+            if response.status_code != 200:
+                return decode(response)
+            content = response.content
+            cache.set(key, content, generation)
+        return loads(content) if content else {}
+
+    def paginate(self, url: str, key: str, page_size: int = 20, params: dict = None, headers: dict = None):
+        # Lazily walks every page of a PayPal list endpoint, yielding the items under `key`
+        page = 1
+        while True:
+            data = decode(self.request(
+                "GET",
+                url,
+                params={**(params or {}), "page": page, "page_size": page_size, "total_required": "true"},
+                headers=headers
+            ))
+            items = data.get(key, [])
+            yield from items
+
+            total_pages = data.get('total_pages')
+            if not items or (total_pages is not None and page >= total_pages) or (
+                    total_pages is None and len(items) < page_size):
+                break
+            page += 1
+
+    @staticmethod
+    def get_pool_stats():
+        return get_pool_stats()
+
+    @staticmethod
+    def get_cache_stats():
+        return resource_cache.get_cache_stats()
+
+    @staticmethod
+    def get_throttle_stats():
+        return throttle.get_throttle_stats()
@@ -1,69 +1,96 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
-from paypal.utils.base import PayPalHelper
+from paypal.utils.base import (
+    PayPalHelper,
+    UpdateResult,
+    RETURN_REPRESENTATION,
+    build_patch_data,
+    build_update_result
+)
+from paypal.utils.response import decode
 
 
 class PayPalBillingPlan(PayPalHelper):
+    # Largest page size the billing plans API accepts
+    max_page_size = 20
+
     def get_billing_plans(self):
-        return requests.get(
-            self.plan_url,
-            headers=self.get_request_headers()
-        ).json().get('plans', [])
+        return self.get_resource("plan").get('plans', [])
+
+    def iter_billing_plans(self, page_size: int = max_page_size, product_id: str = None, full: bool = False):
+        # With `full`, PayPal returns complete plan details (incl. update_time) in the list itself
+        params = {"product_id": product_id} if product_id else None
+        headers = {"Prefer": "return=representation"} if full else None
+        return self.paginate(self.plan_url, 'plans', page_size=page_size, params=params, headers=headers)
 
     def get_billing_plan(self, plan_id):
-        return requests.get(
-            f"{self.plan_url}/{plan_id}",
-            headers=self.get_request_headers()
-        ).json()
+        return self.get_resource("plan", plan_id)
 
-    def create_billing_plan(self, data):
+    def create_billing_plan(self, data, request_id: str = None):
         # If creating a plan succeeds, it triggers the BILLING.PLAN.CREATED webhook
-        return requests.post(
+        return decode(self.request(
+            "POST",
             self.plan_url,
-            headers=self.get_request_headers(),
+            headers=self.get_idempotency_headers(request_id),
             json=data
-        ).json()
+        ))
 
-    def update_billing_plan(self, plan_id, paths: dict):
+    def update_billing_plan(self, plan_id, paths: dict) -> UpdateResult:
         # If the update succeeds, it triggers the BILLING.PLAN.UPDATED webhook.
         """
         Can update these fields [description, auto_bill_outstanding, payment_failure_threshold]
         Example: update_billing_plan.json file
         """
-        data: list = list()
-        for path, value in paths.items():
-            data.append({
-                "op": "replace",
-                "path": path,
-                "value": value
-            })
-        requests.patch(
+        data = build_patch_data(paths)
+        res = self.request(
+            "PATCH",
             f"{self.plan_url}/{plan_id}",
-            headers=self.get_request_headers(),
+            headers=RETURN_REPRESENTATION,
             json=data
         )
+        return build_update_result(res)
 
-    def update_pricing(self, plan_id, data):
+    def update_pricing(self, plan_id, data, request_id: str = None) -> UpdateResult:
         # BILLING.PLAN.PRICING.CHANGE.ACTIVATED
         """
         Example: update_plan_pricing.json
         """
-        requests.post(
+        res = self.request(
+            "POST",
             f"{self.plan_url}/{plan_id}/update-pricing-schemes",
-            headers=self.get_request_headers(),
+            headers={**RETURN_REPRESENTATION, **(self.get_idempotency_headers(request_id) or {})},
             json=data
         )
+        return build_update_result(res)
 
-    def activate_billing_plan(self, plan_id):
+    def activate_billing_plan(self, plan_id) -> UpdateResult:
         # If the plan activation succeeds, it triggers the BILLING.PLAN.ACTIVATED webhook.
-        requests.post(
-            f"{self.plan_url}/{plan_id}/activate",
-            headers=self.get_request_headers(),
+        res = self.request(
+            "POST",
+            f"{self.plan_url}/{plan_id}/activate"
         )
+        return build_update_result(res)
 
-    def deactivate_billing_plan(self, plan_id):
+    def deactivate_billing_plan(self, plan_id) -> UpdateResult:
         # If deactivation succeeds, it triggers the BILLING.PLAN.DEACTIVATED webhook.
-        requests.post(
-            f"{self.plan_url}/{plan_id}/deactivate",
-            headers=self.get_request_headers(),
+        res = self.request(
+            "POST",
+            f"{self.plan_url}/{plan_id}/deactivate"
         )
+        return build_update_result(res)
+
+    def set_billing_plan_statuses(self, plan_ids: list, active: bool, concurrency: int = 8) -> dict:
+        """
+        Activates or deactivates plans on a bounded thread pool.
+        Returns {plan_id: UpdateResult}, a request that raised is reported as a failed result with status code 0.
+        """
+        call = self.activate_billing_plan if active else self.deactivate_billing_plan
+
+        def set_status(plan_id):
+            try:
+                return call(plan_id)
+            except Exception as e:
+                return UpdateResult(False, 0, None, {"message": f"{type(e).__name__} | {e}"})
+
+        with ThreadPoolExecutor(max_workers=max(min(concurrency, len(plan_ids)), 1)) as executor:
+            return dict(zip(plan_ids, executor.map(set_status, plan_ids)))
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import NamedTuple
+
+from paypal.utils.base import UpdateResult
+from paypal.utils.throttle import RateLimited, CircuitOpen
+
+RATE_LIMIT_STATUSES = (429, 503)
+
+
+class BulkResult(NamedTuple):
+    id: str
+    ok: bool
+    status_code: int
+    message: str
+    attempts: int
+
+
+class Checkpoint:
+    """
+    Append-only record of the ids a bulk run already handled, one JSON object per line.
+    Ids that succeeded are skipped when the run is started again with the same file, failed ones are retried.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of a run that was killed mid-write
+                        continue
+                    if entry.get('ok'):
+                        self.done.add(entry['id'])
+        self.file = open(path, 'a')
+
+    def record(self, result: BulkResult):
+        self.file.write(json.dumps({"id": result.id, "ok": result.ok, "status_code": result.status_code}) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class RateLimiter:
+    # Shared pause of every worker once PayPal answers 429/503, so the whole pool honours Retry-After
+    def __init__(self, backoff: float = 1.0):
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+
+    def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, retry_after: float, attempt: int):
+        delay = retry_after if retry_after is not None else self.backoff * 2 ** attempt
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+
+def run_bulk(call, ids, concurrency: int = 8, max_retries: int = 5, checkpoint: Checkpoint = None,
+             backoff: float = 1.0, record: bool = True):
+    """
+    Calls `call(id)` -> UpdateResult for every id of the iterable on a bounded thread pool and yields a
+    BulkResult per id as they complete. Ids are read lazily, at most twice `concurrency` calls are in flight.
+    Ids done in `checkpoint` are skipped. Results are recorded in it as they are yielded, unless `record` is
+    False because the caller records them once it has stored them.
+    """
+    limiter = RateLimiter(backoff)
+
+    def attempt(resource_id):
+        for attempts in range(1, max_retries + 2):
+            limiter.wait()
+            try:
+                result = call(resource_id)
+            except (RateLimited, CircuitOpen) as e:
+                # Refused before reaching PayPal, backed off and retried like a 503
+                result = UpdateResult(False, 503, None, {"message": f"{type(e).__name__} | {e}"})
+            except Exception as e:
+                result = UpdateResult(False, 0, None, {"message": f"{type(e).__name__} | {e}"})
+
+            if result.status_code in RATE_LIMIT_STATUSES and attempts <= max_retries:
+                limiter.pause(result.retry_after, attempts - 1)
+                continue
+            message = '' if result.ok else str(result.data.get('message', result.data) if result.data else '')
+            return BulkResult(resource_id, result.ok, result.status_code, message, attempts)
+
+    ids = iter(ids)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        try:
+            while True:
+                for resource_id in ids:
+                    if checkpoint is not None and resource_id in checkpoint.done:
+                        continue
+                    pending.add(executor.submit(attempt, resource_id))
+                    if len(pending) >= concurrency * 2:
+                        break
+                if not pending:
+                    return
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if checkpoint is not None and record:
+                        checkpoint.record(result)
+                    yield result
+        finally:
+            # The caller stopped iterating, don't start the queued calls
+            for future in pending:
+                future.cancel()
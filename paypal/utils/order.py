@@ -1,42 +1,92 @@
-from paypalcheckoutsdk.orders import OrdersCaptureRequest, OrdersCreateRequest
+from decimal import Decimal, ROUND_HALF_UP
 
-from paypal.utils.base import PayPalHelper
+from paypal.utils.base import PayPalHelper, UpdateResult, RETURN_REPRESENTATION, build_update_result
+from paypal.utils.response import decode
+from paypal.utils.throttle import Priority
 
+# Currencies PayPal only accepts whole amounts in
+ZERO_DECIMAL_CURRENCIES = ('HUF', 'JPY', 'TWD')
 
-class PayPalOrder(PayPalHelper):
-    def create_order(self, price):
-        create_order = OrdersCreateRequest()
-
-        create_order.request_body({
-            "intent": "CAPTURE",
-            "purchase_units": [
-                {
-                    "amount": {
-                        "currency_code": "USD",
-                        "value": price,
-                        "breakdown": {
-                            "item_total": {
-                                "currency_code": "USD",
-                                "value": price
-                            }
-                        },
-                    }
+
+def format_amount(value, currency_code: str = "USD") -> str:
+    exponent = Decimal('1') if currency_code in ZERO_DECIMAL_CURRENCIES else Decimal('0.01')
+    return str(Decimal(str(value)).quantize(exponent, rounding=ROUND_HALF_UP))
+
+
+def get_items_total(items: list, currency_code: str = "USD") -> Decimal:
+    return sum(
+        (Decimal(format_amount(item["unit_amount"], currency_code)) * int(item.get("quantity", 1)) for item in items),
+        Decimal(0)
+    )
+
+
+def build_order_data(price=None, currency_code: str = "USD", items: list = None, custom_id: str = None):
+    """
+    Items are {"name", "unit_amount", "quantity"[, "sku", "description", "category"]}, the order amount is then
+    their total and `price` is ignored.
+    """
+    purchase_unit = {}
+    if items:
+        price = get_items_total(items, currency_code)
+        purchase_unit["items"] = [
+            {
+                **{key: item[key] for key in ("sku", "description", "category") if item.get(key)},
+                "name": item["name"],
+                "quantity": str(int(item.get("quantity", 1))),
+                "unit_amount": {
+                    "currency_code": currency_code,
+                    "value": format_amount(item["unit_amount"], currency_code)
                 }
-            ],
-            "application_context": {
-                "shipping_preference": "NO_SHIPPING"
+            } for item in items
+        ]
+    if custom_id:
+        purchase_unit["custom_id"] = custom_id
+
+    value = format_amount(price, currency_code)
+    purchase_unit["amount"] = {
+        "currency_code": currency_code,
+        "value": value,
+        "breakdown": {
+            "item_total": {
+                "currency_code": currency_code,
+                "value": value
             }
-        })
+        },
+    }
+    return {
+        "intent": "CAPTURE",
+        "purchase_units": [purchase_unit],
+        "application_context": {
+            "shipping_preference": "NO_SHIPPING"
+        }
+    }
 
-        response = self.client.execute(create_order)
-        data = response.result.__dict__['_dict']
 
-        return data
+class PayPalOrder(PayPalHelper):
+    # Orders v2 REST API on the pooled session, the checkout SDK client opens a new connection per call
+    priority = Priority.CHECKOUT
 
-    def capture_order(self, order_id):
-        capture_order = OrdersCaptureRequest(order_id)
+    def create_order(self, price=None, currency_code: str = "USD", items: list = None, custom_id: str = None,
+                     request_id: str = None) -> UpdateResult:
+        res = self.request(
+            "POST",
+            self.orders_url,
+            headers={**RETURN_REPRESENTATION, **(self.get_idempotency_headers(request_id) or {})},
+            json=build_order_data(price, currency_code, items, custom_id)
+        )
+        return build_update_result(res)
 
-        response = self.client.execute(capture_order)
-        data = response.result.__dict__['_dict']
+    def get_order(self, order_id):
+        return decode(self.request(
+            "GET",
+            f"{self.orders_url}/{order_id}"
+        ))
 
-        return data
+    def capture_order(self, order_id, request_id: str = None) -> UpdateResult:
+        # A repeated capture with the same request_id returns the first capture instead of charging again
+        res = self.request(
+            "POST",
+            f"{self.orders_url}/{order_id}/capture",
+            headers={**RETURN_REPRESENTATION, **(self.get_idempotency_headers(request_id) or {})}
+        )
+        return build_update_result(res)
@@ -1,46 +1,47 @@
-import requests
-
-from paypal.utils.base import PayPalHelper
+from paypal.utils.base import (
+    PayPalHelper,
+    UpdateResult,
+    RETURN_REPRESENTATION,
+    build_patch_data,
+    build_update_result
+)
+from paypal.utils.response import decode
 
 
 class PayPalProduct(PayPalHelper):
+    # Largest page size the catalog products API accepts
+    max_page_size = 20
+
     def get_products(self):
-        res = requests.get(
-            self.products_url,
-            headers=self.get_request_headers()
-        )
-        return res.json().get('products', [])
+        return self.get_resource("product").get('products', [])
+
+    def iter_products(self, page_size: int = max_page_size, full: bool = False):
+        headers = {"Prefer": "return=representation"} if full else None
+        return self.paginate(self.products_url, 'products', page_size=page_size, headers=headers)
 
     def get_product(self, product_id):
         # id: PROD-47M73937LE218162X
-        res = requests.get(
-            f"{self.products_url}/{product_id}",
-            headers=self.get_request_headers()
-        )
-        return res.json()
+        return self.get_resource("product", product_id)
 
-    def create_product(self, data):
+    def create_product(self, data, request_id: str = None):
         # If creating a product succeeds, it triggers the CATALOG.PRODUCT.CREATED webhook
-        res = requests.post(
+        res = self.request(
+            "POST",
             self.products_url,
-            headers=self.get_request_headers(),
+            headers=self.get_idempotency_headers(request_id),
             json=data
         )
-        return res.json()
+        return decode(res)
 
-    def update_product(self, prod_id, paths: dict):
+    def update_product(self, prod_id, paths: dict) -> UpdateResult:
         """
         Can update these fields [description, category, image_url, home_url]
         """
-        data: list = list()
-        for path, value in paths.items():
-            data.append({
-                "op": "replace",
-                "path": path,
-                "value": value
-            })
-        requests.patch(
+        data = build_patch_data(paths)
+        res = self.request(
+            "PATCH",
             f"{self.products_url}/{prod_id}",
-            headers=self.get_request_headers(),
+            headers=RETURN_REPRESENTATION,
             json=data
         )
+        return build_update_result(res)
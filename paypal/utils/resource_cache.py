@@ -0,0 +1,139 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Seconds a cached GET response is used per resource type, PAYPAL_RESOURCE_CACHE_TTLS overrides them
+DEFAULT_TTLS = {
+    "product": 60 * 60,
+    "plan": 60 * 60,
+    "subscription": 60,
+}
+# Key of the first page of a list endpoint, dropped with every resource of its type
+LIST_KEY = "list"
+
+
+class ResourceCache:
+    """
+    Read-through cache of the PayPal GET responses of one resource type.
+    Response bodies are kept as bytes, in a bounded in-process LRU in front of a Django cache, and decoded on
+    every hit so a caller can't change what the next one reads.
+    Entries are dropped on our own writes (PayPalHelper.request) and on webhook events (paypal.webhook.handlers).
+    Other processes keep their in-process copy for at most local_ttl seconds after that.
+    """
+
+    def __init__(self, resource: str, ttl: int, cache_alias: str = 'default', maxsize: int = 1024,
+                 local_ttl: int = 30):
+        self.resource = resource
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.maxsize = maxsize
+        self.local_ttl = min(local_ttl, ttl)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Bumped by every invalidation, a response fetched before it is not cached
+        self.generation = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, base_url: str, resource_id: str = None) -> str:
+        digest = hashlib.sha1(base_url.encode()).hexdigest()[:12]
+        return f"paypal:resource:{digest}:{self.resource}:{resource_id or LIST_KEY}"
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        content = self.cache.get(key)
+        with self.lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.shared_hits += 1
+                self._put(key, content, now)
+        return content
+
+    def set(self, key: str, content: bytes, generation: int):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self._put(key, content, time.monotonic())
+        self.cache.set(key, content, self.ttl)
+
+    def _put(self, key: str, content: bytes, now: float):
+        self.entries[key] = (now + self.local_ttl, content)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, base_url: str, *resource_ids):
+        keys = [self.key(base_url, resource_id) for resource_id in resource_ids if resource_id]
+        keys.append(self.key(base_url))
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+        self.cache.delete_many(keys)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+                "maxsize": self.maxsize
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    # Opt-in: PAYPAL_RESOURCE_CACHE names the Django cache to use
+    return bool(getattr(settings, 'PAYPAL_RESOURCE_CACHE', ''))
+
+
+def get_resource_cache(resource: str) -> ResourceCache:
+    cache = _caches.get(resource)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(resource)
+            if cache is None:
+                ttls = {**DEFAULT_TTLS, **getattr(settings, 'PAYPAL_RESOURCE_CACHE_TTLS', {})}
+                cache = _caches[resource] = ResourceCache(
+                    resource,
+                    ttls[resource],
+                    cache_alias=getattr(settings, 'PAYPAL_RESOURCE_CACHE', '') or 'default',
+                    maxsize=getattr(settings, 'PAYPAL_RESOURCE_CACHE_SIZE', 1024),
+                    local_ttl=getattr(settings, 'PAYPAL_RESOURCE_CACHE_LOCAL_TTL', 30)
+                )
+    return cache
+
+
+def invalidate(base_url: str, resource: str, *resource_ids):
+    if is_enabled():
+        get_resource_cache(resource).invalidate(base_url, *resource_ids)
+
+
+def get_cache_stats() -> dict:
+    """
+    Counters per resource type of this process, e.g.
+    {"plan": {"hits": 950, "shared_hits": 12, "misses": 38, "size": 40, "maxsize": 1024}}
+    `hits` are answered in-process, `shared_hits` by the Django cache, `misses` went to PayPal.
+    """
+    return {resource: cache.get_stats() for resource, cache in list(_caches.items())}
@@ -0,0 +1,60 @@
+import json
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# PayPal bodies are UTF-8 JSON. They are decoded straight from the response bytes, with orjson when it is
+# installed, instead of response.json() which first guesses the encoding and builds a str.
+
+
+def loads(content: bytes):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def decode(response):
+    # Body of a requests or httpx response, {} when it is empty. Raises ValueError when it isn't JSON.
+    content = response.content
+    return loads(content) if content else {}
+
+
+class CaptureView:
+    __slots__ = ('id', 'status', 'currency_code', 'value', 'create_time')
+
+    def __init__(self, data: dict):
+        amount = data.get('amount') or {}
+        self.id = data['id']
+        self.status = data.get('status', '')
+        self.currency_code = amount.get('currency_code')
+        self.value = Decimal(str(amount['value'])) if amount.get('value') is not None else None
+        self.create_time = data.get('create_time')
+
+
+class OrderView:
+    """
+    The fields of an Orders v2 response the checkout reads, the rest of the body is not kept.
+    Captures are only collected when they are first read.
+    """
+    __slots__ = ('id', 'status', 'links', '_purchase_units', '_captures')
+
+    def __init__(self, data: dict):
+        self.id = data.get('id')
+        self.status = data.get('status')
+        self.links = data.get('links', [])
+        self._purchase_units = data.get('purchase_units', [])
+        self._captures = None
+
+    @property
+    def captures(self) -> list:
+        if self._captures is None:
+            self._captures = [
+                CaptureView(capture)
+                for unit in self._purchase_units
+                for capture in (unit.get('payments') or {}).get('captures', [])
+            ]
+            self._purchase_units = None
+        return self._captures
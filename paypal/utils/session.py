@@ -0,0 +1,85 @@
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_timeout():
+    # (connect, read) in seconds
+    return (
+        getattr(settings, 'PAYPAL_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'PAYPAL_READ_TIMEOUT', 30)
+    )
+
+
+def build_session() -> requests.Session:
+    retry = Retry(
+        total=getattr(settings, 'PAYPAL_MAX_RETRIES', 3),
+        backoff_factor=getattr(settings, 'PAYPAL_RETRY_BACKOFF', 0.5),
+        status_forcelist=(429, 500, 502, 503, 504),
+        # Only idempotent methods are retried, POST/PATCH could be applied twice
+        allowed_methods=frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=getattr(settings, 'PAYPAL_POOL_CONNECTIONS', 4),
+        pool_maxsize=getattr(settings, 'PAYPAL_POOL_MAXSIZE', 20),
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    # One keep-alive session per process, shared by every PayPalHelper
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def close_session():
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_pool_stats() -> dict:
+    """
+    Connection pool usage per host, e.g.
+    {"https://api-m.paypal.com:443": {"connections_opened": 3, "requests": 120, "idle": 2, "maxsize": 20}}
+    """
+    stats = {}
+    if _session is None:
+        return stats
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # The pool queue is pre-filled with None placeholders, only real entries are idle connections
+            idle = [conn for conn in list(pool.pool.queue) if conn is not None] if pool.pool is not None else []
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": len(idle),
+                "maxsize": pool.pool.maxsize if pool.pool is not None else 0
+            }
+    return stats
@@ -1,19 +1,43 @@
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
-from paypal.utils.base import PayPalHelper
+from paypal.utils.base import PayPalHelper, UpdateResult, build_update_result
+from paypal.utils.bulk import Checkpoint, run_bulk
+from paypal.utils.response import decode
 
 User = get_user_model()
 
 
+def format_time(value: datetime) -> str:
+    # PayPal wants UTC in the form 2021-01-01T00:00:00.000Z
+    return value.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def split_windows(start_time: datetime, end_time: datetime, window: timedelta):
+    while start_time < end_time:
+        window_end = min(start_time + window, end_time)
+        yield start_time, window_end
+        start_time = window_end
+
+
 class PayPalSubscription(PayPalHelper):
+    # Largest page size the transactions API accepts
+    max_page_size = 20
+
+    # PayPal requires a reason for every status change
+    default_reasons = {
+        "cancel": "Cancelled by the merchant",
+        "activate": "Reactivated by the merchant",
+        "suspend": "Suspended by the merchant",
+    }
+
     def get_subscription(self, subscription_id):
         # I-BW452GLLEP1G
-        res = requests.get(
-            url=f"{self.subscription_url}/{subscription_id}",
-            headers=self.get_request_headers()
-        )
-        return res.json()
+        return self.get_resource("subscription", subscription_id)
 
     def update_subscription(self):
         # If subscription update succeeds, it triggers the BILLING.SUBSCRIPTION.UPDATED webhook.
@@ -23,29 +47,122 @@ class PayPalSubscription(PayPalHelper):
         """
         pass
 
-    def cancel_subscription(self, subscription_id):
+    def cancel_subscription(self, subscription_id, reason: str = None) -> UpdateResult:
         # If subscription cancellation succeeds, it triggers the BILLING.SUBSCRIPTION.CANCELLED webhook.
-        requests.post(
-            url=f"{self.subscription_url}/{subscription_id}/cancel",
-            headers=self.get_request_headers()
+        res = self.request(
+            "POST",
+            f"{self.subscription_url}/{subscription_id}/cancel",
+            json={
+                "reason": reason or self.default_reasons["cancel"]
+            }
         )
+        return build_update_result(res)
 
-    def activate_subscription(self, subscription_id):
+    def activate_subscription(self, subscription_id, reason: str = None) -> UpdateResult:
         # If activate subscription succeeds, it triggers the BILLING.SUBSCRIPTION.ACTIVATED webhook.
-        requests.post(
-            url=f"{self.subscription_url}/{subscription_id}/activate",
-            headers=self.get_request_headers()
+        res = self.request(
+            "POST",
+            f"{self.subscription_url}/{subscription_id}/activate",
+            json={
+                "reason": reason or self.default_reasons["activate"]
+            }
         )
+        return build_update_result(res)
 
-    def suspend_subscription(self, subscription_id):
+    def suspend_subscription(self, subscription_id, reason: str = None) -> UpdateResult:
         # If subscription suspension succeeds, it triggers the BILLING.SUBSCRIPTION.SUSPENDED webhook.
-        requests.post(
-            url=f"{self.subscription_url}/{subscription_id}/suspend",
-            headers=self.get_request_headers()
+        res = self.request(
+            "POST",
+            f"{self.subscription_url}/{subscription_id}/suspend",
+            json={
+                "reason": reason or self.default_reasons["suspend"]
+            }
         )
+        return build_update_result(res)
 
-    def get_transactions(self, subscription_id):
-        return requests.get(
-            url=f"{self.subscription_url}/{subscription_id}/transactions",
-            heeaders=self.get_request_headers()
+    def get_transactions(self, subscription_id, start_time: datetime, end_time: datetime = None):
+        res = self.request(
+            "GET",
+            f"{self.subscription_url}/{subscription_id}/transactions",
+            params={
+                "start_time": format_time(start_time),
+                "end_time": format_time(end_time or timezone.now())
+            }
         )
+        return decode(res)
+
+    def iter_window_transactions(self, subscription_id, start_time: datetime, end_time: datetime,
+                                 page_size: int = max_page_size):
+        # Lazily pages through the transactions of one time window
+        return self.paginate(
+            f"{self.subscription_url}/{subscription_id}/transactions",
+            'transactions',
+            page_size=page_size,
+            params={
+                "start_time": format_time(start_time),
+                "end_time": format_time(end_time)
+            }
+        )
+
+    def iter_transactions(self, subscription_id, start_time: datetime, end_time: datetime = None,
+                          window: timedelta = timedelta(days=30), concurrency: int = 1):
+        """
+        Yields the transactions of a subscription between start_time and end_time, oldest window first.
+        The range is split into `window` sized sub-ranges. With concurrency > 1 that many windows are fetched
+        in parallel, so memory stays bounded by `concurrency` windows instead of the whole range.
+        """
+        windows = split_windows(start_time, end_time or timezone.now(), window)
+        if concurrency <= 1:
+            for window_start, window_end in windows:
+                yield from self.iter_window_transactions(subscription_id, window_start, window_end)
+            return
+
+        def fetch(bounds):
+            return list(self.iter_window_transactions(subscription_id, *bounds))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = deque()
+            for bounds in windows:
+                pending.append(executor.submit(fetch, bounds))
+                if len(pending) >= concurrency:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def bulk_update_status(self, action: str, subscription_ids, reason: str = None, concurrency: int = 8,
+                           max_retries: int = 5, checkpoint_path: str = None, checkpoint: Checkpoint = None):
+        """
+        Runs `action` ("cancel", "suspend" or "activate") for every subscription id of the iterable.
+        Yields a BulkResult per subscription as the calls complete, 429/503 answers are retried after Retry-After.
+        With `checkpoint_path` the run can be stopped and started again, subscriptions already done are skipped.
+        An open `checkpoint` is only used to skip them, the caller records the results in it.
+        """
+        call = {
+            "cancel": self.cancel_subscription,
+            "suspend": self.suspend_subscription,
+            "activate": self.activate_subscription,
+        }[action]
+        owned = checkpoint is None and checkpoint_path is not None
+        if owned:
+            checkpoint = Checkpoint(checkpoint_path)
+        try:
+            yield from run_bulk(
+                lambda subscription_id: call(subscription_id, reason),
+                subscription_ids,
+                concurrency=concurrency,
+                max_retries=max_retries,
+                checkpoint=checkpoint,
+                record=owned
+            )
+        finally:
+            if owned:
+                checkpoint.close()
+
+    def bulk_cancel(self, subscription_ids, **kwargs):
+        return self.bulk_update_status("cancel", subscription_ids, **kwargs)
+
+    def bulk_suspend(self, subscription_ids, **kwargs):
+        return self.bulk_update_status("suspend", subscription_ids, **kwargs)
+
+    def bulk_activate(self, subscription_ids, **kwargs):
+        return self.bulk_update_status("activate", subscription_ids, **kwargs)
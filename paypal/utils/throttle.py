@@ -0,0 +1,314 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from enum import IntEnum
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+
+class Priority(IntEnum):
+    BULK = 0
+    NORMAL = 1
+    CHECKOUT = 2
+
+
+# Share of the rate a priority may use, what lower priorities leave free is kept for the higher ones
+DEFAULT_SHARES = {
+    Priority.BULK: 0.5,
+    Priority.NORMAL: 0.8,
+    Priority.CHECKOUT: 1.0,
+}
+
+
+class RateLimited(requests.RequestException):
+    # No token was free within max_wait
+    pass
+
+
+class CircuitOpen(requests.RequestException):
+    # PayPal is failing or slow on this endpoint family, calls fail fast until the breaker probes again
+    pass
+
+
+class TokenBucket:
+    """
+    Limits outbound calls to `rate` per second across every process sharing the Django cache.
+    The bucket is refilled every second: a counter per second, taken with cache.incr() which is atomic on the
+    shared backends. A priority only takes tokens while the counter is below its share of the rate, so bulk
+    work stops at half the rate and leaves the rest to admin and checkout traffic.
+    """
+
+    def __init__(self, rate: float, cache_alias: str = 'default', max_wait: float = 10, shares: dict = None):
+        self.rate = rate
+        self.cache_alias = cache_alias
+        self.max_wait = max_wait
+        self.shares = {**DEFAULT_SHARES, **(shares or {})}
+        self.waits = 0
+        self.rejections = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def key(window: int) -> str:
+        return f"paypal:rate:{window}"
+
+    def take(self, window: int, limit: float) -> bool:
+        key = self.key(window)
+        self.cache.add(key, 0, 5)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            return False
+        if count <= limit:
+            return True
+        # Not taken, the token stays free for a higher priority
+        self.cache.decr(key)
+        return False
+
+    def poll(self, limit: float, deadline: float) -> float:
+        # 0 once a token is taken, otherwise the seconds to wait before trying again
+        now = time.time()
+        if self.take(int(now), limit):
+            return 0
+        if now >= deadline:
+            self.rejections += 1
+            raise RateLimited(f"No PayPal rate limit token within {self.max_wait}s")
+        self.waits += 1
+        # Next refill, spread over a few ms so waiting workers don't all retry at once
+        return min(int(now) + 1 - now + random.uniform(0, 0.01), deadline - now + 0.001)
+
+    def acquire(self, priority: int = Priority.NORMAL):
+        limit = self.rate * self.shares.get(priority, 1.0)
+        deadline = time.time() + self.max_wait
+        while True:
+            wait = self.poll(limit, deadline)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, priority: int = Priority.NORMAL):
+        # acquire() for the asyncio helpers, the event loop keeps running while waiting for a token
+        limit = self.rate * self.shares.get(priority, 1.0)
+        deadline = time.time() + self.max_wait
+        while True:
+            wait = self.poll(limit, deadline)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        # PayPal answered 429, every priority waits until Retry-After has passed
+        seconds = min(seconds, 60)
+        now = int(time.time())
+        blocked = self.rate * max(self.shares.values()) + 1
+        self.cache.set_many({self.key(window): blocked for window in range(now, now + int(seconds) + 1)}, 5 + seconds)
+
+    def get_stats(self) -> dict:
+        return {"rate": self.rate, "waits": self.waits, "rejections": self.rejections}
+
+
+class CircuitBreaker:
+    """
+    Per process breaker of one endpoint family. It opens when at least `failure_ratio` of the last
+    `window` calls failed (exception, 5xx or slower than `slow_call_seconds`) and fails calls fast for
+    `open_seconds`. Then one call at a time is let through, the first success closes it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 10, failure_ratio: float = 0.5,
+                 slow_call_seconds: float = 10, open_seconds: float = 30):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejections = 0
+
+    def before_call(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+            self.rejections += 1
+        raise CircuitOpen(f"PayPal {self.name} circuit is open")
+
+    def release(self):
+        # The call let through was never made, another one may probe
+        with self.lock:
+            self.probing = False
+
+    def record(self, failed: bool):
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.probing = False
+                if failed:
+                    self.state, self.opened_at = self.OPEN, time.monotonic()
+                else:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                return
+
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= self.min_calls and sum(self.outcomes) >= self.failure_ratio * len(self.outcomes):
+                self.state, self.opened_at = self.OPEN, time.monotonic()
+
+    def is_failure(self, response, duration: float) -> bool:
+        return response.status_code >= 500 or duration > self.slow_call_seconds
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "state": self.state,
+                "calls": len(self.outcomes),
+                "failures": sum(self.outcomes),
+                "rejections": self.rejections
+            }
+
+
+_bucket = None
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_endpoint_family(url: str) -> str:
+    # "https://api-m.paypal.com/v1/billing/plans/P-1/activate" -> "v1/billing/plans"
+    return '/'.join(urlsplit(url).path.strip('/').split('/')[:3])
+
+
+def get_token_bucket():
+    # None unless PAYPAL_RATE_LIMIT (calls per second) is set, use a shared cache to limit all processes together
+    global _bucket
+
+    rate = getattr(settings, 'PAYPAL_RATE_LIMIT', 0)
+    if not rate:
+        return None
+    if _bucket is None:
+        with _lock:
+            if _bucket is None:
+                _bucket = TokenBucket(
+                    rate,
+                    cache_alias=getattr(settings, 'PAYPAL_RATE_LIMIT_CACHE', 'default'),
+                    max_wait=getattr(settings, 'PAYPAL_RATE_LIMIT_MAX_WAIT', 10)
+                )
+    return _bucket
+
+
+def get_breaker(url: str):
+    if not getattr(settings, 'PAYPAL_CIRCUIT_BREAKER', True):
+        return None
+    family = get_endpoint_family(url)
+    breaker = _breakers.get(family)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(family)
+            if breaker is None:
+                breaker = _breakers[family] = CircuitBreaker(
+                    family, **getattr(settings, 'PAYPAL_CIRCUIT_BREAKER_OPTIONS', {})
+                )
+    return breaker
+
+
+def record(breaker, bucket, response, started: float):
+    if breaker is not None:
+        breaker.record(breaker.is_failure(response, time.monotonic() - started))
+    if bucket is not None and response.status_code == 429:
+        retry_after = response.headers.get('Retry-After')
+        bucket.pause(float(retry_after) if retry_after and retry_after.isdigit() else 1)
+
+
+def send(url: str, call, priority: int = Priority.NORMAL):
+    """
+    Returns call() -> response once a rate limit token is free and the endpoint family's breaker lets it through.
+    Raises RateLimited or CircuitOpen (both requests.RequestException) instead of calling PayPal.
+    """
+    breaker = get_breaker(url)
+    bucket = get_token_bucket()
+    if breaker is not None:
+        # Checked before waiting for a token, a refused call mustn't use one
+        breaker.before_call()
+    if bucket is not None:
+        try:
+            bucket.acquire(priority)
+        except BaseException:
+            # Refused, cancelled or the cache failed: nothing was sent, another call may probe
+            if breaker is not None:
+                breaker.release()
+            raise
+
+    started = time.monotonic()
+    try:
+        response = call()
+    except Exception:
+        if breaker is not None:
+            breaker.record(True)
+        raise
+    except BaseException:
+        # Cancelled or interrupted, that says nothing about PayPal
+        if breaker is not None:
+            breaker.release()
+        raise
+    record(breaker, bucket, response, started)
+    return response
+
+
+async def send_async(url: str, call, priority: int = Priority.NORMAL):
+    """
+    send() for the asyncio helpers, `call` is a coroutine function returning the httpx response.
+    Takes from the same token bucket and breakers, a rejected call raises the same exceptions.
+    """
+    breaker = get_breaker(url)
+    bucket = get_token_bucket()
+    if breaker is not None:
+        breaker.before_call()
+    if bucket is not None:
+        try:
+            await bucket.acquire_async(priority)
+        except BaseException:
+            # Refused, cancelled or the cache failed: nothing was sent, another call may probe
+            if breaker is not None:
+                breaker.release()
+            raise
+
+    started = time.monotonic()
+    try:
+        response = await call()
+    except Exception:
+        if breaker is not None:
+            breaker.record(True)
+        raise
+    except BaseException:
+        # Cancelled or interrupted, that says nothing about PayPal
+        if breaker is not None:
+            breaker.release()
+        raise
+    record(breaker, bucket, response, started)
+    return response
+
+
+def get_throttle_stats() -> dict:
+    bucket = _bucket
+    return {
+        "rate_limit": bucket.get_stats() if bucket is not None else None,
+        "breakers": {family: breaker.get_stats() for family, breaker in list(_breakers.items())}
+    }
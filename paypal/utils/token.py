@@ -0,0 +1,191 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class AccessToken:
+    __slots__ = ('value', 'expires_at')
+
+    def __init__(self, value: str, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+    def is_expired(self, margin: float = 0) -> bool:
+        return time.time() + margin >= self.expires_at
+
+
+class BaseTokenStore:
+    """
+    Shared store for PayPal OAuth tokens.
+    Subclasses implement get/set/delete and a (possibly cross-process) lock.
+    """
+
+    def __init__(self, refresh_margin: float = 300, **kwargs):
+        # Tokens are refreshed this many seconds before PayPal expires them
+        self.refresh_margin = refresh_margin
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, token: AccessToken):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def acquire(self, key: str, blocking: bool = True) -> bool:
+        raise NotImplementedError
+
+    def release(self, key: str):
+        raise NotImplementedError
+
+    def _is_usable(self, token, rejected):
+        return token is not None and token.value != rejected and not token.is_expired()
+
+    def get_token(self, key: str, fetch, rejected: str = None) -> str:
+        """
+        Returns a valid token for `key`, calling `fetch()` -> (token, expires_in) when needed.
+        Only one caller refreshes at a time; `rejected` is a token PayPal answered 401 for.
+        """
+        token = self.get(key)
+        if self._is_usable(token, rejected):
+            if not token.is_expired(self.refresh_margin):
+                return token.value
+            # Token is still valid but close to expiry, refresh it unless someone else already is
+            if not self.acquire(key, blocking=False):
+                return token.value
+        else:
+            self.acquire(key)
+
+        try:
+            token = self.get(key)
+            if self._is_usable(token, rejected) and not token.is_expired(self.refresh_margin):
+                return token.value
+
+            value, expires_in = fetch()
+            token = AccessToken(value, time.time() + expires_in)
+            self.set(key, token)
+            return token.value
+        finally:
+            self.release(key)
+
+
+class LocalTokenStore(BaseTokenStore):
+    # Thread-safe, per process
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._tokens = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        return self._tokens.get(key)
+
+    def set(self, key, token):
+        self._tokens[key] = token
+
+    def delete(self, key):
+        self._tokens.pop(key, None)
+
+    def acquire(self, key, blocking=True):
+        return self._lock_for(key).acquire(blocking)
+
+    def release(self, key):
+        self._lock_for(key).release()
+
+
+class CacheTokenStore(LocalTokenStore):
+    """
+    Shares tokens between processes through Django's cache framework.
+    The refresh lock is taken in-process first and then with cache.add() across processes.
+    """
+
+    def __init__(self, cache_alias: str = 'default', lock_timeout: float = 10, poll_interval: float = 0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_alias = cache_alias
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._owned = set()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get(self, key):
+        token = super().get(key)
+        if token is not None and not token.is_expired(self.refresh_margin):
+            return token
+
+        data = self.cache.get(key)
+        if data is None:
+            return token
+        token = AccessToken(*data)
+        super().set(key, token)
+        return token
+
+    def set(self, key, token):
+        super().set(key, token)
+        timeout = max(int(token.expires_at - time.time()), 1)
+        self.cache.set(key, (token.value, token.expires_at), timeout)
+
+    def delete(self, key):
+        super().delete(key)
+        self.cache.delete(key)
+
+    def acquire(self, key, blocking=True):
+        if not super().acquire(key, blocking):
+            return False
+
+        lock_key = f"{key}:lock"
+        deadline = time.time() + self.lock_timeout
+        while not self.cache.add(lock_key, 1, int(self.lock_timeout)):
+            if not blocking:
+                super().release(key)
+                return False
+            if time.time() >= deadline:
+                # Lock holder died or is too slow, go ahead without it
+                return True
+            time.sleep(self.poll_interval)
+            token = self.get(key)
+            if token is not None and not token.is_expired(self.refresh_margin):
+                # Another process refreshed the token while we were waiting
+                return True
+        self._owned.add(key)
+        return True
+
+    def release(self, key):
+        if key in self._owned:
+            self._owned.discard(key)
+            self.cache.delete(f"{key}:lock")
+        super().release(key)
+
+
+_token_store = None
+_token_store_lock = threading.Lock()
+
+
+def get_token_store() -> BaseTokenStore:
+    global _token_store
+
+    if _token_store is None:
+        with _token_store_lock:
+            if _token_store is None:
+                store_class = import_string(
+                    getattr(settings, 'PAYPAL_TOKEN_STORE', 'paypal.utils.token.LocalTokenStore')
+                )
+                _token_store = store_class(**getattr(settings, 'PAYPAL_TOKEN_STORE_OPTIONS', {}))
+    return _token_store
+
+
+def get_token_key(base_url: str, client_id: str) -> str:
+    digest = hashlib.sha1(f"{base_url}|{client_id}".encode()).hexdigest()
+    return f"paypal:access-token:{digest}"
@@ -1,14 +1,46 @@
-from django.views.generic import View, TemplateView
+from django.http import Http404
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.generic import TemplateView
 
-from paypal.models import BillingPlan
+from paypal import plans
 
 
+def get_plan(request, plan_id: str = None):
+    # Resolved once per request, the condition checks and the view all need it
+    if not hasattr(request, '_paypal_plan'):
+        plan = plans.get_active_plan(plan_id or request.GET.get('plan_id'))
+        if plan is None:
+            raise Http404("No active billing plan")
+        request._paypal_plan = plan
+    return request._paypal_plan
+
+
+def get_plan_etag(request, plan_id: str = None, **kwargs) -> str:
+    plan_id, last_modified = get_plan(request, plan_id)
+    return f"{plan_id}-{int(last_modified.timestamp())}"
+
+
+def get_plan_last_modified(request, plan_id: str = None, **kwargs):
+    return get_plan(request, plan_id)[1]
+
+
+@method_decorator(condition(etag_func=get_plan_etag, last_modified_func=get_plan_last_modified), name='dispatch')
 class SubscribeTemplateView(TemplateView):
+    """
+    Subscribe button for the active plan in the URL or ?plan_id=, the newest active plan without one.
+    The plan comes from paypal.plans' cache, a revisit is answered with 304 Not Modified until the plan changes.
+    """
     template_name = 'paypal/subscribe.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context.update({
-            "plan_id": BillingPlan.objects.first().plan_id
-        })
+        context.update({"plan_id": get_plan(self.request, kwargs.get('plan_id'))[0]})
         return context
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        # Browsers revalidate on every visit, an inactivated plan isn't shown from their cache
+        patch_cache_control(response, no_cache=True)
+        return response
@@ -0,0 +1,136 @@
+from paypal import plans
+from paypal.importers import (
+    chunked,
+    build_subscription_fields,
+    filter_in,
+    parse_time,
+    update_profile_validity,
+    LookupIndex,
+    SubscriptionSync,
+    LOOKUP_CHUNK_SIZE
+)
+from paypal.models import WebhookEvent, Product, BillingPlan, Subscription
+from paypal.utils import resource_cache
+from paypal.utils.base import get_base_url
+
+# Changes are written with bulk_update(), the model signals would send them back to PayPal.
+# Rows are only updated when the event is newer than what we hold, so replayed or late events are harmless.
+# An applier returns {resource id: error} for the resources it couldn't apply yet, their events are marked FAILED.
+
+
+def get_update_time(event: WebhookEvent):
+    resource = event.payload.get('resource', {})
+    try:
+        update_time = parse_time(resource.get('update_time'))
+    except ValueError:
+        # Well formed but impossible, e.g. month 13
+        update_time = None
+    return update_time or event.event_time or event.created_date
+
+
+def coalesce(events: list) -> dict:
+    # Latest event per resource id, the state it carries supersedes every older event of that resource
+    latest = {}
+    for event in events:
+        current = latest.get(event.resource_id)
+        if current is None or (get_update_time(event), event.id) >= (get_update_time(current), current.id):
+            latest[event.resource_id] = event
+    return latest
+
+
+def invalidate_cached(resource: str, events: list):
+    # PayPal changed these resources, whatever the resource cache holds of them is stale
+    resource_cache.invalidate(get_base_url(), resource, *{event.resource_id for event in events})
+
+
+def apply_latest(model, lookup_field: str, fields: list, build, events: list) -> list:
+    """
+    Applies the latest event of every resource to the rows with `lookup_field` equal to its resource id.
+    `build(resource)` returns the new values of `fields`. Returns the (instance, event) pairs that were updated.
+    """
+    latest = coalesce(events)
+    updated = []
+    for chunk in chunked(list(latest), LOOKUP_CHUNK_SIZE):
+        for instance in model.objects.filter(**{f"{lookup_field}__in": chunk}):
+            event = latest[getattr(instance, lookup_field)]
+            update_time = get_update_time(event)
+            if instance.update_time and instance.update_time >= update_time:
+                continue
+
+            for field, value in build(event.payload.get('resource', {})).items():
+                setattr(instance, field, value)
+            instance.update_time = update_time
+            updated.append((instance, event))
+
+    model.objects.bulk_update([instance for instance, event in updated], fields + ['update_time'], batch_size=500)
+    return updated
+
+
+def apply_products(events: list):
+    fields = ['name', 'description', 'category', 'image_url', 'home_url']
+    invalidate_cached("product", events)
+    apply_latest(
+        Product, 'product_id', fields,
+        lambda resource: {field: resource[field] for field in fields if field in resource},
+        events
+    )
+
+
+def apply_plans(events: list):
+    fields = ['name', 'description', 'status']
+    invalidate_cached("plan", events)
+    apply_latest(
+        BillingPlan, 'plan_id', fields,
+        lambda resource: {field: resource[field] for field in fields if field in resource},
+        events
+    )
+    plans.invalidate()
+
+
+def create_subscriptions(events: list) -> dict:
+    """
+    Creates the subscriptions of events that arrived before we had them locally, from the resource they carry.
+    Returns {subscription id: error} for the ones that can't be created yet (e.g. unknown plan). Their events
+    are marked FAILED, SubscriptionSync.reconcile() fetches those subscriptions again until they can be written.
+    """
+    latest = coalesce(events)
+    existing = {subscription_id for subscription_id, in filter_in(
+        Subscription.objects.all(), 'subscription_id', list(latest), 'subscription_id'
+    )}
+    resources = [
+        event.payload.get('resource', {}) for resource_id, event in latest.items() if resource_id not in existing
+    ]
+    if not resources:
+        return {}
+
+    errors = {}
+    sync = SubscriptionSync(on_error=lambda subscription_id, error: errors.__setitem__(subscription_id, error))
+    sync.lookups = LookupIndex()
+    sync.write([resource for resource in resources if resource.get('id')])
+    return errors
+
+
+def apply_subscriptions(events: list) -> dict:
+    fields = ['status', 'billing_info', 'next_billing_time']
+    invalidate_cached("subscription", events)
+    updated = apply_latest(Subscription, 'subscription_id', fields, build_subscription_fields, events)
+    update_profile_validity([subscription for subscription, event in updated])
+    return create_subscriptions(events)
+
+
+APPLIERS = {
+    'CATALOG.PRODUCT.CREATED': apply_products,
+    'CATALOG.PRODUCT.UPDATED': apply_products,
+    'BILLING.PLAN.CREATED': apply_plans,
+    'BILLING.PLAN.UPDATED': apply_plans,
+    'BILLING.PLAN.ACTIVATED': apply_plans,
+    'BILLING.PLAN.DEACTIVATED': apply_plans,
+    'BILLING.PLAN.PRICING-CHANGE.ACTIVATED': apply_plans,
+    'BILLING.SUBSCRIPTION.CREATED': apply_subscriptions,
+    'BILLING.SUBSCRIPTION.ACTIVATED': apply_subscriptions,
+    'BILLING.SUBSCRIPTION.UPDATED': apply_subscriptions,
+    'BILLING.SUBSCRIPTION.RE-ACTIVATED': apply_subscriptions,
+    'BILLING.SUBSCRIPTION.SUSPENDED': apply_subscriptions,
+    'BILLING.SUBSCRIPTION.CANCELLED': apply_subscriptions,
+    'BILLING.SUBSCRIPTION.EXPIRED': apply_subscriptions,
+}
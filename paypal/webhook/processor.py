@@ -0,0 +1,151 @@
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from paypal.importers import chunked, LOOKUP_CHUNK_SIZE
+from paypal.models import WebhookEvent
+from paypal.webhook.handlers import APPLIERS
+
+Status = WebhookEvent.Status
+
+
+class WebhookProcessor:
+    """
+    Processes stored webhook events in batches.
+    Events are partitioned by resource, so every resource is handled by one worker in event order while
+    different resources run in parallel. Within a partition only the latest event per resource is applied.
+    """
+
+    def __init__(self, batch_size: int = 500, workers: int = 4, stale_after: int = 600):
+        self.batch_size = max(batch_size, 1)
+        self.workers = max(workers, 1)
+        # Events left PROCESSING this long belong to a worker that died and are picked up again
+        self.stale_after = stale_after
+
+    def claim(self) -> list:
+        now = timezone.now()
+        WebhookEvent.objects.filter(
+            status=Status.PROCESSING,
+            modified_date__lt=now - timedelta(seconds=self.stale_after)
+        ).update(status=Status.RECEIVED)
+
+        with transaction.atomic():
+            ids = list(
+                WebhookEvent.objects.select_for_update(skip_locked=True).filter(
+                    status=Status.RECEIVED
+                ).order_by('id').values_list('id', flat=True)[:self.batch_size]
+            )
+            for chunk in chunked(ids, LOOKUP_CHUNK_SIZE):
+                WebhookEvent.objects.filter(id__in=chunk, status=Status.RECEIVED).update(
+                    status=Status.PROCESSING,
+                    attempts=F('attempts') + 1,
+                    modified_date=now
+                )
+
+        events = []
+        for chunk in chunked(ids, LOOKUP_CHUNK_SIZE):
+            events.extend(WebhookEvent.objects.filter(id__in=chunk, status=Status.PROCESSING))
+        return sorted(events, key=lambda event: event.id)
+
+    def partition(self, events: list) -> list:
+        # crc32 is stable across processes, unlike hash() of a str
+        partitions = [[] for _ in range(self.workers)]
+        for event in events:
+            key = f"{event.resource_type}:{event.resource_id}".encode()
+            partitions[zlib.crc32(key) % self.workers].append(event)
+        return [partition for partition in partitions if partition]
+
+    def process_batch(self) -> int:
+        events = self.claim()
+        partitions = self.partition(events)
+        # SQLite has a single writer, concurrent write transactions fail with "database is locked"
+        if len(partitions) <= 1 or connection.vendor == 'sqlite':
+            for partition in partitions:
+                self.process_partition(partition)
+        else:
+            with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+                list(executor.map(self._process_partition_in_thread, partitions))
+        return len(events)
+
+    def process_all(self) -> int:
+        processed = 0
+        while True:
+            count = self.process_batch()
+            processed += count
+            if count < self.batch_size:
+                return processed
+
+    def _process_partition_in_thread(self, events: list):
+        try:
+            self.process_partition(events)
+        finally:
+            close_old_connections()
+
+    def process_partition(self, events: list):
+        groups = {}
+        ignored = []
+        for event in events:
+            applier = APPLIERS.get(event.event_type)
+            if applier is None or not event.resource_id:
+                ignored.append(event.id)
+            else:
+                groups.setdefault(applier, []).append(event)
+
+        self.mark(ignored, Status.IGNORED)
+        for applier, group in groups.items():
+            try:
+                with transaction.atomic():
+                    errors = applier(group) or {}
+                    self.mark([event.id for event in group if event.resource_id not in errors], Status.PROCESSED)
+                    for event in group:
+                        if event.resource_id in errors:
+                            self.mark([event.id], Status.FAILED, errors[event.resource_id])
+            except Exception as e:
+                self.mark([event.id for event in group], Status.FAILED, f"{type(e).__name__} | {e}")
+
+    @staticmethod
+    def mark(ids: list, status: str, error: str = ''):
+        now = timezone.now()
+        for chunk in chunked(ids, LOOKUP_CHUNK_SIZE):
+            WebhookEvent.objects.filter(id__in=chunk).update(
+                status=status,
+                last_error=error,
+                processed_at=now if status != Status.FAILED else None,
+                modified_date=now
+            )
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_scheduled = False
+
+
+def process_in_background():
+    # Drains stored events on a background thread of this process, a burst of requests schedules a single drain
+    global _executor, _scheduled
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='paypal-webhook')
+        if _scheduled:
+            return
+        _scheduled = True
+    _executor.submit(_drain)
+
+
+def _drain():
+    global _scheduled
+
+    with _executor_lock:
+        # Events committed from now on schedule the next drain
+        _scheduled = False
+    try:
+        WebhookProcessor(workers=getattr(settings, 'PAYPAL_WEBHOOK_WORKERS', 4)).process_all()
+    finally:
+        close_old_connections()
@@ -0,0 +1,36 @@
+from django.core.exceptions import ValidationError
+from django.utils.dateparse import parse_datetime
+
+from paypal.utils.response import loads
+
+
+def parse_event(body: bytes) -> dict:
+    """
+    Maps a PayPal webhook body to WebhookEvent fields
+    https://developer.paypal.com/docs/api-basics/notifications/webhooks/notification-messages/
+    """
+    try:
+        payload = loads(body)
+    except ValueError:
+        raise ValidationError("Body is not valid JSON")
+
+    if not isinstance(payload, dict) or not payload.get('id') or not payload.get('event_type'):
+        raise ValidationError("Event id and event_type are required")
+
+    resource = payload.get('resource')
+    if not isinstance(resource, dict):
+        resource = {}
+
+    try:
+        event_time = parse_datetime(payload.get('create_time') or '')
+    except ValueError:
+        event_time = None
+
+    return {
+        "event_id": str(payload['id'])[:64],
+        "event_type": str(payload['event_type'])[:80],
+        "resource_type": str(payload.get('resource_type') or '')[:40],
+        "resource_id": str(resource.get('id') or '')[:160],
+        "event_time": event_time,
+        "payload": payload
+    }
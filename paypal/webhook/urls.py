@@ -1,7 +1,9 @@
 from django.urls import path
 
+from paypal.webhook.views import WebhookView
+
 app_name = 'paypal-webhook'
 
 urlpatterns = [
-
+    path('', WebhookView.as_view(), name='webhook')
 ]
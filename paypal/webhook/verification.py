@@ -0,0 +1,187 @@
+import base64
+import datetime
+import hashlib
+import re
+import threading
+import zlib
+from urllib.parse import urlparse
+
+import certifi
+import requests
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives import hashes
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from paypal.utils.session import get_session, get_timeout
+
+PEM_PATTERN = re.compile(rb'-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----', re.DOTALL)
+
+# Parsed and verified signing certificates per cert URL, shared by every request of the process
+_certificates = {}
+_certificates_lock = threading.Lock()
+_trusted_roots = None
+
+
+class WebhookVerificationError(Exception):
+    pass
+
+
+class CertificateUnavailable(WebhookVerificationError):
+    # PayPal's certificate couldn't be fetched, the event may be fine and is answered so that PayPal retries
+    pass
+
+
+def load_certificates(pem: bytes) -> list:
+    try:
+        return [x509.load_pem_x509_certificate(block) for block in PEM_PATTERN.findall(pem)]
+    except ValueError as e:
+        raise WebhookVerificationError(f"Malformed certificate | {e}")
+
+
+def get_trusted_roots() -> dict:
+    global _trusted_roots
+
+    if _trusted_roots is None:
+        with open(certifi.where(), 'rb') as f:
+            _trusted_roots = {cert.subject: cert for cert in load_certificates(f.read())}
+    return _trusted_roots
+
+
+def verify_issued_by(cert: x509.Certificate, issuer: x509.Certificate):
+    if cert.issuer != issuer.subject:
+        raise WebhookVerificationError(
+            f"{cert.subject.rfc4514_string()} is not issued by {issuer.subject.rfc4514_string()}"
+        )
+
+    public_key = issuer.public_key()
+    try:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(
+                cert.signature, cert.tbs_certificate_bytes, padding.PKCS1v15(), cert.signature_hash_algorithm
+            )
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_key.verify(cert.signature, cert.tbs_certificate_bytes, ec.ECDSA(cert.signature_hash_algorithm))
+        else:
+            raise WebhookVerificationError(f"Unsupported issuer key {type(public_key).__name__}")
+    except InvalidSignature:
+        raise WebhookVerificationError(f"Bad signature on {cert.subject.rfc4514_string()}")
+
+
+def verify_chain(certs: list):
+    """
+    Checks the leaf is a PayPal certificate, that every certificate is in its validity window
+    and that the chain ends in a root from the certifi bundle.
+    """
+    if not certs:
+        raise WebhookVerificationError("Empty certificate chain")
+
+    now = datetime.datetime.utcnow()
+    for cert in certs:
+        if not cert.not_valid_before <= now <= cert.not_valid_after:
+            raise WebhookVerificationError(f"{cert.subject.rfc4514_string()} is expired or not yet valid")
+
+    common_names = [attr.value for attr in certs[0].subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)]
+    if not any(name == 'paypal.com' or name.endswith('.paypal.com') for name in common_names):
+        raise WebhookVerificationError(f"Certificate is not issued to PayPal: {common_names}")
+
+    for cert, issuer in zip(certs, certs[1:]):
+        verify_issued_by(cert, issuer)
+
+    last = certs[-1]
+    root = get_trusted_roots().get(last.issuer)
+    if root is None:
+        raise WebhookVerificationError(f"Untrusted root {last.issuer.rfc4514_string()}")
+    if root.subject != last.subject:
+        verify_issued_by(last, root)
+
+
+def validate_cert_url(cert_url: str):
+    url = urlparse(cert_url or '')
+    host = url.hostname or ''
+    if url.scheme != 'https' or not (host == 'paypal.com' or host.endswith('.paypal.com')):
+        raise WebhookVerificationError(f"Refusing certificate from {cert_url}")
+
+
+def get_certificate(cert_url: str) -> x509.Certificate:
+    certificate = _certificates.get(cert_url)
+    if certificate is not None and certificate.not_valid_after > datetime.datetime.utcnow():
+        return certificate
+
+    with _certificates_lock:
+        certificate = _certificates.get(cert_url)
+        if certificate is not None and certificate.not_valid_after > datetime.datetime.utcnow():
+            return certificate
+
+        validate_cert_url(cert_url)
+        cache_key = f"paypal:webhook-cert:{hashlib.sha1(cert_url.encode()).hexdigest()}"
+        pem = cache.get(cache_key)
+        fetched = pem is None
+        if fetched:
+            try:
+                response = get_session().get(cert_url, timeout=get_timeout())
+                response.raise_for_status()
+            except requests.RequestException as e:
+                raise CertificateUnavailable(f"Fetching {cert_url} failed | {type(e).__name__} | {e}")
+            pem = response.content
+
+        certs = load_certificates(pem)
+        verify_chain(certs)
+        if fetched:
+            # Only a chain that checks out is shared, anything else is fetched again for the next event
+            cache.set(cache_key, pem, getattr(settings, 'PAYPAL_WEBHOOK_CERT_TTL', 24 * 60 * 60))
+        _certificates[cert_url] = certs[0]
+        return certs[0]
+
+
+def verify_transmission_time(transmission_time: str):
+    # A signed event is only accepted for a while after PayPal sent it, a captured one can't be replayed later
+    try:
+        # None when it isn't formatted as a datetime, ValueError when it is but isn't a valid one (month 13)
+        sent_at = parse_datetime(transmission_time or '')
+    except ValueError:
+        sent_at = None
+    if sent_at is None:
+        raise WebhookVerificationError(f"Malformed transmission time {transmission_time}")
+    if timezone.is_naive(sent_at):
+        sent_at = timezone.make_aware(sent_at, datetime.timezone.utc)
+
+    tolerance = getattr(settings, 'PAYPAL_WEBHOOK_TOLERANCE', 5 * 60)
+    if abs((timezone.now() - sent_at).total_seconds()) > tolerance:
+        raise WebhookVerificationError(f"Transmission time {transmission_time} is outside of {tolerance}s")
+
+
+def verify_signature(headers, body: bytes, webhook_id: str = None):
+    """
+    Verifies a webhook locally, see https://developer.paypal.com/docs/api/webhooks/v1/#verify-webhook-signature
+    The signed message is <transmission id>|<transmission time>|<webhook id>|<crc32 of the raw body>.
+    Raises WebhookVerificationError when the event can't be trusted, CertificateUnavailable when it can't be
+    checked right now.
+    """
+    webhook_id = webhook_id or getattr(settings, 'PAYPAL_WEBHOOK_ID', '')
+    transmission_id = headers.get('PAYPAL-TRANSMISSION-ID')
+    transmission_time = headers.get('PAYPAL-TRANSMISSION-TIME')
+    transmission_sig = headers.get('PAYPAL-TRANSMISSION-SIG')
+    cert_url = headers.get('PAYPAL-CERT-URL')
+    auth_algo = headers.get('PAYPAL-AUTH-ALGO', 'SHA256withRSA')
+
+    if not all([webhook_id, transmission_id, transmission_time, transmission_sig, cert_url]):
+        raise WebhookVerificationError("Missing webhook signature headers or PAYPAL_WEBHOOK_ID")
+    if auth_algo != 'SHA256withRSA':
+        raise WebhookVerificationError(f"Unsupported algorithm {auth_algo}")
+    verify_transmission_time(transmission_time)
+
+    message = f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(body)}".encode()
+    try:
+        signature = base64.b64decode(transmission_sig)
+    except ValueError:
+        raise WebhookVerificationError("Malformed signature")
+
+    try:
+        get_certificate(cert_url).public_key().verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+    except InvalidSignature:
+        raise WebhookVerificationError("Signature does not match")
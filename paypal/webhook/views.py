@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction, IntegrityError
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
+
+from paypal.models import WebhookEvent
+from paypal.webhook.processor import process_in_background
+from paypal.webhook.serializers import parse_event
+from paypal.webhook.verification import verify_signature, CertificateUnavailable, WebhookVerificationError
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class WebhookView(View):
+    """
+    Stores PayPal webhook events and answers right away, they are processed in the background.
+    PayPal retries an event until it gets a 2xx, retries of an event we already hold are acknowledged as duplicates.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        if getattr(settings, 'PAYPAL_WEBHOOK_VERIFY', True):
+            try:
+                verify_signature(request.headers, request.body)
+            except CertificateUnavailable as e:
+                # PayPal retries events that aren't answered with a 2xx
+                return JsonResponse({"error": str(e)}, status=503)
+            except WebhookVerificationError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+        try:
+            fields = parse_event(request.body)
+        except ValidationError as e:
+            return JsonResponse({"error": e.messages}, status=400)
+
+        try:
+            with transaction.atomic():
+                WebhookEvent.objects.create(**fields)
+                transaction.on_commit(process_in_background)
+        except IntegrityError:
+            return JsonResponse({"status": "duplicate"})
+        return JsonResponse({"status": "received"})
@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'paypal.entitlements.EntitlementMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -115,6 +116,66 @@ AUTH_PASSWORD_VALIDATORS = [
 PAYPAL_ENVIRONMENT = env.str('PAYPAL_ENVIRONMENT')
 PAYPAL_CLIENT_ID = env.str('PAYPAL_CLIENT_ID')
 PAYPAL_SECRET_KEY = env.str('PAYPAL_SECRET_KEY')
+# Overrides the sandbox/live API host, e.g. http://127.0.0.1:8765 for the run_paypal_sandbox server
+PAYPAL_BASE_URL = env.str('PAYPAL_BASE_URL', default='')
+
+# Use 'paypal.utils.token.CacheTokenStore' to share access tokens between processes
+PAYPAL_TOKEN_STORE = env.str('PAYPAL_TOKEN_STORE', default='paypal.utils.token.LocalTokenStore')
+
+# HTTP connection pool shared by all PayPal REST calls
+PAYPAL_POOL_MAXSIZE = env.int('PAYPAL_POOL_MAXSIZE', default=20)
+PAYPAL_CONNECT_TIMEOUT = env.float('PAYPAL_CONNECT_TIMEOUT', default=5)
+PAYPAL_READ_TIMEOUT = env.float('PAYPAL_READ_TIMEOUT', default=30)
+PAYPAL_MAX_RETRIES = env.int('PAYPAL_MAX_RETRIES', default=3)
+PAYPAL_ASYNC_MAX_CONNECTIONS = env.int('PAYPAL_ASYNC_MAX_CONNECTIONS', default=100)
+
+# Send outbox messages from a background thread after commit, disable when running process_paypal_outbox
+PAYPAL_OUTBOX_AUTO_PROCESS = env.bool('PAYPAL_OUTBOX_AUTO_PROCESS', default=True)
+
+# Billing plan admin actions call PayPal in parallel up to this many plans, larger selections go through the outbox
+PAYPAL_ADMIN_SYNC_LIMIT = env.int('PAYPAL_ADMIN_SYNC_LIMIT', default=50)
+PAYPAL_ADMIN_CONCURRENCY = env.int('PAYPAL_ADMIN_CONCURRENCY', default=8)
+
+# Webhook ID from the PayPal app settings, events are verified locally against PayPal's certificate
+PAYPAL_WEBHOOK_ID = env.str('PAYPAL_WEBHOOK_ID', default='')
+PAYPAL_WEBHOOK_VERIFY = env.bool('PAYPAL_WEBHOOK_VERIFY', default=True)
+# Seconds a signed event is accepted after its PAYPAL-TRANSMISSION-TIME, older ones are rejected as replays
+PAYPAL_WEBHOOK_TOLERANCE = env.int('PAYPAL_WEBHOOK_TOLERANCE', default=5 * 60)
+PAYPAL_WEBHOOK_WORKERS = env.int('PAYPAL_WEBHOOK_WORKERS', default=4)
+
+# Per-user subscription validity is cached here, use a shared cache backend when running several processes
+PAYPAL_ENTITLEMENT_CACHE = env.str('PAYPAL_ENTITLEMENT_CACHE', default='default')
+PAYPAL_ENTITLEMENT_CACHE_TTL = env.int('PAYPAL_ENTITLEMENT_CACHE_TTL', default=60 * 60)
+
+# Amount, Frequency and PricingScheme rows kept in memory per table and process
+PAYPAL_INTERN_CACHE_SIZE = env.int('PAYPAL_INTERN_CACHE_SIZE', default=1024)
+
+# Checkout orders are priced from this catalog, {sku: {"name", "unit_amount", "currency_code"}}, or from the
+# function PAYPAL_CHECKOUT_CATALOG points to (see paypal.checkout.catalog). Unknown skus are rejected.
+PAYPAL_CHECKOUT_CATALOG = env.str('PAYPAL_CHECKOUT_CATALOG', default='paypal.checkout.catalog.get_settings_items')
+PAYPAL_CHECKOUT_ITEMS = {}
+
+# Active billing plans for the subscribe page, dropped on every plan change
+PAYPAL_PLAN_CACHE = env.str('PAYPAL_PLAN_CACHE', default='default')
+PAYPAL_PLAN_CACHE_TTL = env.int('PAYPAL_PLAN_CACHE_TTL', default=60 * 60)
+
+# Read-through cache of product, plan and subscription GETs, off unless set to a cache alias (e.g. 'default').
+# TTLs in seconds per resource type, the in-process tier holds at most PAYPAL_RESOURCE_CACHE_SIZE entries per type
+PAYPAL_RESOURCE_CACHE = env.str('PAYPAL_RESOURCE_CACHE', default='')
+PAYPAL_RESOURCE_CACHE_TTLS = {"product": 60 * 60, "plan": 60 * 60, "subscription": 60}
+PAYPAL_RESOURCE_CACHE_SIZE = env.int('PAYPAL_RESOURCE_CACHE_SIZE', default=1024)
+PAYPAL_RESOURCE_CACHE_LOCAL_TTL = env.int('PAYPAL_RESOURCE_CACHE_LOCAL_TTL', default=30)
+
+# Outbound PayPal calls per second over all processes sharing PAYPAL_RATE_LIMIT_CACHE, 0 disables the limit.
+# Bulk work may use half of it and admin/outbox calls 80%, checkout all of it
+PAYPAL_RATE_LIMIT = env.float('PAYPAL_RATE_LIMIT', default=0)
+PAYPAL_RATE_LIMIT_CACHE = env.str('PAYPAL_RATE_LIMIT_CACHE', default='default')
+PAYPAL_RATE_LIMIT_MAX_WAIT = env.float('PAYPAL_RATE_LIMIT_MAX_WAIT', default=10)
+
+# Fail fast per endpoint family (e.g. v1/billing/plans) once PayPal errors or is slow, see paypal.utils.throttle
+PAYPAL_CIRCUIT_BREAKER = env.bool('PAYPAL_CIRCUIT_BREAKER', default=True)
+PAYPAL_CIRCUIT_BREAKER_OPTIONS = {"window": 20, "min_calls": 10, "failure_ratio": 0.5, "slow_call_seconds": 10,
+                                  "open_seconds": 30}
 
 
 # Internationalization